@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure the offload rate, accuracy and speed of the local classifier
+
+The classifier is trained on most of a labelled corpus, a directory
+with spam and ham subdirectories or a synthetic one, and the rest is
+classified with the strict thresholds a SpamC client would use."""
+import os
+import time
+import random
+
+from optparse import OptionParser
+
+from spamc.classifier import NaiveBayes
+
+
+def load(directory):
+    """Return (message, spam) pairs from the spam and ham subdirectories
+    of directory"""
+    messages = []
+    for label in ('spam', 'ham'):
+        path = os.path.join(directory, label)
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if os.path.isfile(filename):
+                with open(filename) as handle:
+                    messages.append((handle.read(), label == 'spam'))
+    return messages
+
+
+def synthetic(count, rand):
+    """Return count (message, spam) pairs drawn from overlapping spam
+    and ham vocabularies"""
+    shared = ['word%s' % chr(97 + num % 26) * (1 + num // 26)
+              for num in range(2000)]
+    spam_words = ['offer', 'cheap', 'winner', 'pills', 'casino', 'free',
+                  'click', 'unsubscribe', 'discount', 'prize']
+    ham_words = ['meeting', 'minutes', 'report', 'attached', 'review',
+                 'schedule', 'thanks', 'project', 'deadline', 'agenda']
+    messages = []
+    for _ in range(count):
+        spam = rand.random() < 0.5
+        own, other = (spam_words, ham_words) if spam else \
+            (ham_words, spam_words)
+        words = [rand.choice(shared) for _ in range(rand.randint(20, 200))]
+        words += [rand.choice(own) for _ in range(rand.randint(0, 30))]
+        words += [rand.choice(other) for _ in range(rand.randint(0, 3))]
+        rand.shuffle(words)
+        messages.append(('Subject: %s\r\n\r\n%s\r\n' % (
+            ' '.join(words[:5]), ' '.join(words)), spam))
+    return messages
+
+
+# pylint: disable=R0914
+def runit():
+    """run things"""
+    parser = OptionParser()
+    parser.add_option('-c', '--corpus',
+                      help='Directory with spam and ham subdirectories to '
+                           'use instead of a synthetic corpus',
+                      dest='corpus',
+                      type='str')
+    parser.add_option('-n', '--messages',
+                      help='Size of the synthetic corpus',
+                      dest='messages',
+                      type='int',
+                      default=10000)
+    parser.add_option('-t', '--train',
+                      help='Fraction of the corpus to train on',
+                      dest='train',
+                      type='float',
+                      default=0.8)
+    parser.add_option('-b', '--bits',
+                      help='Number of feature hash bits',
+                      dest='bits',
+                      type='int',
+                      default=20)
+    options, _ = parser.parse_args()
+    rand = random.Random(0)
+    if options.corpus:
+        messages = load(options.corpus)
+        rand.shuffle(messages)
+    else:
+        messages = synthetic(options.messages, rand)
+    split = int(len(messages) * options.train)
+    classifier = NaiveBayes(bits=options.bits, min_messages=0,
+                            refresh=split + 1)
+
+    start = time.time()
+    features = [(classifier.features(msg), spam) for msg, spam in messages]
+    extract = time.time() - start
+    start = time.time()
+    for indices, spam in features[:split]:
+        classifier.train(indices, spam)
+    train = time.time() - start
+    tests = features[split:]
+
+    start = time.time()
+    verdicts = [classifier.verdict(indices)[0] for indices, _ in tests]
+    single = time.time() - start
+    start = time.time()
+    classifier.probabilities([indices for indices, _ in tests])
+    batch = time.time() - start
+
+    offloaded = [(verdict == 'spam', spam)
+                 for verdict, (_, spam) in zip(verdicts, tests)
+                 if verdict is not None]
+    correct = len([1 for verdict, spam in offloaded if verdict == spam])
+    total = float(len(tests)) or 1.0
+
+    def rate(count, elapsed):
+        """Return a per second rate"""
+        return count / (elapsed or 1e-9)
+
+    print "Messages      => %d (%d trained)" % (len(messages), split)
+    print "Offloaded     => %.1f%%" % (100 * len(offloaded) / total)
+    print "Accuracy      => %.2f%% of offloaded" % (
+        100.0 * correct / (len(offloaded) or 1))
+    print "Features      => %.0f msgs/s" % rate(len(messages), extract)
+    print "Training      => %.0f msgs/s" % rate(split, train)
+    print "Verdicts      => %.0f msgs/s" % rate(len(tests), single)
+    print "Batch         => %.0f msgs/s" % rate(len(tests), batch)
+
+if __name__ == "__main__":
+    runit()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Measure the accuracy and speed of near duplicate detection offline
+
+Every message of the corpus, the sample messages or the files in a
+directory, is mutated the way bulk mail campaigns vary their copies
+and the mutants are looked up in an index of the originals. A mutant
+matching its own original is a hit, one matching another message a
+false match."""
+import os
+import time
+import random
+
+from optparse import OptionParser
+
+from spamc.neardup import NearDuplicateIndex
+
+
+FILES = ['sample-spam.txt', 'sample-nonspam.txt']
+
+
+def load(directory):
+    """Return the messages of the corpus"""
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        names = FILES
+    else:
+        names = sorted(os.listdir(directory))
+    messages = []
+    for name in names:
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename):
+            with open(filename) as handle:
+                messages.append(handle.read())
+    return messages
+
+
+def mutate(msg, rand):
+    """Return a copy of msg with a new id, greeting and tracking link"""
+    head, sep, body = msg.partition('\n\n')
+    words = body.split(' ')
+    if len(words) > 2:
+        words[rand.randrange(len(words))] = 'friend%d' % rand.randrange(1000)
+    return '%s\nMessage-ID: <%x@example.com>%s%s\nhttp://t.example.com/%x' % (
+        head, rand.getrandbits(64), sep, ' '.join(words),
+        rand.getrandbits(32))
+
+
+# pylint: disable=R0914
+def runit():
+    """run things"""
+    parser = OptionParser()
+    parser.add_option('-c', '--corpus',
+                      help='Directory of messages to use instead of the '
+                           'sample messages',
+                      dest='corpus',
+                      type='str')
+    parser.add_option('-m', '--mutants',
+                      help='Mutated copies per message',
+                      dest='mutants',
+                      type='int',
+                      default=100)
+    parser.add_option('-d', '--max-distance',
+                      help='Maximum Hamming distance of near duplicates',
+                      dest='max_distance',
+                      type='int',
+                      default=3)
+    options, _ = parser.parse_args()
+    rand = random.Random(0)
+    messages = load(options.corpus)
+    index = NearDuplicateIndex(max_distance=options.max_distance)
+    originals = {}
+    for number, msg in enumerate(messages):
+        value = index.fingerprint(msg)
+        if value is not None:
+            originals[value] = number
+            index.add(value, dict(number=number))
+    mutants = [(number, mutate(msg, rand))
+               for number, msg in enumerate(messages)
+               for _ in range(options.mutants)]
+    start = time.time()
+    values = [(number, index.fingerprint(msg)) for number, msg in mutants]
+    elapsed = time.time() - start
+    hits = misses = false = 0
+    for number, value in values:
+        _, result = index.lookup(value) if value is not None else (None, None)
+        if result is None:
+            misses += 1
+        elif result['number'] == number:
+            hits += 1
+        else:
+            false += 1
+    total = float(len(values)) or 1.0
+    print "Messages      => %d (%d indexed)" % (len(messages), len(originals))
+    print "Mutants       => %d" % len(values)
+    print "Hits          => %.1f%%" % (100 * hits / total)
+    print "Misses        => %.1f%%" % (100 * misses / total)
+    print "False matches => %.1f%%" % (100 * false / total)
+    print "Fingerprints  => %.0f/s" % (len(values) / (elapsed or 1e-9))
+
+if __name__ == "__main__":
+    runit()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+per user resource accounting
+"""
+import threading
+
+OTHER = '<other>'
+NO_USER = '<none>'
+FIELDS = ('requests', 'bytes_sent', 'bytes_received', 'compress_time',
+          'wait_time', 'errors')
+WEIGHTS = ('requests', 'bytes', 'wait_time')
+
+
+class Usage(object):
+    """Resources used by one user"""
+
+    __slots__ = FIELDS + ('weight', 'error_bound')
+
+    def __init__(self, weight=0, error_bound=0):
+        """Init"""
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.compress_time = 0.0
+        self.wait_time = 0.0
+        self.errors = 0
+        self.weight = weight
+        self.error_bound = error_bound
+
+    def add(self, other):
+        """Add the usage of other to this one"""
+        for field in FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def as_dict(self):
+        """Return the usage as a plain dict"""
+        result = dict([(field, getattr(self, field)) for field in FIELDS])
+        result['weight'] = self.weight
+        result['error_bound'] = self.error_bound
+        return result
+
+
+class Accounting(object):
+    """Track per user usage for the top users by weight
+
+    Only max_users users are tracked, using the space saving heavy hitter
+    algorithm. When a new user arrives while the table is full, the user
+    with the smallest weight is folded into the other bucket and the new
+    user inherits its weight as an error bound, so totals are exact and
+    any user heavier than total weight / max_users is always tracked."""
+
+    def __init__(self, max_users=100, weight='requests'):
+        """Init"""
+        if weight not in WEIGHTS:
+            raise ValueError('weight should be one of %s' % ', '.join(
+                WEIGHTS))
+        self.max_users = max_users
+        self.weight = weight
+        self.users = {}
+        self.other = Usage()
+        self._lock = threading.Lock()
+
+    def _weight(self, stats):
+        """Return the weight of a request"""
+        if self.weight == 'bytes':
+            return stats.bytes_sent + stats.bytes_received
+        if self.weight == 'wait_time':
+            return stats.phases.get('wait', 0.0)
+        return 1
+
+    def _usage(self, user):
+        """Return the usage entry for user, evicting if needed"""
+        usage = self.users.get(user)
+        if usage is None:
+            floor = 0
+            if len(self.users) >= self.max_users:
+                victim = min(self.users,
+                             key=lambda key: self.users[key].weight)
+                evicted = self.users.pop(victim)
+                self.other.add(evicted)
+                floor = evicted.weight
+            usage = self.users[user] = Usage(floor, floor)
+        return usage
+
+    def record(self, stats):
+        """Record a completed request"""
+        user = stats.user or NO_USER
+        with self._lock:
+            usage = self._usage(user)
+            usage.weight += self._weight(stats)
+            usage.requests += 1
+            usage.bytes_sent += stats.bytes_sent
+            usage.bytes_received += stats.bytes_received
+            usage.compress_time += stats.compress_time
+            usage.wait_time += stats.phases.get('wait', 0.0)
+            if stats.outcome != 'ok':
+                usage.errors += 1
+
+    def _snapshot(self):
+        """Return the current usage, caller must hold the lock"""
+        result = dict([(user, usage.as_dict())
+                       for user, usage in self.users.items()])
+        result[OTHER] = self.other.as_dict()
+        return result
+
+    def snapshot(self):
+        """Return a dict of user to usage, including the other bucket"""
+        with self._lock:
+            return self._snapshot()
+
+    def top(self, count=10):
+        """Return the heaviest (user, usage) pairs"""
+        snapshot = self.snapshot()
+        del snapshot[OTHER]
+        return sorted(snapshot.items(),
+                      key=lambda item: item[1]['weight'],
+                      reverse=True)[:count]
+
+    def reset(self):
+        """Start a new accounting period, returning the last snapshot"""
+        with self._lock:
+            result = self._snapshot()
+            self.users = {}
+            self.other = Usage()
+        return result
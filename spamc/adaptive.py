@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+adaptive timeouts
+"""
+import threading
+
+from bisect import bisect_right
+
+from spamc.metrics import Histogram
+
+# message size class upper bounds: 16K, 64K, 256K, 1M, 4M and larger
+SIZE_CLASSES = (16384, 65536, 262144, 1048576, 4194304)
+# 1ms doubling up to ~131s
+WAIT_BUCKETS = tuple([0.001 * 2 ** exp for exp in range(18)])
+
+
+def size_class(size, classes=SIZE_CLASSES):
+    """Return the size class index of a message size"""
+    return bisect_right(classes, size)
+
+
+class Estimate(object):
+    """Streaming latency estimate, an EWMA plus a decaying histogram"""
+
+    def __init__(self, alpha, decay_every):
+        """Init"""
+        self.alpha = alpha
+        self.decay_every = decay_every
+        self.ewma = None
+        self.histogram = Histogram(WAIT_BUCKETS)
+
+    def observe(self, value):
+        """Add an observation"""
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+        self.histogram.observe(value)
+        if self.histogram.count >= self.decay_every:
+            self.histogram.decay()
+
+
+# pylint: disable=R0902
+class LatencyModel(object):
+    """Learn spamd wait times per endpoint and message size class
+
+    read_timeout() derives a timeout from the observed quantile of the
+    size class, multiplied by a safety factor and clipped to the
+    configured bounds. Until min_samples requests have been seen the
+    caller's default is used."""
+
+    # pylint: disable=R0913
+    def __init__(self, quantile=0.999, factor=2.0, min_timeout=1.0,
+                 max_timeout=300.0, min_samples=50, alpha=0.1,
+                 decay_every=10000, classes=SIZE_CLASSES):
+        """Init"""
+        self.quantile = quantile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.decay_every = decay_every
+        self.classes = classes
+        self.estimates = {}
+        self._lock = threading.Lock()
+
+    def record(self, stats):
+        """Learn from a completed request"""
+        if stats.outcome != 'ok' or 'wait' not in stats.phases:
+            return
+        key = (stats.endpoint, size_class(stats.msg_size, self.classes))
+        with self._lock:
+            estimate = self.estimates.get(key)
+            if estimate is None:
+                estimate = self.estimates[key] = Estimate(
+                    self.alpha, self.decay_every)
+            estimate.observe(stats.phases['wait'])
+
+    def _estimate(self, endpoint, size):
+        """Return the estimate for an endpoint and size or None"""
+        return self.estimates.get(
+            (endpoint, size_class(size, self.classes)))
+
+    def ewma(self, endpoint, size):
+        """Return the moving average wait time or None"""
+        with self._lock:
+            estimate = self._estimate(endpoint, size)
+            return estimate.ewma if estimate is not None else None
+
+    def cost(self, size):
+        """Return the moving average wait time of a size class over all
+        endpoints or None"""
+        index = size_class(size, self.classes)
+        with self._lock:
+            averages = [estimate.ewma
+                        for (_, key), estimate in self.estimates.items()
+                        if key == index]
+        if not averages:
+            return None
+        return sum(averages) / len(averages)
+
+    def latency(self, endpoint, size, fraction):
+        """Return a wait time quantile or None if there is too little
+        data"""
+        with self._lock:
+            estimate = self._estimate(endpoint, size)
+            if estimate is None or \
+                    estimate.histogram.count < self.min_samples:
+                return None
+            return estimate.histogram.quantile(fraction)
+
+    def read_timeout(self, endpoint, size, default=None):
+        """Return the read timeout to use for a request"""
+        latency = self.latency(endpoint, size, self.quantile)
+        if latency is None:
+            return default
+        return min(self.max_timeout,
+                   max(self.min_timeout, latency * self.factor))
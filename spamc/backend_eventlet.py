@@ -4,8 +4,11 @@ spamc: eventlet backend
 # pylint: disable=unused-import,invalid-name,no-member
 # from eventlet.green import select
 from eventlet import sleep
+from eventlet import spawn
 from eventlet.green import socket
+from eventlet.queue import Queue, Empty
 
 Socket = socket.socket
 # Select = select.select
 assert sleep
+assert spawn
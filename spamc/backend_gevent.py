@@ -4,8 +4,11 @@ spamc: gevent backend
 # pylint: disable=unused-import,invalid-name
 # from gevent import select
 from gevent import sleep
+from gevent import spawn
 from gevent import socket
+from gevent.queue import Queue, Empty
 
 Socket = socket.socket
 # Select = select.select
 assert sleep
+assert spawn
@@ -5,7 +5,18 @@ spamc: thread backend
 # import select
 import time
 import socket
+import threading
+
+from Queue import Queue, Empty
 
 # Select = select.select
 Socket = socket.socket
 sleep = time.sleep
+
+
+def spawn(func, *args, **kwargs):
+    """Run func in a new daemon thread"""
+    thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
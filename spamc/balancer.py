@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+load balancing policies
+"""
+import math
+import time
+import random
+import struct
+import hashlib
+import threading
+
+from bisect import bisect
+
+from spamc.client import SpamC
+from spamc.retry import RetryPolicy
+from spamc.limits import ConcurrencyLimit
+from spamc.utils import BackendUser
+from spamc.endpoints import Balancer, RoundRobin, get_endpoint
+from spamc.exceptions import SpamCError
+
+
+# pylint: disable=R0902,R0903
+class NodeState(object):
+    """Load and health of one endpoint"""
+
+    def __init__(self):
+        """Init"""
+        self.outstanding = 0
+        self.ewma = None
+        self.healthy = True
+        self.failures = 0
+        self.successes = 0
+        self.changed = 0.0
+        self.failed_at = 0.0
+        self.from_weight = 1.0
+
+
+# pylint: disable=R0902
+class LatencyBalancer(Balancer):
+    """Power of two choices over outstanding requests and EWMA latency
+
+    Two candidate endpoints are drawn at random and the one with the
+    lower latency * (outstanding + 1) / weight is used. An endpoint is
+    marked down after fall consecutive failures, from traffic or from a
+    HealthChecker, and its weight then drains to zero over drain_time.
+    It is marked up after rise consecutive successes, or recover_after
+    seconds after its last failure, and warms up from warm_weight to
+    full weight over warmup_time."""
+
+    # pylint: disable=R0913
+    def __init__(self, alpha=0.3, default_latency=0.1, fall=3, rise=2,
+                 drain_time=10.0, warmup_time=30.0, warm_weight=0.1,
+                 recover_after=30.0):
+        """Init"""
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self.fall = fall
+        self.rise = rise
+        self.drain_time = drain_time
+        self.warmup_time = warmup_time
+        self.warm_weight = warm_weight
+        self.recover_after = recover_after
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def _node(self, endpoint):
+        """Return the state of endpoint, caller must hold the lock"""
+        node = self.nodes.get(endpoint.name)
+        if node is None:
+            node = self.nodes[endpoint.name] = NodeState()
+        return node
+
+    def _weight(self, node, now):
+        """Return the current weight of a node"""
+        elapsed = now - node.changed
+        if node.healthy:
+            if elapsed >= self.warmup_time:
+                return 1.0
+            return node.from_weight + \
+                (1.0 - node.from_weight) * elapsed / self.warmup_time
+        if now - node.failed_at >= self.recover_after:
+            self._mark(node, True, now)
+            return node.from_weight
+        if elapsed >= self.drain_time:
+            return 0.0
+        return node.from_weight * (1.0 - elapsed / self.drain_time)
+
+    def _mark(self, node, healthy, now):
+        """Change the health of a node, starting a drain or warm up"""
+        if healthy:
+            node.from_weight = self.warm_weight
+        else:
+            # drain from wherever the warm up had got to
+            node.from_weight = self._weight(node, now)
+        node.healthy = healthy
+        node.changed = now
+
+    def _score(self, node, weight):
+        """Return the cost of sending a request to a node"""
+        latency = node.ewma if node.ewma is not None \
+            else self.default_latency
+        return latency * (node.outstanding + 1) / weight
+
+    def select(self, endpoints, stats, exclude=()):
+        """Return the endpoint to use for a request"""
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for endpoint in endpoints:
+                if endpoint in exclude:
+                    continue
+                node = self._node(endpoint)
+                weight = self._weight(node, now)
+                if weight > 0:
+                    candidates.append((endpoint, node, weight))
+            if not candidates:
+                # everything is down, try the least loaded endpoint
+                candidates = [
+                    (endpoint, self._node(endpoint), 1.0)
+                    for endpoint in endpoints
+                    if endpoint not in exclude] or [
+                        (endpoint, self._node(endpoint), 1.0)
+                        for endpoint in endpoints]
+            candidates = random.sample(candidates, min(2, len(candidates)))
+            endpoint = min(candidates, key=lambda item: self._score(
+                item[1], item[2]))[0]
+        return endpoint
+
+    def start(self, endpoint, deadline=None):
+        """A request to endpoint is starting"""
+        # pylint: disable=unused-argument
+        with self._lock:
+            self._node(endpoint).outstanding += 1
+
+    def finish(self, endpoint, elapsed, ok):
+        """A request to endpoint finished"""
+        with self._lock:
+            node = self._node(endpoint)
+            node.outstanding -= 1
+            if ok:
+                if node.ewma is None:
+                    node.ewma = elapsed
+                else:
+                    node.ewma += self.alpha * (elapsed - node.ewma)
+            if ok is not None:
+                self._report(node, ok)
+
+    def _report(self, node, ok):
+        """Count a success or failure, caller must hold the lock"""
+        now = time.time()
+        if ok:
+            node.failures = 0
+            node.successes += 1
+            if not node.healthy and node.successes >= self.rise:
+                self._mark(node, True, now)
+        else:
+            node.successes = 0
+            node.failures += 1
+            node.failed_at = now
+            if node.healthy and node.failures >= self.fall:
+                self._mark(node, False, now)
+
+    def report(self, endpoint, ok):
+        """Record the result of a health check"""
+        with self._lock:
+            self._report(self._node(endpoint), ok)
+
+    def snapshot(self):
+        """Return the state of every endpoint"""
+        now = time.time()
+        with self._lock:
+            return dict([(name, dict(
+                outstanding=node.outstanding,
+                latency=node.ewma,
+                healthy=node.healthy,
+                weight=self._weight(node, now)))
+                         for name, node in self.nodes.items()])
+
+
+def hash_key(key):
+    """Return the ring position of key"""
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return struct.unpack('>Q', hashlib.md5(key).digest()[:8])[0]
+
+
+class ConsistentHash(Balancer):
+    """Route requests for the same user to the same endpoint
+
+    The routing key, the routing_key passed to perform() or else the
+    spamc user, is hashed onto a ring holding replicas virtual nodes per
+    endpoint, so adding or removing an endpoint only moves the keys of
+    its neighbours. With bounded loads an endpoint takes at most
+    (1 + epsilon) times the average number of outstanding requests and
+    keys of a busy endpoint spill over to the next one on the ring.
+    Requests without a key are sent to the fallback balancer."""
+
+    def __init__(self, replicas=100, epsilon=0.25, fallback=None):
+        """Init"""
+        self.replicas = replicas
+        self.epsilon = epsilon
+        self.fallback = fallback or RoundRobin()
+        self.outstanding = {}
+        self._ring = None
+        self._lock = threading.Lock()
+
+    def _get_ring(self, endpoints):
+        """Return the ring for endpoints, building it when they change"""
+        names = tuple([endpoint.name for endpoint in endpoints])
+        if self._ring is None or self._ring[0] != names:
+            points = []
+            for endpoint in endpoints:
+                for replica in range(self.replicas):
+                    points.append((hash_key('%s-%d' % (endpoint.name,
+                                                       replica)),
+                                   endpoint))
+            points.sort(key=lambda point: point[0])
+            self._ring = (names, [point[0] for point in points],
+                          [point[1] for point in points])
+        return self._ring
+
+    def capacity(self, endpoints):
+        """Return the maximum outstanding requests per endpoint"""
+        total = sum([self.outstanding.get(endpoint.name, 0)
+                     for endpoint in endpoints])
+        return int(math.ceil(
+            (1 + self.epsilon) * (total + 1) / float(len(endpoints))))
+
+    def select(self, endpoints, stats, exclude=()):
+        """Return the endpoint to use for a request"""
+        key = stats.routing_key or stats.user
+        if not key:
+            return self.fallback.select(endpoints, stats, exclude)
+        with self._lock:
+            _, hashes, owners = self._get_ring(endpoints)
+            capacity = self.capacity(endpoints)
+            index = bisect(hashes, hash_key(key))
+            fallback = None
+            for offset in range(len(hashes)):
+                endpoint = owners[(index + offset) % len(hashes)]
+                if endpoint in exclude:
+                    continue
+                if fallback is None:
+                    fallback = endpoint
+                if self.outstanding.get(endpoint.name, 0) < capacity:
+                    return endpoint
+        return fallback or endpoints[0]
+
+    def start(self, endpoint, deadline=None):
+        """A request to endpoint is starting"""
+        with self._lock:
+            self.outstanding[endpoint.name] = \
+                self.outstanding.get(endpoint.name, 0) + 1
+        self.fallback.start(endpoint, deadline)
+
+    def finish(self, endpoint, elapsed, ok):
+        """A request to endpoint finished"""
+        with self._lock:
+            self.outstanding[endpoint.name] -= 1
+        self.fallback.finish(endpoint, elapsed, ok)
+
+    def report(self, endpoint, ok):
+        """Record the result of a health check"""
+        self.fallback.report(endpoint, ok)
+
+
+# pylint: disable=R0902
+class SizeRouter(BackendUser, Balancer):
+    """Send large messages to a dedicated pool of spamd endpoints
+
+    Messages whose Content-length exceeds threshold go to
+    large_endpoints, chosen by the large balancer, and everything else
+    to the client endpoints through the small balancer. max_large and
+    max_small bound the requests in flight in each pool, waiting up to
+    queue_timeout for a slot, so a burst of big messages cannot hold up
+    the small ones. The two pools must not share endpoints. Waiting
+    uses the backend of the client unless backend is given."""
+
+    # pylint: disable=R0913
+    def __init__(self, large_endpoints, threshold=1048576, max_large=4,
+                 max_small=None, queue_timeout=5.0, small=None, large=None,
+                 backend=None, port=783):
+        """Init"""
+        self.large_endpoints = [get_endpoint(spec, port)
+                                for spec in large_endpoints]
+        self.threshold = threshold
+        self.small = small or RoundRobin()
+        self.large = large or RoundRobin()
+        self.set_backend(backend)
+        self.limits = {}
+        for pool, limit in (('small', max_small), ('large', max_large)):
+            if limit is not None:
+                self.limits[pool] = ConcurrencyLimit(
+                    limit, self.backend_mod, queue_timeout)
+
+    def _rebind(self, backend_mod):
+        """Wait for pool slots on backend_mod"""
+        for limit in self.limits.values():
+            limit.backend_mod = backend_mod
+
+    def _pool(self, endpoint):
+        """Return the pool name and balancer of endpoint"""
+        if endpoint in self.large_endpoints:
+            return 'large', self.large
+        return 'small', self.small
+
+    def select(self, endpoints, stats, exclude=()):
+        """Return the endpoint to use for a request"""
+        if stats.msg_size > self.threshold:
+            return self.large.select(self.large_endpoints, stats, exclude)
+        return self.small.select(endpoints, stats, exclude)
+
+    def start(self, endpoint, deadline=None):
+        """Wait for a slot in the pool of endpoint, no longer than until
+        the request deadline"""
+        pool, balancer = self._pool(endpoint)
+        if pool in self.limits:
+            self.limits[pool].acquire(deadline=deadline)
+        balancer.start(endpoint, deadline)
+
+    def finish(self, endpoint, elapsed, ok):
+        """Release the slot taken by start"""
+        pool, balancer = self._pool(endpoint)
+        balancer.finish(endpoint, elapsed, ok)
+        if pool in self.limits:
+            self.limits[pool].release()
+
+    def report(self, endpoint, ok):
+        """Record the result of a health check"""
+        self._pool(endpoint)[1].report(endpoint, ok)
+
+
+class HealthChecker(object):
+    """Ping every endpoint of a client at an interval and report the
+    results to its balancer"""
+
+    def __init__(self, client, interval=5.0, timeout=1.0):
+        """Init"""
+        self.balancer = client.balancer
+        self.backend_mod = client.backend_mod
+        self.interval = interval
+        self.running = False
+        self.clients = [(endpoint, SpamC(
+            endpoints=[endpoint],
+            backend=client.backend_mod,
+            timeout=timeout,
+            total_timeout=timeout,
+            retry_policy=RetryPolicy(max_tries=0),
+            is_ssl=client.is_ssl,
+            **client.ssl_args)) for endpoint in client.endpoints]
+
+    def check(self):
+        """Ping every endpoint once"""
+        for endpoint, pinger in self.clients:
+            try:
+                healthy = pinger.ping()['message'] == 'PONG'
+            except SpamCError:
+                healthy = False
+            self.balancer.report(endpoint, healthy)
+
+    def run(self):
+        """Check the endpoints until stopped"""
+        while self.running:
+            self.check()
+            self.backend_mod.sleep(self.interval)
+
+    def start(self):
+        """Start checking in the background"""
+        self.running = True
+        self.backend_mod.spawn(self.run)
+
+    def stop(self):
+        """Stop checking"""
+        self.running = False
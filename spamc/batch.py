@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+batch scanning
+"""
+import time
+import heapq
+import threading
+
+from spamc.client import get_msg_length
+
+# assumed scan time per byte when the model knows nothing of a size
+DEFAULT_SECONDS_PER_BYTE = 1e-7
+
+
+class BatchScanner(object):
+    """Scan many messages concurrently, shortest predicted job first
+
+    The scan time of a message is predicted from its size, using the
+    moving average wait of its size class in latency_model, the client's
+    by default, or seconds_per_byte times its size when that is
+    unknown. Pending messages are started in order of predicted cost
+    plus aging times their arrival time, so a message that has waited
+    long enough runs before cheaper newcomers."""
+
+    # pylint: disable=R0913
+    def __init__(self, client, workers=4, aging=1.0, latency_model=None,
+                 seconds_per_byte=DEFAULT_SECONDS_PER_BYTE):
+        """Init"""
+        self.client = client
+        self.workers = workers
+        self.aging = aging
+        self.latency_model = latency_model or client.latency_model
+        self.seconds_per_byte = seconds_per_byte
+
+    def predict(self, size):
+        """Return the predicted scan time of a message size"""
+        cost = None
+        if self.latency_model is not None:
+            cost = self.latency_model.cost(size)
+        if cost is None:
+            cost = size * self.seconds_per_byte
+        return cost
+
+    def scan(self, messages, cmd='check', **kwargs):
+        """Run cmd on every message, returning the results in the order
+        of messages with the exception raised in place of failures"""
+        backend_mod = self.client.backend_mod
+        method = getattr(self.client, cmd)
+        pending = []
+        results = []
+        lock = threading.Lock()
+        ready = backend_mod.Queue()
+        done = backend_mod.Queue()
+
+        def worker():
+            """Scan pending messages until told to stop"""
+            while ready.get() is not None:
+                with lock:
+                    _, index, msg = heapq.heappop(pending)
+                try:
+                    results[index] = method(msg, **kwargs)
+                except Exception as err:  # pylint: disable=W0703
+                    results[index] = err
+            done.put(None)
+
+        for _ in range(self.workers):
+            backend_mod.spawn(worker)
+        for index, msg in enumerate(messages):
+            try:
+                size = get_msg_length(msg)
+            except ValueError:
+                # fails again, in place, when it is scanned
+                size = 0
+            key = self.predict(size) + self.aging * time.time()
+            with lock:
+                results.append(None)
+                heapq.heappush(pending, (key, index, msg))
+            ready.put(index)
+        for _ in range(self.workers):
+            ready.put(None)
+        for _ in range(self.workers):
+            done.get()
+        return results
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+verdict cache
+"""
+import copy
+import time
+import hashlib
+import threading
+
+from cStringIO import StringIO
+from collections import deque
+
+# commands whose responses depend only on the message and user
+CACHE_COMMANDS = ('CHECK', 'SYMBOLS', 'REPORT', 'REPORT_IFSPAM', 'HEADERS')
+# size of the blocks file messages are read in
+BLOCK_SIZE = 65536
+# longest header name or blank line waited for across reads
+MAX_NAME = 998
+# headers added or rewritten by every relay a message passes through,
+# names ending in * are prefixes
+VOLATILE_HEADERS = ('received', 'delivered-to', 'return-path',
+                    'x-original-to', 'x-envelope-*', 'x-queue-id',
+                    'x-postfix-queue-id', 'x-spam-*')
+
+
+def message_digest(msg, digest=None):
+    """Update and return a hashlib digest with the bytes of msg, a
+    string or a file that is read from the start"""
+    if digest is None:
+        digest = hashlib.sha1()
+    if hasattr(msg, 'read'):
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+        for block in iter(lambda: msg.read(BLOCK_SIZE), ''):
+            digest.update(block)
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+    elif msg:
+        digest.update(msg)
+    return digest
+
+
+def cache_key(cmd, user, extra_headers, msg):
+    """Return the cache key of a request"""
+    digest = hashlib.sha1()
+    digest.update('%s\0%s\0' % (cmd, user or ''))
+    for key in sorted(extra_headers or {}):
+        digest.update('%s: %s\0' % (key, extra_headers[key]))
+    return message_digest(msg, digest).hexdigest()
+
+
+class CanonicalDigest(object):
+    """Digest of a message that ignores volatile headers, header case
+    and folding, runs of whitespace, line endings and trailing blank
+    lines. The message is read once, a line of at most BLOCK_SIZE bytes
+    at a time."""
+
+    def __init__(self, digest, volatile=VOLATILE_HEADERS):
+        """Init"""
+        self.digest = digest
+        self.names = frozenset([name for name in volatile
+                                if not name.endswith('*')])
+        self.prefixes = tuple([name[:-1] for name in volatile
+                               if name.endswith('*')])
+        self.in_body = False
+        self.in_line = False
+        self.skip = False
+        self.open = False
+        self.started = False
+        self.space = False
+        self.blanks = 0
+        self.partial = ''
+
+    def volatile(self, name):
+        """Return True if the header name is excluded"""
+        return name in self.names or name.startswith(self.prefixes)
+
+    def _words(self, text):
+        """Add text with runs of whitespace collapsed"""
+        words = text.split()
+        if not words:
+            self.space = self.space or bool(text)
+            return
+        if not self.started:
+            if self.in_body and self.blanks:
+                self.digest.update('\n' * self.blanks)
+                self.blanks = 0
+        elif self.space or text[0].isspace():
+            self.digest.update(' ')
+        self.digest.update(' '.join(words))
+        self.started = True
+        self.space = text[-1].isspace()
+
+    def _header(self, line):
+        """Add the start of a header line"""
+        self._close()
+        name, sep, value = line.partition(':')
+        name = name.strip().lower()
+        self.skip = self.volatile(name)
+        self.started = self.space = False
+        if not self.skip:
+            self.digest.update(name + sep)
+            self.open = True
+            self._words(value)
+
+    def _close(self):
+        """End the current header"""
+        if self.open:
+            self.digest.update('\n')
+            self.open = False
+
+    def update(self, line):
+        """Add a line, or part of one when it does not end with a
+        newline"""
+        ended = line.endswith('\n')
+        if not self.in_body and not self.in_line:
+            line = self.partial + line
+            if not ended and len(line) < MAX_NAME and (
+                    not line.strip() or
+                    (':' not in line and not line[0].isspace())):
+                # wait for the end of a blank line or of a header name
+                self.partial = line
+                return
+            self.partial = ''
+            if not line.strip():
+                self._close()
+                self.digest.update('\0')
+                self.in_body = True
+                self.started = self.space = False
+                return
+            if not line[0].isspace():
+                self._header(line)
+                self.in_line = not ended
+                return
+        if not self.skip or self.in_body:
+            self._words(line)
+        self.in_line = not ended
+        if ended:
+            if not self.in_body:
+                self.space = self.started
+            else:
+                # line breaks only count before more text
+                self.blanks += 1
+                self.started = self.space = False
+
+
+def canonical_digest(msg, digest=None, volatile=VOLATILE_HEADERS):
+    """Update and return a hashlib digest with the canonical form of
+    msg, a string or a file that is read from the start"""
+    if digest is None:
+        digest = hashlib.sha1()
+    canonical = CanonicalDigest(digest, volatile)
+    if not hasattr(msg, 'read'):
+        msg = StringIO(msg or '')
+    elif hasattr(msg, 'seek'):
+        msg.seek(0)
+    for line in iter(lambda: msg.readline(BLOCK_SIZE), ''):
+        canonical.update(line)
+    if hasattr(msg, 'seek'):
+        msg.seek(0)
+    return digest
+
+
+class CanonicalKey(object):
+    """Cache key function that ignores the headers relays add, for
+    VerdictCache and Coalescer key_func"""
+
+    def __init__(self, volatile=VOLATILE_HEADERS):
+        """Init"""
+        self.volatile = volatile
+
+    def __call__(self, cmd, user, extra_headers, msg):
+        """Return the cache key of a request"""
+        digest = hashlib.sha1()
+        digest.update('%s\0%s\0' % (cmd, user or ''))
+        for key in sorted(extra_headers or {}):
+            digest.update('%s: %s\0' % (key, extra_headers[key]))
+        return canonical_digest(msg, digest, self.volatile).hexdigest()
+
+
+canonical_key = CanonicalKey()
+
+
+class Entry(object):
+    """A cached response"""
+
+    __slots__ = ('result', 'stored', 'refreshing')
+
+    def __init__(self, result, stored):
+        """Init"""
+        self.result = result
+        self.stored = stored
+        self.refreshing = False
+
+
+# pylint: disable=R0902
+class VerdictCache(object):
+    """Cache of spamd responses by message digest
+
+    Responses are fresh for ttl seconds and may be served stale for
+    grace seconds after that. A fresh entry within refresh_ahead
+    seconds of expiry is refreshed in the background while it is
+    served. A stale entry is served, flagged stale=True, when the live
+    request fails and stale_if_error is set, is shed, or takes longer
+    than stale_timeout seconds when that is set. Fresh hits are flagged
+    cached=True. At most max_entries responses are kept, the oldest
+    being evicted first. With key_func=canonical_key copies of a message
+    that only differ in the headers relays add share an entry."""
+
+    # pylint: disable=R0913
+    def __init__(self, ttl=300.0, grace=3600.0, refresh_ahead=0.0,
+                 stale_if_error=True, stale_timeout=None,
+                 max_entries=10000, key_func=cache_key,
+                 commands=CACHE_COMMANDS):
+        """Init"""
+        self.ttl = ttl
+        self.grace = grace
+        self.refresh_ahead = refresh_ahead
+        self.stale_if_error = stale_if_error
+        self.stale_timeout = stale_timeout
+        self.max_entries = max_entries
+        self.key_func = key_func
+        self.commands = commands
+        self.entries = {}
+        self.order = deque()
+        self._lock = threading.Lock()
+
+    def applies(self, cmd):
+        """Return True if responses to cmd are cached"""
+        return cmd in self.commands
+
+    def key(self, cmd, user, extra_headers, msg):
+        """Return the cache key of a request"""
+        return self.key_func(cmd, user, extra_headers, msg)
+
+    def lookup(self, key, now=None):
+        """Return (state, entry) where state is fresh, refresh, stale or
+        None when nothing usable is cached. refresh marks a fresh entry
+        the caller should refresh, it is only returned once."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            age = now - entry.stored
+            if age < self.ttl:
+                if age >= self.ttl - self.refresh_ahead and \
+                        not entry.refreshing:
+                    entry.refreshing = True
+                    return 'refresh', entry
+                return 'fresh', entry
+            if age < self.ttl + self.grace:
+                return 'stale', entry
+            del self.entries[key]
+        return None, None
+
+    def store(self, key, result, now=None):
+        """Cache a response"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self.entries[key] = Entry(result, now)
+            self.order.append((key, now))
+            while len(self.entries) > self.max_entries:
+                old_key, stored = self.order.popleft()
+                entry = self.entries.get(old_key)
+                if entry is not None and entry.stored == stored:
+                    del self.entries[old_key]
+            if len(self.order) > 2 * self.max_entries:
+                # drop the records of replaced entries
+                self.order = deque([
+                    (old_key, stored) for old_key, stored in self.order
+                    if old_key in self.entries and
+                    self.entries[old_key].stored == stored])
+
+    def done_refreshing(self, key):
+        """Allow the entry of key to be refreshed again"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    @staticmethod
+    def serve(entry, flag):
+        """Return a copy of a cached response flagged with flag"""
+        result = copy.deepcopy(entry.result)
+        result[flag] = True
+        return result
+
+    def __len__(self):
+        """Return the number of cached responses"""
+        return len(self.entries)
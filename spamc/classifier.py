@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+local naive Bayes classifier
+"""
+import re
+import zlib
+import threading
+
+import numpy
+
+from spamc.client import make_response
+
+CLASSIFIED = 'CLASSIFIED'
+# commands a confident local verdict may answer
+CLASSIFY_COMMANDS = ('CHECK',)
+TOKEN_RE = re.compile(r'[^\W\d_][\w\'$.-]{1,30}', re.UNICODE)
+OUTCOMES = ('offloaded', 'agree', 'disagree', 'unsure')
+
+
+def message_text(msg, max_bytes=65536):
+    """Return up to max_bytes of msg, a string or file read from the
+    start"""
+    if hasattr(msg, 'read'):
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+        data = msg.read(max_bytes)
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+        return data
+    return (msg or '')[:max_bytes]
+
+
+# pylint: disable=R0902
+class NaiveBayes(object):
+    """Naive Bayes over hashed tokens that answers confident scans
+
+    The distinct tokens of the first max_bytes of a message are hashed
+    into 2 ** bits features. The classifier trains on the spamd verdicts
+    at least train_margin points from the threshold and on every
+    message passed to SpamC.tell() or learn(), weighted learn_weight.
+    Once it has seen min_messages of each class a scan whose spam
+    probability is below ham_threshold or above spam_threshold is
+    answered locally, anything else goes to spamd. In shadow mode every
+    scan goes to spamd and the local verdicts are only counted against
+    spamd's."""
+
+    # pylint: disable=R0913,R0914
+    def __init__(self, bits=20, alpha=1.0, ham_threshold=0.001,
+                 spam_threshold=0.999, min_messages=1000, train_margin=2.0,
+                 learn_weight=5.0, threshold=5.0, ham_score=0.0,
+                 spam_score=100.0, shadow=False, refresh=100,
+                 max_bytes=65536, commands=CLASSIFY_COMMANDS):
+        """Init"""
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.alpha = alpha
+        self.ham_threshold = ham_threshold
+        self.spam_threshold = spam_threshold
+        self.min_messages = min_messages
+        self.train_margin = train_margin
+        self.learn_weight = learn_weight
+        self.threshold = threshold
+        self.ham_score = ham_score
+        self.spam_score = spam_score
+        self.shadow = shadow
+        self.refresh = refresh
+        self.max_bytes = max_bytes
+        self.commands = commands
+        self.spam_counts = numpy.zeros(1 << bits)
+        self.ham_counts = numpy.zeros(1 << bits)
+        self.spam_total = 0.0
+        self.ham_total = 0.0
+        self.weights = None
+        self.prior = 0.0
+        self.pending = 0
+        self.outcomes = dict([(outcome, 0) for outcome in OUTCOMES])
+        self._lock = threading.Lock()
+
+    def applies(self, cmd):
+        """Return True if cmd may be answered locally"""
+        return cmd in self.commands
+
+    def features(self, msg):
+        """Return the sorted feature indices of a message"""
+        text = message_text(msg, self.max_bytes).lower()
+        tokens = set(TOKEN_RE.findall(text))
+        indices = numpy.fromiter(
+            [zlib.crc32(token) for token in tokens], numpy.int64,
+            len(tokens))
+        return numpy.unique(indices & self.mask)
+
+    def train(self, indices, spam, weight=1.0):
+        """Count a message with the given features as spam or ham"""
+        with self._lock:
+            if spam:
+                self.spam_counts[indices] += weight
+                self.spam_total += weight
+            else:
+                self.ham_counts[indices] += weight
+                self.ham_total += weight
+            self.pending += 1
+
+    def _weights(self):
+        """Return the per feature log likelihood ratios and the prior,
+        recomputed every refresh updates"""
+        with self._lock:
+            if self.weights is None or self.pending >= self.refresh:
+                spam = numpy.log(self.spam_counts + self.alpha) - \
+                    numpy.log(self.spam_total + 2 * self.alpha)
+                ham = numpy.log(self.ham_counts + self.alpha) - \
+                    numpy.log(self.ham_total + 2 * self.alpha)
+                self.weights = spam - ham
+                self.prior = numpy.log(self.spam_total + self.alpha) - \
+                    numpy.log(self.ham_total + self.alpha)
+                self.pending = 0
+            return self.weights, self.prior
+
+    def trained(self):
+        """Return True once enough of both classes has been seen"""
+        return min(self.spam_total, self.ham_total) >= self.min_messages
+
+    def probability(self, indices):
+        """Return the spam probability of a message"""
+        weights, prior = self._weights()
+        odds = prior + weights[indices].sum()
+        return float(1.0 / (1.0 + numpy.exp(-numpy.clip(odds, -500, 500))))
+
+    def probabilities(self, batch):
+        """Return the spam probabilities of a list of feature arrays"""
+        if not batch:
+            return numpy.zeros(0)
+        weights, prior = self._weights()
+        sizes = numpy.array([len(indices) for indices in batch])
+        flat = numpy.concatenate(list(batch) + [numpy.zeros(1, numpy.int64)])
+        starts = numpy.concatenate(([0], numpy.cumsum(sizes)[:-1]))
+        odds = numpy.add.reduceat(weights[flat], starts)
+        # reduceat returns the next element for empty messages
+        odds[sizes == 0] = 0.0
+        odds = numpy.clip(odds + prior, -500, 500)
+        return 1.0 / (1.0 + numpy.exp(-odds))
+
+    def verdict(self, indices):
+        """Return (verdict, probability) where verdict is spam, ham or
+        None when the classifier is not confident"""
+        if not self.trained():
+            return None, None
+        probability = self.probability(indices)
+        if probability >= self.spam_threshold:
+            return 'spam', probability
+        if probability <= self.ham_threshold:
+            return 'ham', probability
+        return None, probability
+
+    def result(self, verdict, probability):
+        """Return the response to a scan answered locally"""
+        self._count('offloaded')
+        score = self.spam_score if verdict == 'spam' else self.ham_score
+        return make_response(CLASSIFIED, verdict == 'spam', score,
+                             self.threshold, classified=probability)
+
+    def _count(self, outcome):
+        """Count the outcome of a scan"""
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def observe(self, indices, verdict, result):
+        """Compare a local verdict with the spamd result and train on
+        the latter when it is clear"""
+        if verdict is None:
+            self._count('unsure')
+        elif (verdict == 'spam') == result['isspam']:
+            self._count('agree')
+        else:
+            self._count('disagree')
+        if abs(result['score'] - result['basescore']) >= self.train_margin:
+            self.train(indices, result['isspam'])
+
+    def learn(self, msg, spam):
+        """Train on a message learnt through spamd"""
+        self.train(self.features(msg), spam, self.learn_weight)
+
+    def snapshot(self):
+        """Return the counts of scan outcomes"""
+        with self._lock:
+            return dict(self.outcomes)
+
+    def register(self, metrics):
+        """Export the scan outcomes as a gauge"""
+        metrics.add_gauge(
+            'classifier_scans', 'Scans by local classifier outcome.',
+            lambda: [(dict(outcome=outcome), count)
+                     for outcome, count in sorted(self.snapshot().items())],
+            source=self)
+
+    def save(self, path):
+        """Write the model to a numpy .npz file"""
+        with self._lock:
+            numpy.savez_compressed(
+                path, spam_counts=self.spam_counts,
+                ham_counts=self.ham_counts,
+                totals=numpy.array([self.spam_total, self.ham_total]))
+
+    def load(self, path):
+        """Read a model written by save()"""
+        data = numpy.load(path)
+        if len(data['spam_counts']) != 1 << self.bits:
+            raise ValueError('%s was saved with a different size' % path)
+        with self._lock:
+            self.spam_counts = data['spam_counts']
+            self.ham_counts = data['ham_counts']
+            self.spam_total, self.ham_total = [
+                float(total) for total in data['totals']]
+            self.weights = None
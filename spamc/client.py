@@ -20,16 +20,24 @@ spamc: Python spamassassin spamc client library
 client
 """
 import os
+import copy
+import time
 import errno
 import types
 import socket
+import threading
 
 from zlib import compress
 # from mimetools import Message
 from email.parser import Parser
 
 from spamc.utils import load_backend
-from spamc.conn import SpamCTcpConnector, SpamCUnixConnector
+from spamc.stats import RequestStats
+from spamc.tracing import Tracer, NOOP_SPAN
+from spamc.retry import RetryPolicy, RetryBudget
+from spamc.conn import deadline_timeout
+from spamc.limits import COMMAND_LANES, DEFAULT_LANE
+from spamc.endpoints import Endpoint, RoundRobin, get_endpoint
 
 from spamc.regex import RESPONSE_RE, SPAM_RE, PART_RE, RULE_RE, SPACE_RE
 from spamc.exceptions import SpamCError, SpamCTimeOutError, SpamCResponseError
@@ -37,6 +45,28 @@ from spamc.exceptions import SpamCError, SpamCTimeOutError, SpamCResponseError
 PROTOCOL_VERSION = 'SPAMC/1.5'
 
 
+def _default(value, default):
+    """Return value, or default when value is None"""
+    if value is None:
+        return default
+    return value
+
+
+def get_msg_length(msg):
+    """Return the Content-length of a message, string or file"""
+    if hasattr(msg, 'read') and hasattr(msg, 'fileno'):
+        return os.fstat(msg.fileno()).st_size + 2
+    if hasattr(msg, 'read'):
+        msg.seek(0, 2)
+        return msg.tell() + 2
+    if msg:
+        try:
+            return len(msg) + 2
+        except TypeError:
+            raise ValueError('msg param should be a string or file handle')
+    return 2
+
+
 def _check_action(action):
     """check for invalid actions"""
     if isinstance(action, types.StringTypes):
@@ -47,26 +77,53 @@ def _check_action(action):
     return action
 
 
-# pylint: disable=R0912,R0915
-def get_response(cmd, conn):
-    """Return a response"""
-    resp = conn.socket().makefile('rb', -1)
+def _detached(msg):
+    """return msg as a string for a request that may outlive the call,
+    the caller may close a file once we return"""
+    if hasattr(msg, 'read'):
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+        msg = msg.read()
+    return msg
+
+
+def _check_aborted(state):
+    """stop a hedged attempt that has already lost"""
+    if state.get('aborted'):
+        raise socket.error(errno.ECONNABORTED, 'Hedged request aborted')
+
+
+def make_response(message='', isspam=False, score=0.0, basescore=0.0,
+                  **flags):
+    """Return a response with the keys set by get_response(), flags
+    mark the responses made without spamd"""
     resp_dict = dict(
         code=0,
-        message='',
-        isspam=False,
-        score=0.0,
-        basescore=0.0,
+        message=message,
+        isspam=isspam,
+        score=score,
+        basescore=basescore,
         report=[],
         symbols=[],
         headers={},
     )
+    resp_dict.update(flags)
+    return resp_dict
+
+
+# pylint: disable=R0912,R0915
+def get_response(cmd, conn, stats=None):
+    """Return a response"""
+    resp_dict = make_response()
 
     if cmd == 'TELL':
         resp_dict['didset'] = False
         resp_dict['didremove'] = False
 
-    data = resp.read()
+    data = conn.read()
+    if stats is not None:
+        stats.bytes_received += len(data)
+        stats.lap('wait')
     lines = data.split('\r\n')
     for index, line in enumerate(lines):
         if index == 0:
@@ -112,6 +169,8 @@ def get_response(cmd, conn):
         headers = parser.parsestr('\r\n'.join(lines[4:]), headersonly=True)
         for key in headers.keys():
             resp_dict['headers'][key] = headers[key]
+    if stats is not None:
+        stats.lap('parse')
     return resp_dict
 
 
@@ -132,11 +191,69 @@ class SpamC(object):
                  gzip=None,
                  compress_level=6,
                  is_ssl=None,
+                 metrics=None,
+                 slowlog=None,
+                 tracer=None,
+                 profiler=None,
+                 accounting=None,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 send_timeout=None,
+                 total_timeout=None,
+                 latency_model=None,
+                 retry_policy=None,
+                 endpoints=None,
+                 balancer=None,
+                 hedging=None,
+                 admission=None,
+                 shedder=None,
+                 cache=None,
+                 coalescer=None,
+                 neardup=None,
+                 known=None,
+                 prefilter=None,
+                 classifier=None,
                  **ssl_args):
-        """Init"""
+        """Init
+
+        timeout is the default for connect_timeout, read_timeout and
+        send_timeout, the latter two being idle timeouts for a single
+        socket operation. total_timeout bounds a whole perform() call,
+        retries included. When a latency_model is given it derives the
+        read timeout from the observed spamd latency instead.
+
+        Retries are driven by retry_policy, which defaults to a
+        RetryPolicy built from max_tries and wait_tries.
+
+        endpoints is a list of spamd servers, given as Endpoint objects,
+        (host, port) tuples, host:port strings or unix socket paths, to
+        use instead of host, port and socket_file. The balancer picks the
+        endpoint for each attempt and hedging sends a second copy of slow
+        requests to another endpoint.
+
+        admission is an AdmissionControl that limits the requests in
+        flight to each endpoint, queueing or failing fast beyond that.
+        shedder is a LoadShedder that answers some scans with a not
+        scanned verdict while spamd is overloaded. cache is a
+        VerdictCache of responses by message digest and coalescer a
+        Coalescer that merges identical requests in flight. neardup is a
+        NearDuplicateIndex that reuses clear verdicts of recently scanned
+        messages for near duplicates and known a KnownSpam that answers
+        scans of messages already learnt as spam. prefilter is a
+        PreFilter whose header rules answer scans of trusted or obvious
+        mail and classifier a NaiveBayes that answers the scans it is
+        confident about."""
         self.host = host
         self.port = port
         self.socket_file = socket_file
+        if endpoints:
+            self.endpoints = [get_endpoint(spec, port) for spec in endpoints]
+        elif host is None:
+            self.endpoints = [Endpoint(socket_file=socket_file)]
+        else:
+            self.endpoints = [Endpoint(host, port)]
+        self.balancer = balancer or RoundRobin()
+        self.hedging = hedging
         self.user = user
         if isinstance(backend, str):
             self.backend_mod = load_backend(backend)
@@ -144,26 +261,53 @@ class SpamC(object):
             self.backend_mod = backend
         self.max_tries = max_tries
         self.wait_tries = wait_tries
+        if retry_policy is None:
+            retry_policy = RetryPolicy(
+                max_tries=max_tries, base=wait_tries, budget=RetryBudget())
+        self.retry_policy = retry_policy
         self.timeout = timeout
+        self.connect_timeout = _default(connect_timeout, timeout)
+        self.read_timeout = _default(read_timeout, timeout)
+        self.send_timeout = _default(send_timeout, timeout)
+        self.total_timeout = total_timeout
+        self.latency_model = latency_model
         self.gzip = gzip
         self.compress_level = compress_level
         self.is_ssl = is_ssl
         self.ssl_args = ssl_args or {}
+        self.metrics = metrics
+        self.slowlog = slowlog
+        self.tracer = tracer or Tracer()
+        self.profiler = profiler
+        self.accounting = accounting
+        self.admission = admission
+        self.shedder = shedder
+        self.cache = cache
+        self.coalescer = coalescer
+        self.neardup = neardup
+        self.known = known
+        self.prefilter = prefilter
+        self.classifier = classifier
+        for component in (self.balancer, admission, coalescer):
+            if component is not None:
+                component.bind(self.backend_mod)
+        if metrics is not None:
+            for source in (admission, shedder, classifier):
+                if source is not None:
+                    source.register(metrics)
+
+    @property
+    def endpoint(self):
+        """Return a printable name of the primary spamd endpoint"""
+        return self.endpoints[0].name
 
-    def get_connection(self):
+    def get_connection(self, deadline=None, endpoint=None):
         """Creates a new connection"""
-        if self.host is None:
-            connector = SpamCUnixConnector
-            conn = connector(self.socket_file, self.backend_mod)
-        else:
-            connector = SpamCTcpConnector
-            conn = connector(
-                self.host,
-                self.port,
-                self.backend_mod,
-                is_ssl=self.is_ssl,
-                **self.ssl_args)
-        return conn
+        timeout = deadline_timeout(self.connect_timeout, deadline)
+        if endpoint is None:
+            endpoint = self.endpoints[0]
+        return endpoint.connect(
+            self.backend_mod, timeout, self.is_ssl, self.ssl_args)
 
     def get_headers(self, cmd, msg_length, extra_headers):
         """Returns the headers string based on command to execute"""
@@ -183,104 +327,447 @@ class SpamC(object):
         headers.append('')
         return '\r\n'.join(headers)
 
-    # pylint: disable=E1103
-    def perform(self, cmd, msg='', extra_headers=None):
-        """Perform the call"""
+    def record(self, stats):
+        """Feed the statistics of a finished request to the observers"""
+        if self.metrics is not None:
+            self.metrics.record(stats)
+        if self.slowlog is not None:
+            self.slowlog.record(stats)
+        if self.accounting is not None:
+            self.accounting.record(stats)
+        if self.latency_model is not None:
+            self.latency_model.record(stats)
+        if self.shedder is not None:
+            self.shedder.record(stats)
+
+    # pylint: disable=R0913
+    def perform(self, cmd, msg='', extra_headers=None, correlation_id=None,
+                routing_key=None, priority=None, high_risk=False):
+        """Perform the call, correlation_id is used as the trace id,
+        routing_key overrides the user when a balancer routes by key,
+        priority is the admission lane, interactive, normal or bulk, and
+        high_risk messages are the first to be shed under overload"""
+        span = self.tracer.start_span(cmd, correlation_id)
+        stats = RequestStats(cmd, self.user, self.endpoint, span)
+        stats.routing_key = routing_key
+        stats.priority = priority or COMMAND_LANES.get(cmd, DEFAULT_LANE)
+        stats.high_risk = high_risk
+        try:
+            if self.coalescer is not None and self.coalescer.applies(cmd):
+                result, shared = self.coalescer.call(
+                    self.coalescer.key(cmd, self.user, extra_headers, msg),
+                    self._answer, cmd, msg, extra_headers, stats)
+                if shared:
+                    stats.coalesced = True
+                    stats.endpoint = None
+            else:
+                result = self._answer(cmd, msg, extra_headers, stats)
+        except BaseException as err:
+            stats.finish(err)
+            self.record(stats)
+            raise
+        stats.finish()
+        self.record(stats)
+        return result
+
+    def _answer(self, cmd, msg, extra_headers, stats):
+        """Answer the request from the pre-filter rules, the known spam
+        digests or the cache when they apply or spamd"""
+        if self.prefilter is not None and self.prefilter.applies(cmd):
+            result = self.prefilter.check(msg)
+            if result is not None:
+                stats.cache = 'prefilter'
+                stats.endpoint = None
+                return result
+        if self.known is not None and self.known.applies(cmd) and \
+                self.known.digest(msg) in self.known:
+            stats.cache = 'known'
+            stats.endpoint = None
+            return self.known.result()
+        if self.cache is not None and self.cache.applies(cmd):
+            return self._cached(cmd, msg, extra_headers, stats)
+        return self._fetch(cmd, msg, extra_headers, stats)
+
+    def _fetch(self, cmd, msg, extra_headers, stats):
+        """Answer from the verdict of a near duplicate or from spamd,
+        indexing the verdicts of scanned messages"""
+        neardup = self.neardup
+        if neardup is None or not neardup.applies(cmd):
+            return self._classify(cmd, msg, extra_headers, stats)
+        value = neardup.fingerprint(msg)
+        if value is None:
+            return self._classify(cmd, msg, extra_headers, stats)
+        result = neardup.match(value)
+        if result is not None:
+            stats.cache = 'near'
+            stats.endpoint = None
+            return result
+        result = self._classify(cmd, msg, extra_headers, stats)
+        if result is not None and not result.get('shed') and \
+                'classified' not in result:
+            neardup.add(value, copy.deepcopy(result))
+        return result
+
+    def _classify(self, cmd, msg, extra_headers, stats):
+        """Answer from the local classifier when it is confident or from
+        spamd, training it on the spamd verdict"""
+        classifier = self.classifier
+        if classifier is None or not classifier.applies(cmd):
+            return self._execute(cmd, msg, extra_headers, stats)
+        indices = classifier.features(msg)
+        verdict, probability = classifier.verdict(indices)
+        if verdict is not None and not classifier.shadow:
+            stats.cache = 'classifier'
+            stats.endpoint = None
+            return classifier.result(verdict, probability)
+        result = self._execute(cmd, msg, extra_headers, stats)
+        if result is not None and not result.get('shed'):
+            classifier.observe(indices, verdict, result)
+        return result
+
+    def _execute(self, cmd, msg, extra_headers, stats):
+        """Run the request, under the profiler when there is one"""
+        if self.profiler is not None:
+            return self.profiler.call(
+                self._perform, cmd, msg, extra_headers, stats)
+        return self._perform(cmd, msg, extra_headers, stats)
+
+    def _cached(self, cmd, msg, extra_headers, stats):
+        """Answer from the verdict cache or from spamd, keeping the cache
+        up to date"""
+        cache = self.cache
+        key = cache.key(cmd, self.user, extra_headers, msg)
+        state, entry = cache.lookup(key)
+        if state in ('fresh', 'refresh'):
+            stats.cache = 'hit'
+            stats.endpoint = None
+            if state == 'refresh':
+                self.backend_mod.spawn(
+                    self._refresh, key, cmd, _detached(msg), extra_headers)
+            return cache.serve(entry, 'cached')
+        stats.cache = 'miss'
+        try:
+            if state == 'stale' and cache.stale_timeout is not None:
+                result = self._waited(key, cmd, msg, extra_headers, stats)
+            else:
+                result = self._fetch(cmd, msg, extra_headers, stats)
+        except SpamCError:
+            if state == 'stale' and cache.stale_if_error:
+                return self._stale(entry, stats)
+            raise
+        if result is None or result.get('shed'):
+            if state == 'stale':
+                return self._stale(entry, stats)
+            return result
+        if result.get('approximate') or 'classified' in result:
+            # only spamd verdicts of this very message are cached
+            return result
+        cache.store(key, copy.deepcopy(result))
+        return result
+
+    def _stale(self, entry, stats):
+        """Serve a stale cached response"""
+        stats.cache = 'stale'
+        stats.shed = False
+        return self.cache.serve(entry, 'stale')
+
+    def _waited(self, key, cmd, msg, extra_headers, stats):
+        """Run the request in the background, returning None when it
+        takes longer than the cache stale_timeout"""
+        job = dict(queue=self.backend_mod.Queue(), abandoned=False,
+                   lock=threading.Lock())
+        self.backend_mod.spawn(
+            self._refresh, key, cmd, _detached(msg), extra_headers, job)
+        try:
+            outcome = job['queue'].get(timeout=self.cache.stale_timeout)
+        except self.backend_mod.Empty:
+            with job['lock']:
+                job['abandoned'] = True
+                if job['queue'].empty():
+                    # the request is accounted for when it completes
+                    stats.endpoint = None
+                    return None
+            outcome = job['queue'].get()
+        job_stats, result, err = outcome
+        stats.merge(job_stats)
+        stats.shed = job_stats.shed
+        if err is not None:
+            raise err
+        return result
+
+    def _refresh(self, key, cmd, msg, extra_headers, job=None):
+        """Make a request in the background and cache the response,
+        handing it to the caller waiting on job if there still is one"""
+        if job is None:
+            span = self.tracer.start_span(cmd)
+        else:
+            span = NOOP_SPAN
+        stats = RequestStats(cmd, self.user, self.endpoint, span)
+        result = err = None
+        try:
+            result = self._execute(cmd, msg, extra_headers, stats)
+        except Exception as exc:  # pylint: disable=W0703
+            err = exc
+        self.cache.done_refreshing(key)
+        if err is None and not result.get('shed'):
+            self.cache.store(key, copy.deepcopy(result))
+        if job is not None:
+            with job['lock']:
+                if not job['abandoned']:
+                    job['queue'].put((stats, result, err))
+                    return
+        stats.finish(err)
+        self.record(stats)
+
+    def _perform(self, cmd, msg, extra_headers, stats):
+        """Run the request, retrying on transient socket errors"""
         tries = 0
+        delay = None
+        deadline = None
+        if self.total_timeout is not None:
+            deadline = stats.start + self.total_timeout
+        hedge = self.hedging is not None and len(self.endpoints) > 1 and \
+            self.hedging.applies(cmd)
+        if hedge and hasattr(msg, 'read'):
+            # both copies of a hedged request need to read the message
+            if hasattr(msg, 'seek'):
+                msg.seek(0)
+            msg = msg.read()
+        # known up front so balancers can route on it
+        stats.msg_size = get_msg_length(msg)
+        if self.shedder is not None and self.shedder.should_shed(
+                cmd, stats.msg_size, stats.high_risk):
+            stats.shed = True
+            stats.endpoint = None
+            return self.shedder.result(cmd, msg)
+        self.retry_policy.request()
         while 1:
-            conn = None
+            state = dict(sending=False)
+            endpoint = self.balancer.select(self.endpoints, stats)
             try:
-                conn = self.get_connection()
-                if hasattr(msg, 'read') and hasattr(msg, 'fileno'):
-                    msg_length = str(os.fstat(msg.fileno()).st_size)
-                elif hasattr(msg, 'read'):
-                    msg.seek(0, 2)
-                    msg_length = str(msg.tell() + 2)
-                else:
-                    if msg:
-                        try:
-                            msg_length = str(len(msg) + 2)
-                        except TypeError:
-                            conn.close()
-                            raise ValueError(
-                                'msg param should be a string or file handle')
-                    else:
-                        msg_length = '2'
-
-                headers = self.get_headers(cmd, msg_length, extra_headers)
-
-                if isinstance(msg, types.StringTypes):
-                    if self.gzip and msg:
-                        msg = compress(msg + '\r\n', self.compress_level)
-                    else:
-                        msg = msg + '\r\n'
-                    conn.send(headers + msg)
-                else:
-                    conn.send(headers)
-                    if hasattr(msg, 'read'):
-                        if hasattr(msg, 'seek'):
-                            msg.seek(0)
-                        conn.sendfile(msg, self.gzip, self.compress_level)
-                conn.send('\r\n')
-                try:
-                    conn.socket().shutdown(socket.SHUT_WR)
-                except socket.error:
-                    pass
-                return get_response(cmd, conn)
+                if hedge:
+                    return self._hedged(cmd, msg, extra_headers, stats,
+                                        tries, endpoint, deadline, state)
+                stats.endpoint = endpoint.name
+                stats.begin_attempt(tries)
+                result = self._attempt(cmd, msg, extra_headers, stats,
+                                       endpoint, deadline, state)
+                stats.end_attempt()
+                return result
             except socket.gaierror as err:
-                if conn is not None:
-                    conn.release()
+                stats.error(err)
                 raise SpamCError(str(err))
             except socket.timeout as err:
-                if conn is not None:
-                    conn.release()
+                stats.error(err)
                 raise SpamCTimeOutError(str(err))
             except socket.error as err:
-                if conn is not None:
-                    conn.close()
-                errors = (errno.EAGAIN, errno.EPIPE, errno.EBADF,
-                          errno.ECONNRESET)
-                if err[0] not in errors or tries >= self.max_tries:
+                stats.error(err)
+                if not self.retry_policy.should_retry(
+                        cmd, err, tries, state['sending']):
                     raise SpamCError("socket.error: %s" % str(err))
-            except BaseException:
-                if conn is not None:
-                    conn.release()
+            except BaseException as err:
+                stats.error(err)
                 raise
             tries += 1
-            self.backend_mod.sleep(self.wait_tries)
+            delay = self.retry_policy.backoff(delay)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise SpamCTimeOutError('request deadline exceeded')
+            self.backend_mod.sleep(delay)
+
+    # pylint: disable=R0913
+    def _attempt(self, cmd, msg, extra_headers, stats, endpoint, deadline,
+                 state):
+        """Make a single request to endpoint once admitted, keeping the
+        balancer informed"""
+        if self.admission is not None:
+            start = time.time()
+            self.admission.acquire(endpoint, stats.priority, stats.user,
+                                   stats.msg_size, deadline)
+            stats.add_phase('queue', start, time.time())
+        elapsed = ok = None
+        try:
+            self.balancer.start(endpoint, deadline)
+            start = time.time()
+            try:
+                result = self._request(cmd, msg, extra_headers, stats,
+                                       endpoint, deadline, state)
+                ok = True
+                return result
+            except socket.error:
+                # losing hedges are aborted, that says nothing of spamd
+                if not state.get('aborted'):
+                    ok = False
+                raise
+            finally:
+                elapsed = time.time() - start
+                self.balancer.finish(endpoint, elapsed, ok)
+        finally:
+            if self.admission is not None:
+                self.admission.release(endpoint, elapsed, ok)
 
-    def check(self, msg):
+    # pylint: disable=E1103,R0914
+    def _request(self, cmd, msg, extra_headers, stats, endpoint, deadline,
+                 state):
+        """Send a request to endpoint and read the response, unless it is
+        a hedge that lost before sending"""
+        conn = None
+        try:
+            _check_aborted(state)
+            conn = self.get_connection(deadline, endpoint)
+            state['conn'] = conn
+            _check_aborted(state)
+            for phase, start, end in conn.timings:
+                stats.add_phase(phase, start, end)
+            stats.mark()
+            conn.settimeout(self.send_timeout, deadline)
+            stats.msg_size = get_msg_length(msg)
+            msg_length = str(stats.msg_size)
+
+            headers = self.get_headers(cmd, msg_length, extra_headers)
+            state['sending'] = True
+
+            if isinstance(msg, types.StringTypes):
+                if self.gzip and msg:
+                    start = time.time()
+                    body = compress(msg + '\r\n', self.compress_level)
+                    stats.compress_time += time.time() - start
+                    stats.compressed_size = len(body)
+                else:
+                    body = msg + '\r\n'
+                conn.send(headers + body)
+                stats.bytes_sent += len(headers) + len(body)
+            else:
+                conn.send(headers)
+                stats.bytes_sent += len(headers)
+                if hasattr(msg, 'read'):
+                    if hasattr(msg, 'seek'):
+                        msg.seek(0)
+                    sent = conn.sendfile(msg, self.gzip, self.compress_level)
+                    stats.bytes_sent += sent
+                    if self.gzip:
+                        stats.compressed_size = sent
+                        stats.compress_time += conn.compress_time
+            conn.send('\r\n')
+            stats.bytes_sent += 2
+            try:
+                conn.socket().shutdown(socket.SHUT_WR)
+            except socket.error:
+                pass
+            stats.lap('send')
+            read_timeout = self.read_timeout
+            if self.latency_model is not None:
+                read_timeout = self.latency_model.read_timeout(
+                    stats.endpoint, stats.msg_size, read_timeout)
+            conn.settimeout(read_timeout, deadline)
+            return get_response(cmd, conn, stats)
+        except (socket.gaierror, socket.timeout):
+            if conn is not None:
+                conn.release()
+            raise
+        except socket.error:
+            if conn is not None:
+                conn.close()
+            raise
+        except BaseException:
+            if conn is not None:
+                conn.release()
+            raise
+
+    # pylint: disable=R0913
+    def _hedged(self, cmd, msg, extra_headers, stats, tries, primary,
+                deadline, state):
+        """Make a request to primary and, if it is slow, a second one to
+        another endpoint, returning the first response"""
+        results = self.backend_mod.Queue()
+        states = {}
+
+        def run(endpoint, attempt_state):
+            """Make one of the attempts and queue its outcome"""
+            attempt_stats = RequestStats(
+                cmd, self.user, endpoint.name, stats.span)
+            attempt_stats.priority = stats.priority
+            attempt_stats.begin_attempt(tries)
+            try:
+                result = self._attempt(cmd, msg, extra_headers,
+                                       attempt_stats, endpoint, deadline,
+                                       attempt_state)
+            except BaseException as err:  # pylint: disable=W0703
+                attempt_stats.end_attempt(err)
+                results.put((endpoint, attempt_stats, None, err))
+            else:
+                attempt_stats.end_attempt()
+                results.put((endpoint, attempt_stats, result, None))
+
+        # states are recorded before spawning so that an attempt which
+        # has not started yet is still aborted when the other one wins
+        states[primary] = state
+        self.backend_mod.spawn(run, primary, state)
+        pending = 1
+        try:
+            outcome = results.get(timeout=self.hedging.delay(
+                primary.name, stats.msg_size, self.latency_model))
+            pending -= 1
+        except self.backend_mod.Empty:
+            outcome = None
+            if self.hedging.allow():
+                secondary = self.balancer.select(
+                    self.endpoints, stats, exclude=(primary,))
+                if secondary is not primary:
+                    stats.hedge = 'primary'
+                    states[secondary] = dict(sending=False)
+                    self.backend_mod.spawn(run, secondary, states[secondary])
+                    pending += 1
+        while outcome is None or (outcome[3] is not None and pending):
+            failed = outcome
+            outcome = results.get()
+            pending -= 1
+            if outcome[3] is not None and failed is not None:
+                outcome = failed
+        endpoint, attempt_stats, result, err = outcome
+        stats.merge(attempt_stats)
+        if stats.hedge is not None and endpoint is not primary:
+            stats.hedge = 'hedge'
+        for other, other_state in list(states.items()):
+            if other is not endpoint:
+                other_state['aborted'] = True
+                if 'conn' in other_state:
+                    other_state['conn'].abort()
+        if err is not None:
+            raise err
+        return result
+
+    def check(self, msg, **kwargs):
         """Check if the passed message is spam or not"""
-        return self.perform('CHECK', msg)
+        return self.perform('CHECK', msg, **kwargs)
 
-    def symbols(self, msg):
+    def symbols(self, msg, **kwargs):
         """Check if message is spam or not, and return score plus list
         of symbols hit"""
-        return self.perform('SYMBOLS', msg)
+        return self.perform('SYMBOLS', msg, **kwargs)
 
-    def report(self, msg):
+    def report(self, msg, **kwargs):
         """Check if message is spam or not, and return score plus report"""
-        return self.perform('REPORT', msg)
+        return self.perform('REPORT', msg, **kwargs)
 
-    def report_ifspam(self, msg):
+    def report_ifspam(self, msg, **kwargs):
         """Check if message is spam or not, and return score plus report
         if the message is spam"""
-        return self.perform('REPORT_IFSPAM', msg)
+        return self.perform('REPORT_IFSPAM', msg, **kwargs)
 
-    def ping(self):
+    def ping(self, **kwargs):
         """Return a confirmation that spamd is alive"""
-        return self.perform('PING')
+        return self.perform('PING', **kwargs)
 
-    def process(self, msg):
+    def process(self, msg, **kwargs):
         """Check if message is spam or not, and return modified message"""
-        return self.perform('PROCESS', msg)
+        return self.perform('PROCESS', msg, **kwargs)
 
-    def headers(self, msg):
+    def headers(self, msg, **kwargs):
         """Check if message is spam or not, and return only modified
         headers, not body"""
-        return self.perform('HEADERS', msg)
+        return self.perform('HEADERS', msg, **kwargs)
 
-    def tell(self, msg, action, learnas=''):
+    def tell(self, msg, action, learnas='', **kwargs):
         """Tell what type of we are to process and what should be done
         with that message. This includes setting or removing a local
         or a remote database (learning, reporting, forgetting, revoking)."""
@@ -309,18 +796,24 @@ class SpamC(object):
         elif action == 'revoke':
             headers['Message-class'] = 'ham'
             headers['Remove'] = 'remote'
-        return self.perform('TELL', msg, headers)
+        resp = self.perform('TELL', msg, headers, **kwargs)
+        if self.known is not None:
+            self.known.learn(self.known.digest(msg),
+                             headers.get('Message-class') or 'forget')
+        if self.classifier is not None and 'Message-class' in headers:
+            self.classifier.learn(msg, headers['Message-class'] == 'spam')
+        return resp
 
-    def learn(self, msg, learnas):
+    def learn(self, msg, learnas, **kwargs):
         """Learn message as spam/ham or forget"""
         if not isinstance(learnas, types.StringTypes):
             raise SpamCError('The learnas option is invalid')
         if learnas.lower() == 'forget':
-            resp = self.tell(msg, 'forget')
+            resp = self.tell(msg, 'forget', **kwargs)
         else:
-            resp = self.tell(msg, 'learn', learnas)
+            resp = self.tell(msg, 'learn', learnas, **kwargs)
         return resp
 
-    def revoke(self, msg):
+    def revoke(self, msg, **kwargs):
         """Tell spamd message is not spam"""
-        return self.tell(msg, 'revoke')
+        return self.tell(msg, 'revoke', **kwargs)
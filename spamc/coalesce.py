@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+request coalescing
+"""
+import copy
+import threading
+
+from spamc.utils import BackendUser
+from spamc.cache import CACHE_COMMANDS, cache_key
+
+
+class Coalescer(BackendUser):
+    """Share one spamd round trip between identical concurrent requests
+
+    The first request for a key is made and any identical request
+    arriving while it is in flight waits for it instead, getting a copy
+    of its response, flagged coalesced=True, or its exception. Waiting
+    uses backend queues so it works with threads and greenlets, those of
+    the client unless backend is given."""
+
+    def __init__(self, backend=None, key_func=cache_key,
+                 commands=CACHE_COMMANDS):
+        """Init"""
+        self.set_backend(backend)
+        self.key_func = key_func
+        self.commands = commands
+        self.flights = {}
+        self._lock = threading.Lock()
+
+    def applies(self, cmd):
+        """Return True if requests for cmd are coalesced"""
+        return cmd in self.commands
+
+    def key(self, cmd, user, extra_headers, msg):
+        """Return the key identical requests share"""
+        return self.key_func(cmd, user, extra_headers, msg)
+
+    def call(self, key, func, *args):
+        """Return (result, shared) where result is that of func(*args),
+        or of the identical call in flight in which case shared is
+        True"""
+        with self._lock:
+            waiters = self.flights.get(key)
+            if waiters is None:
+                self.flights[key] = []
+            else:
+                waiter = self.backend_mod.Queue()
+                waiters.append(waiter)
+        if waiters is not None:
+            result, err = waiter.get()
+            if err is not None:
+                raise err
+            return result, True
+        try:
+            result = func(*args)
+        except BaseException as err:
+            self._land(key, None, err)
+            raise
+        self._land(key, result, None)
+        return result, False
+
+    def _land(self, key, result, err):
+        """Hand the outcome of the call for key to its waiters"""
+        with self._lock:
+            waiters = self.flights.pop(key)
+        for waiter in waiters:
+            if result is not None:
+                shared = copy.deepcopy(result)
+                shared['coalesced'] = True
+                waiter.put((shared, None))
+            else:
+                waiter.put((None, err))
+
+    def __len__(self):
+        """Return the number of requests in flight"""
+        return len(self.flights)
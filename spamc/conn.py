@@ -20,6 +20,8 @@ spamc: Python spamassassin spamc client library
 connections
 """
 import ssl
+import time
+import errno
 import socket
 
 from zlib import compressobj
@@ -30,12 +32,28 @@ BLOCK_SIZE = 64
 CHUNK_SIZE = 16 * 1024
 
 
+def deadline_timeout(timeout, deadline):
+    """Return timeout clipped to the time left before deadline"""
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise socket.timeout('request deadline exceeded')
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
+
+
 class Connector(object):
     """Base class for our connectors"""
     def __init__(self):
         # pylint: disable=invalid-name
         self._s = None
         self._connected = False
+        self.timings = []
+        self.compress_time = 0.0
+        self.idle_timeout = None
+        self.deadline = None
 
     def __del__(self):
         "del"
@@ -65,24 +83,58 @@ class Connector(object):
         except BaseException:
             pass
 
+    def abort(self):
+        """Shut the connection down, waking up any blocked reader"""
+        try:
+            self._s.shutdown(socket.SHUT_RDWR)
+        except BaseException:
+            pass
+        self.close()
+
     def invalidate(self):
         "close"
         self._s.close()
         self._connected = False
 
+    def settimeout(self, idle_timeout, deadline=None):
+        """Set the idle timeout for socket operations, capped so that no
+        operation runs past deadline"""
+        self.idle_timeout = idle_timeout
+        self.deadline = deadline
+        self._s.settimeout(deadline_timeout(idle_timeout, deadline))
+
     def send(self, data):
         "send data"
+        if self.deadline is not None:
+            self._s.settimeout(
+                deadline_timeout(self.idle_timeout, self.deadline))
         return self._s.sendall(data)
 
-    # def recv(self, size=1024):
-    #     "receive data"
-    #     return self._s.recv(size)
+    def read(self):
+        """Read until the peer closes the connection, capping every
+        receive so that the whole read does not run past the deadline"""
+        chunks = []
+        while True:
+            if self.deadline is not None:
+                self._s.settimeout(
+                    deadline_timeout(self.idle_timeout, self.deadline))
+            try:
+                data = self._s.recv(CHUNK_SIZE)
+            except socket.error as err:
+                if err.args and err.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                break
+            chunks.append(data)
+        return ''.join(chunks)
 
     def sendfile(self, data, zlib_compress=None, compress_level=6):
-        """Send data from a file object"""
+        """Send data from a file object, returns the bytes sent"""
         if hasattr(data, 'seek'):
             data.seek(0)
 
+        sent = 0
         chunk_size = CHUNK_SIZE
 
         if zlib_compress:
@@ -94,28 +146,38 @@ class Connector(object):
             if binarydata == '':
                 break
             if zlib_compress:
+                start = time.time()
                 binarydata = compressor.compress(binarydata)
+                self.compress_time += time.time() - start
                 if not binarydata:
                     continue
             self.send(binarydata)
+            sent += len(binarydata)
 
         if zlib_compress:
+            start = time.time()
             remaining = compressor.flush()
+            self.compress_time += time.time() - start
             while remaining:
                 binarydata = remaining[:BLOCK_SIZE]
                 remaining = remaining[BLOCK_SIZE:]
                 self.send(binarydata)
+                sent += len(binarydata)
+        return sent
 
 
 class SpamCUnixConnector(Connector):
     """UnixConnector"""
 
-    def __init__(self, socket_file, backend_mod):
+    def __init__(self, socket_file, backend_mod, timeout=None):
         # pylint: disable=invalid-name
         super(SpamCUnixConnector, self).__init__()
         self._s = backend_mod.Socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._s.settimeout(timeout)
         self.socket_file = socket_file
+        start = time.time()
         self._s.connect(self.socket_file)
+        self.timings.append(('connect', start, time.time()))
         self.backend_mod = backend_mod
         self._connected = True
 
@@ -123,15 +185,22 @@ class SpamCUnixConnector(Connector):
 class SpamCTcpConnector(Connector):
     """SpamCTcpConnector"""
 
-    def __init__(self, host, port, backend_mod, is_ssl=False, **ssl_args):
+    # pylint: disable=R0913
+    def __init__(self, host, port, backend_mod, is_ssl=False, timeout=None,
+                 **ssl_args):
         # pylint: disable=invalid-name
         super(SpamCTcpConnector, self).__init__()
         self._s = backend_mod.Socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._s.settimeout(timeout)
+        start = time.time()
         self._s.connect((host, port))
+        self.timings.append(('connect', start, time.time()))
         self.host = host
         self.port = port
         self.backend_mod = backend_mod
         self._connected = True
         if is_ssl:
+            start = time.time()
             self._s = ssl.wrap_socket(self._s, **ssl_args)
+            self.timings.append(('tls', start, time.time()))
         self.is_ssl = is_ssl
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+spamd endpoints
+"""
+import types
+
+from itertools import count
+
+from spamc.conn import SpamCTcpConnector, SpamCUnixConnector
+
+
+class Endpoint(object):
+    """A spamd server reachable over TCP or a unix socket"""
+
+    def __init__(self, host=None, port=783, socket_file=None):
+        """Init"""
+        self.host = host
+        self.port = port
+        self.socket_file = socket_file
+        if host is None:
+            self.name = socket_file
+        else:
+            self.name = '%s:%s' % (host, port)
+
+    def __repr__(self):
+        """repr"""
+        return '<Endpoint %s>' % self.name
+
+    def connect(self, backend_mod, timeout=None, is_ssl=None, ssl_args=None):
+        """Return a new connection to the endpoint"""
+        if self.host is None:
+            return SpamCUnixConnector(self.socket_file, backend_mod, timeout)
+        return SpamCTcpConnector(
+            self.host,
+            self.port,
+            backend_mod,
+            is_ssl=is_ssl,
+            timeout=timeout,
+            **(ssl_args or {}))
+
+
+def get_endpoint(spec, port=783):
+    """Return an Endpoint from an Endpoint, a (host, port) tuple,
+    a host:port string or a unix socket path"""
+    if isinstance(spec, Endpoint):
+        return spec
+    if isinstance(spec, tuple):
+        return Endpoint(*spec)
+    if not isinstance(spec, types.StringTypes):
+        raise ValueError('Invalid spamd endpoint: %r' % (spec,))
+    if spec.startswith('/'):
+        return Endpoint(socket_file=spec)
+    if ':' in spec:
+        host, port = spec.rsplit(':', 1)
+        return Endpoint(host, int(port))
+    return Endpoint(spec, port)
+
+
+class Balancer(object):
+    """Base class of the endpoint selection policies"""
+
+    def bind(self, backend_mod):
+        """Use the backend of the client the balancer serves"""
+        pass
+
+    def select(self, endpoints, stats, exclude=()):
+        """Return the endpoint to use for a request"""
+        raise NotImplementedError
+
+    def start(self, endpoint, deadline=None):
+        """A request to endpoint is starting, this may wait for capacity
+        until the request deadline or raise, and finish is only called
+        if it returns"""
+        pass
+
+    def finish(self, endpoint, elapsed, ok):
+        """A request to endpoint finished after elapsed seconds, ok is
+        False on network errors and None when the outcome says nothing
+        about the endpoint"""
+        pass
+
+    def report(self, endpoint, ok):
+        """Record the result of a health check of endpoint"""
+        pass
+
+
+class RoundRobin(Balancer):
+    """Select endpoints in turn"""
+
+    def __init__(self):
+        """Init"""
+        self._counter = count()
+
+    def select(self, endpoints, stats, exclude=()):
+        """Return the endpoint to use for a request"""
+        # pylint: disable=unused-argument
+        candidates = [endpoint for endpoint in endpoints
+                      if endpoint not in exclude] or endpoints
+        return candidates[next(self._counter) % len(candidates)]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+request hedging
+"""
+from spamc.retry import RetryBudget
+
+# read only commands that are safe to send twice
+HEDGE_COMMANDS = ('CHECK', 'SYMBOLS', 'REPORT', 'REPORT_IFSPAM', 'HEADERS')
+
+
+class HedgePolicy(object):
+    """Send a second copy of slow read only requests to another endpoint
+
+    The hedge is sent after delay seconds or, when delay is None and the
+    client has a latency model, after the observed quantile of the spamd
+    wait time. Hedges are limited to max_ratio of the requests."""
+
+    # pylint: disable=R0913
+    def __init__(self, delay=None, quantile=0.95, default_delay=1.0,
+                 min_delay=0.01, max_ratio=0.05, commands=HEDGE_COMMANDS):
+        """Init"""
+        self.fixed_delay = delay
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.commands = commands
+        self.budget = RetryBudget(
+            ratio=max_ratio, min_per_second=0, max_tokens=10)
+
+    def applies(self, cmd):
+        """Return True if cmd may be hedged, accounting for the request"""
+        if cmd not in self.commands:
+            return False
+        self.budget.deposit()
+        return True
+
+    def delay(self, endpoint, size, latency_model=None):
+        """Return how long to wait before hedging"""
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        latency = None
+        if latency_model is not None:
+            latency = latency_model.latency(endpoint, size, self.quantile)
+        if latency is None:
+            return self.default_delay
+        return max(self.min_delay, latency)
+
+    def allow(self):
+        """Return True if the extra load budget allows a hedge"""
+        return self.budget.withdraw()
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+known spam pre-screen
+"""
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+import binascii
+import threading
+
+from spamc.cache import canonical_digest
+from spamc.client import make_response
+
+BLOOM_MAGIC = 'SPBF'
+BLOOM_HEADER = struct.Struct('>4sQI')
+DIGEST_SIZE = hashlib.sha1().digest_size
+KNOWN_SPAM = 'KNOWN_SPAM'
+# commands answered from the known spam digests
+KNOWN_COMMANDS = ('CHECK',)
+# learn journal actions, spam adds a digest, the others remove it
+JOURNAL_ACTIONS = ('spam', 'ham', 'forget')
+
+
+def message_digest(msg):
+    """Return the binary digest a message is known by, that of its
+    canonical form so relayed copies share it"""
+    return canonical_digest(msg).digest()
+
+
+def bloom_size(capacity, error_rate):
+    """Return the (bits, hashes) of a filter holding capacity digests
+    with the given false positive rate"""
+    bits = int(math.ceil(
+        -capacity * math.log(error_rate) / math.log(2) ** 2))
+    bits = max(8, (bits + 7) // 8 * 8)
+    hashes = max(1, int(round(float(bits) / capacity * math.log(2))))
+    return bits, hashes
+
+
+class BloomFilter(object):
+    """Bloom filter of message digests in a memory map
+
+    The filter lives in the file at path, created for capacity digests
+    at error_rate false positives when it does not exist, or in
+    anonymous memory when path is None. Additions are written straight
+    to the map."""
+
+    def __init__(self, path=None, capacity=1000000, error_rate=0.001):
+        """Init"""
+        self.path = path
+        if path is not None and os.path.exists(path):
+            handle = open(path, 'r+b')
+            magic, self.bits, self.hashes = BLOOM_HEADER.unpack(
+                handle.read(BLOOM_HEADER.size))
+            if magic != BLOOM_MAGIC:
+                handle.close()
+                raise ValueError('%s is not a bloom filter' % path)
+        else:
+            self.bits, self.hashes = bloom_size(capacity, error_rate)
+            handle = None
+            if path is not None:
+                handle = open(path, 'w+b')
+                handle.write(BLOOM_HEADER.pack(
+                    BLOOM_MAGIC, self.bits, self.hashes))
+                handle.truncate(BLOOM_HEADER.size + self.bits // 8)
+                handle.flush()
+        size = BLOOM_HEADER.size + self.bits // 8
+        if handle is None:
+            self.map = mmap.mmap(-1, size)
+            self.map[:BLOOM_HEADER.size] = BLOOM_HEADER.pack(
+                BLOOM_MAGIC, self.bits, self.hashes)
+        else:
+            self.map = mmap.mmap(handle.fileno(), size)
+            handle.close()
+        self._lock = threading.Lock()
+
+    def _positions(self, digest):
+        """Return the bit positions of a digest"""
+        first, second = struct.unpack('>QQ', digest[:16])
+        second |= 1
+        return [(first + index * second) % self.bits
+                for index in range(self.hashes)]
+
+    def add(self, digest):
+        """Add a digest"""
+        with self._lock:
+            for position in self._positions(digest):
+                offset = BLOOM_HEADER.size + (position >> 3)
+                self.map[offset] = chr(
+                    ord(self.map[offset]) | 1 << (position & 7))
+
+    def __contains__(self, digest):
+        """Return True if digest may have been added"""
+        for position in self._positions(digest):
+            offset = BLOOM_HEADER.size + (position >> 3)
+            if not ord(self.map[offset]) & 1 << (position & 7):
+                return False
+        return True
+
+    def flush(self):
+        """Write the filter to its file"""
+        self.map.flush()
+
+    def close(self):
+        """Unmap the filter"""
+        self.map.close()
+
+
+class DigestFile(object):
+    """Sorted file of binary digests searched in a memory map"""
+
+    def __init__(self, path):
+        """Init"""
+        self.path = path
+        self.map = None
+        self.count = 0
+        if path is not None and os.path.exists(path) and \
+                os.path.getsize(path):
+            with open(path, 'rb') as handle:
+                self.map = mmap.mmap(
+                    handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self.count = len(self.map) // DIGEST_SIZE
+
+    def __contains__(self, digest):
+        """Return True if digest is in the file"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * DIGEST_SIZE
+            value = self.map[offset:offset + DIGEST_SIZE]
+            if value == digest:
+                return True
+            if value < digest:
+                low = middle + 1
+            else:
+                high = middle
+        return False
+
+    def __iter__(self):
+        """Iterate over the digests in order"""
+        for index in range(self.count):
+            offset = index * DIGEST_SIZE
+            yield self.map[offset:offset + DIGEST_SIZE]
+
+    def __len__(self):
+        """Return the number of digests"""
+        return self.count
+
+    def close(self):
+        """Unmap the file"""
+        if self.map is not None:
+            self.map.close()
+
+
+class LearnJournal(object):
+    """Append only log of the digests learnt as spam or ham"""
+
+    def __init__(self, path):
+        """Init"""
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, action, digest, now=None):
+        """Record that the message with digest was learnt as action"""
+        if action not in JOURNAL_ACTIONS:
+            raise ValueError('Invalid journal action: %s' % action)
+        if now is None:
+            now = time.time()
+        line = '%d %s %s\n' % (now, action, binascii.hexlify(digest))
+        with self._lock:
+            with open(self.path, 'ab') as handle:
+                handle.write(line)
+
+    def __iter__(self):
+        """Iterate over the (time, action, digest) entries"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as handle:
+            for line in handle:
+                parts = line.split()
+                if len(parts) != 3 or parts[1] not in JOURNAL_ACTIONS:
+                    # torn write
+                    continue
+                yield int(parts[0]), parts[1], binascii.unhexlify(parts[2])
+
+    def changes(self):
+        """Return a dict of digest to True when it was last learnt as
+        spam and False otherwise"""
+        return dict([(digest, action == 'spam')
+                     for _, action, digest in self])
+
+
+# pylint: disable=R0902
+class KnownSpam(object):
+    """Answer scans of messages already learnt as spam without spamd
+
+    The digests of the canonical form of messages learnt as spam are
+    kept in directory: a sorted digest file and a memory mapped Bloom
+    filter, both written by rebuild(), and a learn journal of the
+    changes since. A message whose digest is in the filter, and then
+    found by an exact lookup, gets a spam verdict flagged known=True
+    instead of a scan. SpamC.tell() and learn() update the filter and
+    the journal as they go, rebuild() folds the journal into the digest
+    file offline. Without a directory everything is kept in memory."""
+
+    # pylint: disable=R0913
+    def __init__(self, directory=None, capacity=1000000, error_rate=0.001,
+                 score=100.0, threshold=5.0, commands=KNOWN_COMMANDS):
+        """Init"""
+        self.directory = directory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.score = score
+        self.threshold = threshold
+        self.commands = commands
+        self._lock = threading.Lock()
+        self.open()
+
+    def open(self):
+        """Open the filter, digest file and journal of the directory"""
+        if self.directory is None:
+            bloom = BloomFilter(None, self.capacity, self.error_rate)
+            digests = DigestFile(None)
+            journal = None
+            changes = {}
+        else:
+            paths = known_paths(self.directory)
+            bloom = BloomFilter(paths['bloom'], self.capacity,
+                                self.error_rate)
+            digests = DigestFile(paths['digests'])
+            journal = LearnJournal(paths['journal'])
+            changes = journal.changes()
+            for digest, spam in changes.items():
+                if spam:
+                    bloom.add(digest)
+        with self._lock:
+            self.bloom, self.digests = bloom, digests
+            self.journal, self.changes = journal, changes
+
+    def reload(self):
+        """Pick up the files written by rebuild(), the old maps are
+        left to the scans still using them and unmapped once they are
+        garbage collected"""
+        self.open()
+
+    def applies(self, cmd):
+        """Return True if cmd may be answered from known digests"""
+        return cmd in self.commands
+
+    def digest(self, msg):
+        """Return the digest of a message"""
+        return message_digest(msg)
+
+    def __contains__(self, digest):
+        """Return True if digest is that of known spam"""
+        with self._lock:
+            bloom, digests = self.bloom, self.digests
+            spam = self.changes.get(digest)
+        if digest not in bloom:
+            return False
+        if spam is not None:
+            return spam
+        return digest in digests
+
+    def learn(self, digest, action):
+        """Record that a message was learnt as spam, ham or forgotten"""
+        spam = action == 'spam'
+        with self._lock:
+            self.changes[digest] = spam
+        if spam:
+            self.bloom.add(digest)
+        if self.journal is not None:
+            self.journal.append(action, digest)
+
+    def result(self):
+        """Return the response to a scan of known spam"""
+        return make_response(KNOWN_SPAM, True, self.score, self.threshold,
+                             known=True)
+
+    def __len__(self):
+        """Return the number of known digests"""
+        with self._lock:
+            digests, changes = self.digests, self.changes.items()
+        count = len(digests)
+        for digest, spam in changes:
+            if spam != (digest in digests):
+                count += 1 if spam else -1
+        return count
+
+
+def known_paths(directory):
+    """Return the paths of the files of a known spam directory"""
+    return dict(bloom=os.path.join(directory, 'known.bloom'),
+                digests=os.path.join(directory, 'known.digests'),
+                journal=os.path.join(directory, 'learn.journal'))
+
+
+def rebuild(directory, capacity=None, error_rate=0.001):
+    """Fold the learn journal of directory into its digest file and
+    write a new Bloom filter, sized for capacity digests or twice the
+    number known, returning that number. Clients reload() afterwards."""
+    paths = known_paths(directory)
+    if os.path.exists(paths['journal']):
+        # clients start a new journal while this one is folded in
+        os.rename(paths['journal'], paths['journal'] + '.1')
+    changes = LearnJournal(paths['journal'] + '.1').changes()
+    digests = DigestFile(paths['digests'])
+    added = sorted([digest for digest, spam in changes.items() if spam])
+    temp = paths['digests'] + '.new'
+    count = 0
+    with open(temp, 'wb') as handle:
+        pending = iter(added)
+        extra = next(pending, None)
+        for digest in digests:
+            while extra is not None and extra < digest:
+                handle.write(extra)
+                count += 1
+                extra = next(pending, None)
+            if extra == digest:
+                extra = next(pending, None)
+            if changes.get(digest, True):
+                handle.write(digest)
+                count += 1
+        while extra is not None:
+            handle.write(extra)
+            count += 1
+            extra = next(pending, None)
+    digests.close()
+    bloom_temp = paths['bloom'] + '.new'
+    if os.path.exists(bloom_temp):
+        os.unlink(bloom_temp)
+    bloom = BloomFilter(bloom_temp, capacity or max(1000, count * 2),
+                        error_rate)
+    digests = DigestFile(temp)
+    for digest in digests:
+        bloom.add(digest)
+    digests.close()
+    bloom.flush()
+    bloom.close()
+    os.rename(temp, paths['digests'])
+    os.rename(bloom_temp, paths['bloom'])
+    return count
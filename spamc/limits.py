@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+concurrency limits
+"""
+import time
+import socket
+import threading
+
+from collections import deque
+
+from spamc.conn import deadline_timeout
+from spamc.utils import load_backend, BackendUser, TokenBucket
+from spamc.exceptions import SpamCConnError
+
+# request priorities, highest first
+LANES = ('interactive', 'normal', 'bulk')
+DEFAULT_LANE = 'normal'
+# lanes of commands that are not given a priority
+COMMAND_LANES = {'TELL': 'bulk'}
+RATE_POLICIES = ('queue', 'shed')
+
+
+class FairQueue(object):
+    """Waiters queued per user and served by deficit round robin
+
+    Every user with waiters is given quantum credit per round and a
+    waiter is served once its user has credit for its cost. Without a
+    quantum every waiter costs one, sharing slots equally by request,
+    with one the cost passed to append() is used, such as the message
+    size. Only users with waiters are kept."""
+
+    def __init__(self, quantum=None):
+        """Init"""
+        self.quantum = quantum
+        self.queues = {}
+        self.deficits = {}
+        self.active = deque()
+        self.size = 0
+
+    def __len__(self):
+        """Return the number of waiters"""
+        return self.size
+
+    def __contains__(self, waiter):
+        """Return True if waiter is queued"""
+        for queue in self.queues.values():
+            for item in queue:
+                if item[0] is waiter:
+                    return True
+        return False
+
+    def append(self, waiter, user=None, cost=1):
+        """Queue a waiter of user"""
+        queue = self.queues.get(user)
+        if queue is None:
+            queue = self.queues[user] = deque()
+            # the head of the round already had its turn of credit
+            self.deficits[user] = 0 if self.active else \
+                self.quantum or 1
+            self.active.append(user)
+        queue.append((waiter, cost if self.quantum else 1))
+        self.size += 1
+
+    def popleft(self):
+        """Remove and return the next waiter"""
+        while True:
+            user = self.active[0]
+            queue = self.queues[user]
+            waiter, cost = queue[0]
+            if self.deficits[user] >= cost:
+                self.deficits[user] -= cost
+                queue.popleft()
+                self.size -= 1
+                if not queue:
+                    self._drop(user)
+                return waiter
+            self.active.rotate(-1)
+            self.deficits[self.active[0]] += self.quantum or 1
+
+    def remove(self, waiter):
+        """Remove a waiter that gave up"""
+        for user, queue in self.queues.items():
+            for item in queue:
+                if item[0] is waiter:
+                    queue.remove(item)
+                    self.size -= 1
+                    if not queue:
+                        self._drop(user)
+                    return
+        raise ValueError('waiter is not queued')
+
+    def _drop(self, user):
+        """Forget a user without waiters"""
+        head = self.active[0] == user
+        self.active.remove(user)
+        del self.queues[user]
+        del self.deficits[user]
+        if head and self.active:
+            self.deficits[self.active[0]] += self.quantum or 1
+
+
+class UserRateLimits(object):
+    """Token bucket rate limits per user
+
+    Every user may make rate requests per second with bursts of burst.
+    At most max_users buckets are kept, users idle for idle_time seconds
+    being evicted first and the least recently seen otherwise."""
+
+    # pylint: disable=R0913
+    def __init__(self, rate, burst=None, max_users=10000, idle_time=300.0):
+        """Init"""
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.idle_time = idle_time
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        """Make room for a new user, caller must hold the lock"""
+        idle = [user for user, (_, seen) in self.buckets.items()
+                if now - seen >= self.idle_time]
+        if not idle:
+            idle = [min(self.buckets.items(), key=lambda item: item[1][1])[0]]
+        for user in idle:
+            del self.buckets[user]
+
+    def reserve(self, user, max_wait=None):
+        """Take a token of user, returning how long to wait before
+        sending or None if the wait would exceed max_wait"""
+        now = time.time()
+        with self._lock:
+            entry = self.buckets.get(user)
+            if entry is None:
+                if len(self.buckets) >= self.max_users:
+                    self._evict(now)
+                bucket = TokenBucket(self.rate, self.burst)
+            else:
+                bucket = entry[0]
+            self.buckets[user] = (bucket, now)
+        return bucket.reserve(1, max_wait)
+
+
+# pylint: disable=R0902
+class ConcurrencyLimit(object):
+    """Bound the number of requests in flight
+
+    acquire() waits up to timeout seconds for a free slot, forever when
+    timeout is None, and raises SpamCConnError if none frees up. A wait
+    cut short by the request deadline raises socket.timeout. When
+    max_queue requests are already waiting in its lane it fails at once
+    instead.
+
+    Waiting requests are queued in priority lanes. Freed slots go to
+    the highest lane with waiters or, when weights maps lanes to
+    weights, are shared between lanes in proportion to them. The last
+    reserved slots are kept for the top lane. Within a lane the users
+    share slots fairly, see FairQueue. Each waiter blocks on its own
+    backend queue so waiting works with every backend."""
+
+    # pylint: disable=R0913
+    def __init__(self, limit, backend='thread', timeout=None,
+                 max_queue=None, lanes=LANES, weights=None, reserved=0,
+                 default_lane=DEFAULT_LANE, quantum=None):
+        """Init"""
+        if isinstance(backend, str):
+            backend = load_backend(backend)
+        self.backend_mod = backend
+        self.limit = limit
+        self.free = limit
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.lanes = lanes
+        self.weights = weights
+        self.reserved = reserved
+        self.default_lane = default_lane if default_lane in lanes \
+            else lanes[-1]
+        self.queues = dict([(lane, FairQueue(quantum)) for lane in lanes])
+        self.credits = dict([(lane, 0) for lane in lanes])
+        self.rejected = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        """Return the number of slots in use"""
+        return self.limit - self.free
+
+    @property
+    def waiting(self):
+        """Return the number of queued requests"""
+        return sum([len(queue) for queue in self.queues.values()])
+
+    def _lane(self, priority):
+        """Return the lane of a priority"""
+        if priority in self.queues:
+            return priority
+        return self.default_lane
+
+    def _allowed(self, lane):
+        """Return True if lane may take a free slot"""
+        if lane == self.lanes[0]:
+            return self.free > 0
+        return self.free > self.reserved
+
+    def _pick(self):
+        """Return the lane to hand the next free slot to, or None"""
+        lanes = [lane for lane in self.lanes
+                 if self.queues[lane] and self._allowed(lane)]
+        if not lanes:
+            return None
+        if self.weights is None:
+            return lanes[0]
+        # smooth weighted round robin between the waiting lanes
+        total = 0
+        for lane in lanes:
+            self.credits[lane] += self.weights.get(lane, 1)
+            total += self.weights.get(lane, 1)
+        lane = max(lanes, key=lambda item: self.credits[item])
+        self.credits[lane] -= total
+        return lane
+
+    def _dispatch(self):
+        """Hand free slots to waiters, caller must hold the lock"""
+        lane = self._pick()
+        while lane is not None:
+            self.free -= 1
+            self.queues[lane].popleft().put(None)
+            lane = self._pick()
+
+    def acquire(self, priority=None, user=None, cost=1, deadline=None):
+        """Take a slot, returning how long it took, the wait ends with
+        socket.timeout at the request deadline"""
+        lane = self._lane(priority)
+        queue = self.queues[lane]
+        timeout = deadline_timeout(self.timeout, deadline)
+        with self._lock:
+            if not queue and self._allowed(lane):
+                self.free -= 1
+                return 0.0
+            if self.max_queue is not None and len(queue) >= self.max_queue:
+                self.rejected += 1
+                raise SpamCConnError(
+                    'Request queue full, %d requests waiting' % len(queue))
+            waiter = self.backend_mod.Queue()
+            queue.append(waiter, user, cost)
+        start = time.time()
+        try:
+            waiter.get(True, timeout)
+        except self.backend_mod.Empty:
+            with self._lock:
+                # the slot may have been handed over as the wait ended
+                if waiter in queue:
+                    queue.remove(waiter)
+                    self.timeouts += 1
+                    if timeout != self.timeout:
+                        raise socket.timeout('request deadline exceeded')
+                    raise SpamCConnError(
+                        'Concurrency limit of %d requests reached' %
+                        self.limit)
+        return time.time() - start
+
+    def release(self):
+        """Return a slot"""
+        with self._lock:
+            self.free += 1
+            self._dispatch()
+
+    def resize(self, limit):
+        """Change the number of slots, in use slots above a lower limit
+        are dropped as they are released"""
+        with self._lock:
+            self.free += limit - self.limit
+            self.limit = limit
+            self._dispatch()
+
+    def queued(self):
+        """Return the number of queued requests by lane"""
+        with self._lock:
+            return dict([(lane, len(queue))
+                         for lane, queue in self.queues.items()])
+
+    def snapshot(self):
+        """Return the state of the limit"""
+        with self._lock:
+            return dict(limit=self.limit, in_flight=self.in_flight,
+                        waiting=self.waiting, rejected=self.rejected,
+                        timeouts=self.timeouts)
+
+
+class AdmissionControl(BackendUser):
+    """Client side admission control with a limit per spamd endpoint
+
+    Each endpoint admits at most limit concurrent requests, spamd's
+    --max-children being a good value, and queues up to max_queue more
+    for at most queue_timeout seconds. Requests beyond that fail fast
+    with SpamCConnError rather than piling up in the spamd listen
+    backlog. lanes, weights and reserved configure the priority lanes
+    of the ConcurrencyLimit of every endpoint and quantum its per user
+    fair queuing.
+
+    rate_limits, a UserRateLimits, bounds the request rate of each user.
+    With the queue policy requests over the rate wait their turn, up to
+    queue_timeout, with the shed policy they fail at once. A single
+    AdmissionControl may be shared by the SpamC clients of many users.
+    Waiting uses the backend of the first client unless backend is
+    given."""
+
+    # pylint: disable=R0913
+    def __init__(self, limit=5, max_queue=50, queue_timeout=5.0,
+                 backend=None, lanes=LANES, weights=None, reserved=0,
+                 quantum=None, rate_limits=None, rate_policy='queue'):
+        """Init"""
+        if rate_policy not in RATE_POLICIES:
+            raise ValueError('Invalid rate_policy: %s' % rate_policy)
+        self.set_backend(backend)
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lanes = lanes
+        self.weights = weights
+        self.reserved = reserved
+        self.quantum = quantum
+        self.rate_limits = rate_limits
+        self.rate_policy = rate_policy
+        self.limits = {}
+        self._lock = threading.Lock()
+
+    def _rebind(self, backend_mod):
+        """Wait for endpoint slots on backend_mod"""
+        with self._lock:
+            for limit in self.limits.values():
+                limit.backend_mod = backend_mod
+
+    def _get_limit(self, endpoint):
+        """Return the limit of endpoint, creating it on first use"""
+        with self._lock:
+            limit = self.limits.get(endpoint.name)
+            if limit is None:
+                limit = self.limits[endpoint.name] = ConcurrencyLimit(
+                    self.limit, self.backend_mod, self.queue_timeout,
+                    self.max_queue, self.lanes, self.weights,
+                    self.reserved, quantum=self.quantum)
+            return limit
+
+    def acquire(self, endpoint, priority=None, user=None, cost=1,
+                deadline=None):
+        """Wait for a slot on endpoint, returning how long it took, no
+        longer than until the request deadline"""
+        waited = 0.0
+        if self.rate_limits is not None:
+            max_wait = self.queue_timeout if self.rate_policy == 'queue' \
+                else 0.0
+            max_wait = deadline_timeout(max_wait, deadline)
+            waited = self.rate_limits.reserve(user, max_wait)
+            if waited is None:
+                raise SpamCConnError('Rate limit of user %s exceeded' % user)
+            if waited:
+                self.backend_mod.sleep(waited)
+        return waited + self._get_limit(endpoint).acquire(
+            priority, user, cost, deadline)
+
+    def release(self, endpoint, elapsed=None, ok=None):
+        """Return the slot taken on endpoint, the request took elapsed
+        seconds and ok is False if it failed on a network error"""
+        # pylint: disable=unused-argument
+        self._get_limit(endpoint).release()
+
+    def snapshot(self):
+        """Return the state of every endpoint"""
+        with self._lock:
+            limits = self.limits.items()
+        return dict([(name, limit.snapshot()) for name, limit in limits])
+
+    def register(self, metrics):
+        """Export queue depth and in flight requests as metrics gauges"""
+        metrics.add_gauge(
+            'queue_depth', 'Requests waiting for admission by endpoint.',
+            lambda: self._gauge('waiting'), source=self)
+        metrics.add_gauge(
+            'in_flight_requests', 'Admitted requests by endpoint.',
+            lambda: self._gauge('in_flight'), source=self)
+        metrics.add_gauge(
+            'lane_queue_depth',
+            'Requests waiting for admission by endpoint and lane.',
+            self._lane_gauge, source=self)
+        metrics.add_gauge(
+            'concurrency_limit', 'Concurrency limit by endpoint.',
+            lambda: self._gauge('limit'), source=self)
+
+    def _gauge(self, field):
+        """Return (labels, value) pairs of one snapshot field"""
+        return [(dict(endpoint=name), state[field])
+                for name, state in sorted(self.snapshot().items())]
+
+    def _lane_gauge(self):
+        """Return (labels, value) pairs of the queued requests by lane"""
+        with self._lock:
+            limits = sorted(self.limits.items())
+        result = []
+        for name, limit in limits:
+            for lane, count in sorted(limit.queued().items()):
+                result.append((dict(endpoint=name, lane=lane), count))
+        return result
+
+
+# pylint: disable=R0902
+class AdaptiveLimit(object):
+    """Additive increase, multiplicative decrease of a concurrency limit
+
+    The baseline is a slow moving average of the latency of successful
+    requests, so it follows the usual mix of fast and slow scans. While
+    the fast moving average stays within tolerance times the baseline
+    and at least half the limit is in use the limit grows by about one
+    per round trip. Network errors and latency above that cut it by
+    backoff, at most once per round trip. The baseline starts as the
+    mean of the first 1 / baseline_alpha requests and is then held while
+    latency is inflated so that queueing does not become the norm,
+    unless the limit is down to min_limit and latency is still high,
+    in which case it is the new norm."""
+
+    # pylint: disable=R0913
+    def __init__(self, initial=4, min_limit=1, max_limit=100,
+                 tolerance=2.0, backoff=0.9, alpha=0.2, baseline_alpha=0.01):
+        """Init"""
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.alpha = alpha
+        self.baseline_alpha = baseline_alpha
+        self.baseline = None
+        self.smoothed = None
+        self.samples = 0
+        self.decreased_at = 0.0
+
+    def update(self, elapsed, ok, in_flight, now=None):
+        """Account for a finished request, returning the new limit"""
+        if now is None:
+            now = time.time()
+        if ok:
+            if self._observe(elapsed):
+                self._decrease(now)
+            elif in_flight * 2 >= self.limit:
+                self.limit = min(self.max_limit,
+                                 self.limit + 1.0 / self.limit)
+        elif ok is not None:
+            self._decrease(now)
+        return int(self.limit)
+
+    def _observe(self, elapsed):
+        """Update the fast and slow moving average latencies, returning
+        True if latency is inflated"""
+        self.samples += 1
+        if self.smoothed is None:
+            self.smoothed = self.baseline = elapsed
+            return False
+        self.smoothed += self.alpha * (elapsed - self.smoothed)
+        inflated = self.smoothed > self.baseline * self.tolerance
+        if self.samples * self.baseline_alpha < 1:
+            self.baseline += (elapsed - self.baseline) / self.samples
+        elif not inflated or self.limit <= self.min_limit:
+            self.baseline += self.baseline_alpha * (elapsed - self.baseline)
+        return inflated
+
+    def _decrease(self, now):
+        """Cut the limit unless it was cut less than a round trip ago"""
+        if now - self.decreased_at < (self.smoothed or 0.0):
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreased_at = now
+
+
+class AdaptiveAdmissionControl(AdmissionControl):
+    """Admission control whose per endpoint limits adapt to spamd
+
+    Every endpoint gets an AdaptiveLimit, starting at initial, that
+    tracks the concurrency spamd can take without queueing."""
+
+    # pylint: disable=R0913
+    def __init__(self, initial=4, min_limit=1, max_limit=100,
+                 tolerance=2.0, backoff=0.9, **kwargs):
+        """Init, the other arguments are those of AdmissionControl"""
+        super(AdaptiveAdmissionControl, self).__init__(initial, **kwargs)
+        self.settings = dict(initial=initial, min_limit=min_limit,
+                             max_limit=max_limit, tolerance=tolerance,
+                             backoff=backoff)
+        self.adaptive = {}
+
+    def release(self, endpoint, elapsed=None, ok=None):
+        """Return the slot taken on endpoint and adapt its limit"""
+        limit = self._get_limit(endpoint)
+        with self._lock:
+            adaptive = self.adaptive.get(endpoint.name)
+            if adaptive is None:
+                adaptive = self.adaptive[endpoint.name] = AdaptiveLimit(
+                    **self.settings)
+            new_limit = adaptive.update(elapsed, ok, limit.in_flight)
+        limit.release()
+        if new_limit != limit.limit:
+            limit.resize(new_limit)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+metrics
+"""
+import threading
+
+from bisect import bisect_left
+
+# 1ms doubling up to ~16s
+LATENCY_BUCKETS = tuple([0.001 * 2 ** exp for exp in range(15)])
+
+
+def _escape(value):
+    """Escape a prometheus label value"""
+    return str(value).replace('\\', r'\\').replace(
+        '"', r'\"').replace('\n', r'\n')
+
+
+def _labels(**labels):
+    """Format a prometheus label set"""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        ['%s="%s"' % (key, _escape(labels[key])) for key in sorted(labels)])
+
+
+def _value(value):
+    """Format a prometheus sample value"""
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """Fixed bucket histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Init"""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a value, caller must hold any lock"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def decay(self):
+        """Halve all counts so that older observations weigh less"""
+        self.counts = [count // 2 for count in self.counts]
+        self.total /= 2.0
+        self.count = sum(self.counts)
+
+    def quantile(self, fraction):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs"""
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+# pylint: disable=R0902
+class Metrics(object):
+    """In memory metrics registry fed by SpamC.perform()
+
+    A single lock is taken once per request, it is never held across
+    I/O so it is safe with threads as well as gevent/eventlet."""
+
+    def __init__(self, namespace='spamc', buckets=LATENCY_BUCKETS):
+        """Init"""
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.retries = {}
+        self.exceptions = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self.latency = {}
+        self.queue_wait = {}
+        self.hedges = {}
+        self.cache = {}
+        self.coalesced = 0
+        self.gauges = []
+
+    def record(self, stats):
+        """Record a completed request"""
+        key = (stats.cmd, stats.outcome)
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if stats.tries:
+                self.retries[stats.cmd] = \
+                    self.retries.get(stats.cmd, 0) + stats.tries
+            if stats.hedge is not None:
+                self.hedges[stats.hedge] = self.hedges.get(stats.hedge, 0) + 1
+            if stats.coalesced:
+                self.coalesced += 1
+            if stats.cache is not None:
+                self.cache[stats.cache] = self.cache.get(stats.cache, 0) + 1
+            for name in stats.errors:
+                self.exceptions[name] = self.exceptions.get(name, 0) + 1
+            self.bytes_sent += stats.bytes_sent
+            self.bytes_received += stats.bytes_received
+            if stats.compressed_size is not None:
+                self.uncompressed_bytes += stats.msg_size
+                self.compressed_bytes += stats.compressed_size
+            if stats.endpoint is not None:
+                if stats.endpoint not in self.latency:
+                    self.latency[stats.endpoint] = Histogram(self.buckets)
+                self.latency[stats.endpoint].observe(stats.duration)
+                if 'queue' in stats.phases:
+                    if stats.endpoint not in self.queue_wait:
+                        self.queue_wait[stats.endpoint] = \
+                            Histogram(self.buckets)
+                    self.queue_wait[stats.endpoint].observe(
+                        stats.phases['queue'])
+
+    def add_gauge(self, name, text, func, source=None):
+        """Render a gauge whose (labels, value) pairs are returned by
+        func when the metrics are rendered. A source registers each
+        gauge once however often it is added, and gauges of the same
+        name from several sources are rendered together"""
+        with self._lock:
+            for gauge in self.gauges:
+                if source is not None and gauge[0] == name and \
+                        gauge[3] is source:
+                    return
+            self.gauges.append((name, text, func, source))
+
+    def compression_ratio(self):
+        """Return compressed/uncompressed bytes or None"""
+        if not self.uncompressed_bytes:
+            return None
+        return float(self.compressed_bytes) / self.uncompressed_bytes
+
+    def quantile(self, endpoint, fraction):
+        """Estimate a latency quantile for an endpoint"""
+        with self._lock:
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                return None
+            return histogram.quantile(fraction)
+
+    def _header(self, lines, name, kind, text):
+        """Add HELP and TYPE lines"""
+        name = '%s_%s' % (self.namespace, name)
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        return name
+
+    # pylint: disable=R0914
+    def render(self):
+        """Render the registry in the prometheus text format"""
+        lines = []
+        with self._lock:
+            requests = sorted(self.requests.items())
+            retries = sorted(self.retries.items())
+            exceptions = sorted(self.exceptions.items())
+            hedges = sorted(self.hedges.items())
+            cache = sorted(self.cache.items())
+            coalesced = self.coalesced
+            totals = (self.bytes_sent, self.bytes_received,
+                      self.uncompressed_bytes, self.compressed_bytes)
+            latency = [(endpoint, histogram.cumulative(),
+                        histogram.total, histogram.count)
+                       for endpoint, histogram in sorted(
+                           self.latency.items())]
+            queue_wait = [(endpoint, histogram.cumulative(),
+                           histogram.total, histogram.count)
+                          for endpoint, histogram in sorted(
+                              self.queue_wait.items())]
+            gauges = list(self.gauges)
+        ratio = self.compression_ratio()
+
+        name = self._header(lines, 'requests_total', 'counter',
+                            'Requests by command and outcome.')
+        for (cmd, outcome), count in requests:
+            lines.append('%s%s %s' % (
+                name, _labels(command=cmd, outcome=outcome), count))
+        name = self._header(lines, 'retries_total', 'counter',
+                            'Retried attempts by command.')
+        for cmd, count in retries:
+            lines.append('%s%s %s' % (name, _labels(command=cmd), count))
+        name = self._header(lines, 'exceptions_total', 'counter',
+                            'Exceptions raised by attempts, by class.')
+        for exc, count in exceptions:
+            lines.append('%s%s %s' % (name, _labels(exception=exc), count))
+        name = self._header(lines, 'hedges_total', 'counter',
+                            'Hedged requests by the attempt that won.')
+        for winner, count in hedges:
+            lines.append('%s%s %s' % (name, _labels(winner=winner), count))
+        name = self._header(lines, 'cache_total', 'counter',
+                            'Verdict cache lookups by result.')
+        for result, count in cache:
+            lines.append('%s%s %s' % (name, _labels(result=result), count))
+        name = self._header(lines, 'coalesced_total', 'counter',
+                            'Requests answered by an identical one.')
+        lines.append('%s %s' % (name, coalesced))
+        for suffix, value, text in zip(
+                ('sent_bytes_total', 'received_bytes_total',
+                 'uncompressed_bytes_total', 'compressed_bytes_total'),
+                totals,
+                ('Bytes sent to spamd.', 'Bytes received from spamd.',
+                 'Message bytes before compression.',
+                 'Message bytes after compression.')):
+            name = self._header(lines, suffix, 'counter', text)
+            lines.append('%s %s' % (name, value))
+        if ratio is not None:
+            name = self._header(lines, 'compression_ratio', 'gauge',
+                                'Compressed to uncompressed byte ratio.')
+            lines.append('%s %s' % (name, _value(ratio)))
+        for suffix, histograms, text in (
+                ('request_duration_seconds', latency,
+                 'Request latency by endpoint.'),
+                ('queue_wait_seconds', queue_wait,
+                 'Time spent waiting for admission by endpoint.')):
+            name = self._header(lines, suffix, 'histogram', text)
+            for endpoint, buckets, total, count in histograms:
+                for bound, running in buckets:
+                    lines.append('%s_bucket%s %s' % (
+                        name, _labels(endpoint=endpoint, le=_value(bound)),
+                        running))
+                lines.append('%s_sum%s %s' % (
+                    name, _labels(endpoint=endpoint), _value(total)))
+                lines.append('%s_count%s %s' % (
+                    name, _labels(endpoint=endpoint), count))
+        names = []
+        for suffix, text, _, _ in gauges:
+            if suffix not in [seen for seen, _ in names]:
+                names.append((suffix, text))
+        for suffix, text in names:
+            name = self._header(lines, suffix, 'gauge', text)
+            for gauge in gauges:
+                if gauge[0] != suffix:
+                    continue
+                for labels, value in gauge[2]():
+                    lines.append('%s%s %s' % (name, _labels(**labels),
+                                              _value(value)))
+        return '\n'.join(lines) + '\n'
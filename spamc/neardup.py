@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+near duplicate verdict reuse
+"""
+import re
+import copy
+import hashlib
+import threading
+
+from collections import deque
+
+# tokens made of letters, anything carrying digits is treated as a
+# tracking token, counter or id and dropped
+TOKEN_RE = re.compile(r'[^\W\d_]{2,}', re.UNICODE)
+VARIABLE_RE = re.compile(r'\S*\d\S*')
+BODY_RE = re.compile(r'\r?\n\r?\n')
+# commands whose verdict may be reused
+NEAR_COMMANDS = ('CHECK',)
+BITS = 64
+DIGEST_SIZE = 16
+# translation tables turning every byte into '1' when a bit is set
+BIT_TABLES = [''.join('1' if value >> bit & 1 else '0'
+                      for value in range(256)) for bit in range(8)]
+
+
+def message_body(msg, max_bytes=262144):
+    """Return up to max_bytes of the body of msg, a string or file"""
+    if hasattr(msg, 'read'):
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+        data = msg.read(max_bytes + 65536)
+        if hasattr(msg, 'seek'):
+            msg.seek(0)
+    else:
+        data = msg[:max_bytes + 65536]
+    match = BODY_RE.search(data)
+    if match is None:
+        return ''
+    return data[match.end():match.end() + max_bytes]
+
+
+def tokens(body):
+    """Return the normalised tokens of a message body"""
+    body = VARIABLE_RE.sub(' ', body.lower())
+    return TOKEN_RE.findall(body)
+
+
+def features(words, size=3):
+    """Return the shingles of size consecutive tokens"""
+    if len(words) < size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[index:index + size])
+            for index in range(len(words) - size + 1)]
+
+
+def simhash(items):
+    """Return the 64 bit SimHash of a list of features"""
+    digests = [hashlib.md5(item.encode('utf-8') if isinstance(item, unicode)
+                           else item).digest() for item in items]
+    # every DIGEST_SIZE-th byte of data from index on is byte index of
+    # each digest, whose first 8 bytes make its 64 bit hash, so the set
+    # bits of a column are counted in one pass over a string
+    data = ''.join(digests)
+    half = len(digests) / 2.0
+    result = 0
+    for index in range(BITS // 8):
+        column = data[index::DIGEST_SIZE]
+        for bit in range(8):
+            if column.translate(BIT_TABLES[bit]).count('1') > half:
+                result |= 1 << (BITS - 8 - index * 8 + bit)
+    return result
+
+
+def distance(first, second):
+    """Return the Hamming distance between two fingerprints"""
+    return bin(first ^ second).count('1')
+
+
+def fingerprint(msg, max_bytes=262144):
+    """Return the SimHash of the normalised body of msg or None when the
+    body has too few tokens to be compared"""
+    items = features(tokens(message_body(msg, max_bytes)))
+    if len(items) < 3:
+        return None
+    return simhash(items)
+
+
+# pylint: disable=R0902
+class NearDuplicateIndex(object):
+    """Reuse the verdicts of recent messages for near duplicates
+
+    Fingerprints are SimHashes of the normalised message body, kept in a
+    banded index of max_distance + 1 bands so that any fingerprint
+    within max_distance bits shares a band with the query. A cached
+    verdict is reused, flagged approximate=True, when its score is at
+    least margin points from the spam threshold. At most max_entries
+    fingerprints are kept, the oldest being evicted first. Verdicts depend
+    on the user preferences so an index must not be shared between
+    clients of different users."""
+
+    # pylint: disable=R0913
+    def __init__(self, max_distance=3, margin=3.0, max_entries=100000,
+                 max_bytes=262144, commands=NEAR_COMMANDS):
+        """Init"""
+        self.max_distance = max_distance
+        self.margin = margin
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.commands = commands
+        self.bands = max_distance + 1
+        self.width = BITS // self.bands
+        self.buckets = [{} for _ in range(self.bands)]
+        self.entries = {}
+        self.order = deque()
+        self._lock = threading.Lock()
+
+    def applies(self, cmd):
+        """Return True if verdicts of cmd may be reused"""
+        return cmd in self.commands
+
+    def fingerprint(self, msg):
+        """Return the fingerprint of a message or None"""
+        return fingerprint(msg, self.max_bytes)
+
+    def _band_keys(self, value):
+        """Return the band values of a fingerprint"""
+        mask = (1 << self.width) - 1
+        keys = []
+        for band in range(self.bands):
+            shift = band * self.width
+            if band == self.bands - 1:
+                mask = (1 << (BITS - shift)) - 1
+            keys.append(value >> shift & mask)
+        return keys
+
+    def add(self, value, result):
+        """Index the verdict of a message with fingerprint value"""
+        with self._lock:
+            if value not in self.entries:
+                for band, key in enumerate(self._band_keys(value)):
+                    self.buckets[band].setdefault(key, set()).add(value)
+                self.order.append(value)
+            self.entries[value] = result
+            while len(self.entries) > self.max_entries:
+                self._evict(self.order.popleft())
+
+    def _evict(self, value):
+        """Remove a fingerprint, caller must hold the lock"""
+        del self.entries[value]
+        for band, key in enumerate(self._band_keys(value)):
+            bucket = self.buckets[band][key]
+            bucket.discard(value)
+            if not bucket:
+                del self.buckets[band][key]
+
+    def lookup(self, value):
+        """Return (distance, verdict) of the nearest indexed fingerprint
+        within max_distance or (None, None)"""
+        best = (None, None)
+        with self._lock:
+            seen = set()
+            for band, key in enumerate(self._band_keys(value)):
+                for other in self.buckets[band].get(key, ()):
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    bits = distance(value, other)
+                    if bits <= self.max_distance and (
+                            best[0] is None or bits < best[0]):
+                        best = (bits, self.entries[other])
+        return best
+
+    def reusable(self, result):
+        """Return True if a verdict is clear enough to be reused"""
+        return abs(result['score'] - result['basescore']) >= self.margin
+
+    def match(self, value):
+        """Return a copy of a reusable verdict for fingerprint value,
+        flagged approximate, or None"""
+        bits, result = self.lookup(value)
+        if result is None or not self.reusable(result):
+            return None
+        result = copy.deepcopy(result)
+        result['approximate'] = True
+        result['distance'] = bits
+        return result
+
+    def __len__(self):
+        """Return the number of indexed fingerprints"""
+        return len(self.entries)
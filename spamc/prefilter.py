@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+header pre-filter rules
+"""
+import re
+import types
+
+from cStringIO import StringIO
+from email.parser import Parser
+from email.utils import getaddresses
+
+from spamc.client import get_msg_length, make_response
+
+PREFILTERED = 'PREFILTERED'
+# commands answered by pre-filter rules
+PREFILTER_COMMANDS = ('CHECK',)
+VERDICTS = ('ham', 'spam')
+# header blocks larger than this are cut short
+MAX_HEADER_BYTES = 65536
+# size of the lines header blocks are read in
+LINE_SIZE = 8192
+
+
+def read_headers(msg, max_bytes=MAX_HEADER_BYTES):
+    """Return the header block of msg, a string or a file that is read
+    from the start up to the first blank line"""
+    if not hasattr(msg, 'read'):
+        msg = StringIO(msg or '')
+    elif hasattr(msg, 'seek'):
+        msg.seek(0)
+    lines = []
+    size = 0
+    for line in iter(lambda: msg.readline(LINE_SIZE), ''):
+        if not line.strip() and line.endswith('\n'):
+            break
+        lines.append(line)
+        size += len(line)
+        if size >= max_bytes:
+            break
+    if hasattr(msg, 'seek'):
+        msg.seek(0)
+    return Parser().parsestr(''.join(lines), headersonly=True)
+
+
+class HeaderMatcher(object):
+    """Match a header that is present, equal to a value or matching a
+    regex, case insensitively, or that is absent when present is
+    False
+
+    Anyone can put any header in a message, so a header stamped by a
+    relay only counts above the Received header that relay added, the
+    first one matching the relay regex. Copies further down, or in mail
+    that never went through the relay, were written by the sender and
+    are ignored. With topmost only the first copy of the header is
+    looked at."""
+
+    # pylint: disable=R0913
+    def __init__(self, name, equals=None, regex=None, present=True,
+                 relay=None, topmost=False):
+        """Init"""
+        self.name = name
+        self.present = present
+        self.equals = equals.strip().lower() if equals is not None else None
+        self.regex = re.compile(regex, re.I) if regex is not None else None
+        self.relay = re.compile(relay, re.I) if relay is not None else None
+        self.topmost = topmost
+
+    def values(self, headers):
+        """Return the values of the header that may be trusted, topmost
+        first"""
+        name = self.name.lower()
+        values = []
+        for key, value in headers.items():
+            key = key.lower()
+            if self.relay is not None and key == 'received' and \
+                    self.relay.search(' '.join(value.split())):
+                break
+            if key == name:
+                values.append(value)
+        else:
+            if self.relay is not None:
+                return []
+        return values[:1] if self.topmost else values
+
+    def __call__(self, headers, size):
+        """Return True if a header matches"""
+        # pylint: disable=unused-argument
+        for value in self.values(headers):
+            value = ' '.join(value.split())
+            if self.equals is not None and value.lower() != self.equals:
+                continue
+            if self.regex is not None and not self.regex.search(value):
+                continue
+            return self.present
+        return not self.present
+
+
+class SizeMatcher(object):
+    """Match messages within a size range in bytes"""
+
+    def __init__(self, min_size=None, max_size=None):
+        """Init"""
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def __call__(self, headers, size):
+        """Return True if size is in range"""
+        # pylint: disable=unused-argument
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return True
+
+
+class DomainMatcher(object):
+    """Match the domain of a sender address against a set, a domain
+    also matches its subdomains"""
+
+    def __init__(self, domains, header='From'):
+        """Init"""
+        self.domains = frozenset([domain.lower().strip('.')
+                                  for domain in domains])
+        self.header = header
+
+    def __call__(self, headers, size):
+        """Return True if the sender domain is in the set"""
+        # pylint: disable=unused-argument
+        addresses = getaddresses(headers.get_all(self.header) or [])
+        if not addresses:
+            return False
+        for _, address in addresses:
+            domain = address.rpartition('@')[2].lower().strip('.> ')
+            while domain and domain not in self.domains:
+                domain = domain.partition('.')[2]
+            if not domain:
+                return False
+        return True
+
+
+class Rule(object):
+    """Named set of matchers that must all match, with the verdict to
+    return when they do"""
+
+    def __init__(self, name, matchers, verdict='ham', score=None):
+        """Init"""
+        if verdict not in VERDICTS:
+            raise ValueError('Invalid pre-filter verdict: %s' % verdict)
+        self.name = name
+        self.matchers = matchers
+        self.verdict = verdict
+        self.score = score
+
+    def __call__(self, headers, size):
+        """Return True if every matcher matches"""
+        for matcher in self.matchers:
+            if not matcher(headers, size):
+                return False
+        return True
+
+
+def compile_rule(spec):
+    """Return a Rule from a dict with a name, a verdict, an optional
+    score and any of header with present, equals, regex, relay or
+    topmost, min_size, max_size, and sender_domains with sender_header
+
+    Rules on a header stamped by a relay, such as X-Spam-Status, should
+    give a relay regex matching the Received header of that relay, see
+    HeaderMatcher, or a sender can forge the stamp."""
+    spec = dict(spec)
+    name = spec.pop('name')
+    verdict = spec.pop('verdict', 'ham')
+    score = spec.pop('score', None)
+    matchers = []
+    if 'header' in spec:
+        matchers.append(HeaderMatcher(
+            spec.pop('header'), spec.pop('equals', None),
+            spec.pop('regex', None), spec.pop('present', True),
+            spec.pop('relay', None), spec.pop('topmost', False)))
+    if 'min_size' in spec or 'max_size' in spec:
+        matchers.append(SizeMatcher(
+            spec.pop('min_size', None), spec.pop('max_size', None)))
+    if 'sender_domains' in spec:
+        domains = spec.pop('sender_domains')
+        if isinstance(domains, types.StringTypes):
+            domains = [domains]
+        matchers.append(DomainMatcher(
+            domains, spec.pop('sender_header', 'From')))
+    if spec:
+        raise ValueError('Invalid pre-filter rule %s options: %s' % (
+            name, ', '.join(sorted(spec))))
+    if not matchers:
+        raise ValueError('Pre-filter rule %s matches nothing' % name)
+    return Rule(name, matchers, verdict, score)
+
+
+class PreFilter(object):
+    """Answer scans of trusted or obvious mail from header rules
+
+    rules are Rule objects or dicts for compile_rule(), tried in order.
+    Only the header block of a message is read. The first matching rule
+    answers the scan with a synthetic verdict, flagged with its name in
+    prefiltered, scoring ham_score or spam_score against threshold
+    unless the rule has a score of its own. Rules trusting the verdict
+    of a relay must name it, for example::
+
+        dict(name='relay-ham', header='X-Spam-Status', regex=r'^No\\b',
+             relay=r'\\bby relay\\.example\\.com\\b')"""
+
+    # pylint: disable=R0913
+    def __init__(self, rules, threshold=5.0, ham_score=0.0,
+                 spam_score=100.0, max_bytes=MAX_HEADER_BYTES,
+                 commands=PREFILTER_COMMANDS):
+        """Init"""
+        self.rules = [rule if isinstance(rule, Rule) else compile_rule(rule)
+                      for rule in rules]
+        self.threshold = threshold
+        self.ham_score = ham_score
+        self.spam_score = spam_score
+        self.max_bytes = max_bytes
+        self.commands = commands
+
+    def applies(self, cmd):
+        """Return True if cmd may be answered by the rules"""
+        return cmd in self.commands
+
+    def match(self, msg):
+        """Return the first rule matching msg or None"""
+        headers = read_headers(msg, self.max_bytes)
+        size = get_msg_length(msg) - 2
+        for rule in self.rules:
+            if rule(headers, size):
+                return rule
+        return None
+
+    def check(self, msg):
+        """Return the synthetic response of the first matching rule or
+        None"""
+        rule = self.match(msg)
+        if rule is None:
+            return None
+        score = rule.score
+        if score is None:
+            score = self.spam_score if rule.verdict == 'spam' \
+                else self.ham_score
+        return make_response(PREFILTERED, rule.verdict == 'spam', score,
+                             self.threshold, prefiltered=rule.name)
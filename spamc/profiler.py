@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+sampling profiler
+"""
+import os
+import sys
+import time
+import signal
+import threading
+
+from itertools import count
+
+
+def frame_name(code):
+    """Return a flame graph friendly name for a code object"""
+    return '%s:%s:%d' % (
+        os.path.basename(code.co_filename), code.co_name,
+        code.co_firstlineno)
+
+
+# stack of the time spent in other greenlets of the same thread
+OTHER_STACK = ('[other greenlets]',)
+
+
+def _stack(frame, base):
+    """Return the stack of frame names below base, outermost first, or
+    OTHER_STACK when frame is not called from base"""
+    names = []
+    while frame is not base:
+        if frame is None:
+            return OTHER_STACK
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+class Profiler(object):
+    """Profile every Nth call and aggregate the time spent per stack
+
+    Profiling uses sys.setprofile, which affects the calling OS thread.
+    With gevent or eventlet that thread is shared by every greenlet, the
+    time other greenlets run during a profiled call is counted under
+    OTHER_STACK. Only one call is profiled at a time, an Nth call made
+    while another is profiled is not. Time is attributed to full call
+    stacks which are rendered in the collapsed format read by
+    flamegraph.pl and speedscope."""
+
+    def __init__(self, every=100):
+        """Init"""
+        self.every = every
+        self.stacks = {}
+        self.profiled = 0
+        self._counter = count(1)
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """Call func, profiling it if this is an Nth call"""
+        if next(self._counter) % self.every:
+            return func(*args, **kwargs)
+        return self.profile(func, *args, **kwargs)
+
+    def profile(self, func, *args, **kwargs):
+        """Call func under the profiler unless another call is"""
+        if not self._active.acquire(False):
+            return func(*args, **kwargs)
+        try:
+            return self._profile(func, *args, **kwargs)
+        finally:
+            self._active.release()
+
+    def _profile(self, func, *args, **kwargs):
+        """Call func under the profiler"""
+        # pylint: disable=protected-access
+        base = sys._getframe()
+        samples = {}
+        state = dict(stack=(), last=time.time())
+
+        def handler(frame, event, arg):
+            """Attribute the time since the last event to the stack"""
+            now = time.time()
+            current = state['stack']
+            samples[current] = samples.get(current, 0.0) + \
+                now - state['last']
+            if event == 'call':
+                state['stack'] = _stack(frame, base)
+            elif event == 'return':
+                state['stack'] = _stack(frame.f_back, base)
+            elif event == 'c_call':
+                state['stack'] = _stack(frame, base) + (
+                    getattr(arg, '__name__', '?'),)
+            else:
+                state['stack'] = _stack(frame, base)
+            state['last'] = time.time()
+
+        previous = sys.getprofile()
+        state['stack'] = _stack(sys._getframe(), base)
+        sys.setprofile(handler)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if sys.getprofile() is handler:
+                sys.setprofile(previous)
+            self._merge(samples)
+
+    def _merge(self, samples):
+        """Add the samples of one profiled call to the aggregate"""
+        with self._lock:
+            self.profiled += 1
+            for stack, spent in samples.items():
+                if stack:
+                    self.stacks[stack] = self.stacks.get(stack, 0.0) + spent
+
+    def reset(self):
+        """Discard the aggregated stacks"""
+        with self._lock:
+            self.stacks = {}
+            self.profiled = 0
+
+    def collapsed(self, locked=True):
+        """Return the stacks in collapsed format, weights in microseconds,
+        without locked the stacks are copied without taking the lock"""
+        if locked:
+            with self._lock:
+                stacks = self.stacks.items()
+        else:
+            stacks = dict(self.stacks).items()
+        return ''.join(['%s %d\n' % (';'.join(stack), spent * 1000000)
+                        for stack, spent in sorted(stacks)
+                        if int(spent * 1000000)])
+
+    def dump(self, path, locked=True):
+        """Write the collapsed stacks to path"""
+        with open(path, 'w') as handle:
+            handle.write(self.collapsed(locked))
+
+    def install_signal(self, path, signum=signal.SIGUSR2):
+        """Dump the collapsed stacks to path when signum is received,
+        must be called from the main thread"""
+        def handler(signum, frame):
+            """signal handler"""
+            # pylint: disable=unused-argument
+            # the code interrupted may hold the lock, with gevent or
+            # eventlet it always runs in this thread
+            self.dump(path, locked=False)
+        signal.signal(signum, handler)
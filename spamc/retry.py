@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+retry policies
+"""
+import errno
+import random
+import threading
+
+from spamc.utils import TokenBucket
+
+RETRY_ERRNOS = (errno.EAGAIN, errno.EPIPE, errno.EBADF, errno.ECONNRESET)
+# commands that have no side effects on spamd and may be sent again
+IDEMPOTENT_COMMANDS = ('CHECK', 'SYMBOLS', 'REPORT', 'REPORT_IFSPAM',
+                       'PING', 'PROCESS', 'HEADERS')
+
+
+class RetryBudget(object):
+    """Client wide cap on retries
+
+    Every request deposits ratio tokens and every retry withdraws one,
+    so retries stay below ratio of the request rate. A small reserve of
+    min_per_second retries is always available for low traffic."""
+
+    def __init__(self, ratio=0.2, min_per_second=10, max_tokens=100):
+        """Init"""
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.reserve = TokenBucket(min_per_second) if min_per_second \
+            else None
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Account for a new request"""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Take a token for a retry if one is available"""
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+        return self.reserve is not None and self.reserve.consume()
+
+
+class RetryPolicy(object):
+    """Exponential backoff with decorrelated jitter
+
+    Requests are retried on the errnos given, up to max_tries times and
+    while the budget allows. Commands that are not in commands, TELL by
+    default, are only retried when the request was never sent, as spamd
+    may already have acted on it otherwise."""
+
+    # pylint: disable=R0913
+    def __init__(self, max_tries=5, base=0.3, cap=10.0,
+                 errnos=RETRY_ERRNOS, commands=IDEMPOTENT_COMMANDS,
+                 budget=None):
+        """Init"""
+        self.max_tries = max_tries
+        self.base = base
+        self.cap = cap
+        self.errnos = errnos
+        self.commands = commands
+        self.budget = budget
+
+    def request(self):
+        """Account for a new request"""
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def should_retry(self, cmd, err, tries, sent):
+        """Return True if the failed attempt should be retried"""
+        if tries >= self.max_tries:
+            return False
+        if getattr(err, 'errno', None) not in self.errnos:
+            return False
+        if sent and cmd not in self.commands:
+            return False
+        return self.budget is None or self.budget.withdraw()
+
+    def backoff(self, previous=None):
+        """Return the delay before the next attempt"""
+        if previous is None:
+            previous = self.base
+        return min(self.cap, random.uniform(self.base, previous * 3))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+load shedding
+"""
+import time
+import random
+import threading
+
+from spamc.client import make_response
+
+NOT_SCANNED = 'NOT_SCANNED'
+# commands whose result can be replaced by an unscanned verdict
+SHED_COMMANDS = ('CHECK', 'SYMBOLS', 'REPORT', 'REPORT_IFSPAM', 'HEADERS',
+                 'PROCESS')
+
+
+def not_scanned(cmd, msg=''):
+    """Return the fail open answer to a shed request, flagged shed=True,
+    with the message passed through unmodified for PROCESS"""
+    resp_dict = make_response(NOT_SCANNED, shed=True)
+    if cmd == 'PROCESS':
+        if hasattr(msg, 'read'):
+            if hasattr(msg, 'seek'):
+                msg.seek(0)
+            msg = msg.read()
+        resp_dict['message'] = msg + '\r\n'
+    return resp_dict
+
+
+# pylint: disable=R0902
+class LoadShedder(object):
+    """Skip scans while spamd is overloaded
+
+    The client is overloaded when the admission queue holds at least
+    queue_threshold requests, the moving average request latency
+    exceeds latency_slo seconds or the moving average error rate
+    exceeds error_rate. Unset thresholds are not checked. While
+    overloaded a fraction of the scans, and every scan of a message
+    larger than max_size or flagged high risk, is answered with
+    not_scanned() instead of reaching spamd. One scan every
+    probe_interval seconds is let through regardless so that the
+    latency and error averages see spamd recover."""
+
+    # pylint: disable=R0913
+    def __init__(self, fraction=0.5, queue_threshold=None, latency_slo=None,
+                 error_rate=None, max_size=262144, admission=None,
+                 alpha=0.1, probe_interval=1.0, commands=SHED_COMMANDS):
+        """Init"""
+        self.fraction = fraction
+        self.queue_threshold = queue_threshold
+        self.latency_slo = latency_slo
+        self.error_rate = error_rate
+        self.max_size = max_size
+        self.admission = admission
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self.commands = commands
+        self.probed_at = None
+        self.latency = None
+        self.errors = 0.0
+        self.requests = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def record(self, stats):
+        """Learn latency and errors from a completed request"""
+        if stats.outcome == 'shed' or stats.cmd not in self.commands:
+            return
+        if stats.endpoint is None or stats.coalesced or \
+                stats.cache not in (None, 'miss', 'stale'):
+            # answered without spamd, it says nothing about its load
+            return
+        failed = 1.0 if stats.outcome != 'ok' else 0.0
+        with self._lock:
+            self.errors += self.alpha * (failed - self.errors)
+            if not failed:
+                if self.latency is None:
+                    self.latency = stats.duration
+                else:
+                    self.latency += self.alpha * (
+                        stats.duration - self.latency)
+
+    def queue_depth(self):
+        """Return the number of requests waiting for admission"""
+        if self.admission is None:
+            return 0
+        return sum([state['waiting']
+                    for state in self.admission.snapshot().values()])
+
+    def overloaded(self):
+        """Return True if any overload threshold is crossed"""
+        if self.queue_threshold is not None and \
+                self.queue_depth() >= self.queue_threshold:
+            return True
+        with self._lock:
+            if self.latency_slo is not None and \
+                    self.latency is not None and \
+                    self.latency > self.latency_slo:
+                return True
+            return self.error_rate is not None and \
+                self.errors > self.error_rate
+
+    def should_shed(self, cmd, size, high_risk=False):
+        """Return True if this scan should be skipped"""
+        if cmd not in self.commands:
+            return False
+        overloaded = self.overloaded()
+        shed = overloaded and (
+            high_risk or size > self.max_size or
+            random.random() < self.fraction)
+        now = time.time()
+        with self._lock:
+            if not overloaded:
+                self.probed_at = None
+            elif self.probed_at is None:
+                self.probed_at = now
+            elif shed and now - self.probed_at >= self.probe_interval:
+                # probe spamd so the averages can recover
+                self.probed_at = now
+                shed = False
+            self.requests += 1
+            if shed:
+                self.shed += 1
+        return shed
+
+    def result(self, cmd, msg=''):
+        """Return the response to a shed request"""
+        return not_scanned(cmd, msg)
+
+    def register(self, metrics):
+        """Export the overload state and shed fraction as gauges"""
+        metrics.add_gauge(
+            'overloaded', 'Whether the client is shedding load.',
+            lambda: [({}, int(self.overloaded()))], source=self)
+        metrics.add_gauge(
+            'shed_fraction', 'Fraction of ordinary scans shed in overload.',
+            lambda: [({}, float(self.fraction))], source=self)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+slow request log
+"""
+import random
+import logging
+import threading
+
+from spamc.utils import TokenBucket
+
+PHASES = ('queue', 'connect', 'tls', 'send', 'wait', 'parse')
+
+
+def format_record(record):
+    """Format a slow request record as a single log line"""
+    phases = record['phases']
+    parts = ['%s=%s' % (key, record[key]) for key in (
+        'cmd', 'user', 'endpoint', 'outcome', 'msg_size',
+        'compressed_size', 'tries', 'suppressed')]
+    parts.insert(0, 'duration=%.6f' % record['duration'])
+    parts.extend(['%s=%.6f' % (phase, phases[phase])
+                  for phase in PHASES if phase in phases])
+    return 'slow spamd request: %s' % ' '.join(parts)
+
+
+class SlowLog(object):
+    """Emit one record for every request slower than a threshold
+
+    Records are sampled and rate limited so that the log does not add
+    to the load during an incident. The number of records dropped since
+    the last emitted one is reported in its suppressed field."""
+
+    # pylint: disable=R0913
+    def __init__(self, threshold=1.0, sample_rate=1.0, rate=10,
+                 burst=None, emit=None, logger=None):
+        """Init"""
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.emit = emit
+        self.logger = logger or logging.getLogger('spamc.slowlog')
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def record(self, stats):
+        """Log the request if it was slow"""
+        if stats.duration is None or stats.duration < self.threshold:
+            return
+        if (self.sample_rate < 1.0 and
+                random.random() >= self.sample_rate) or \
+                (self.bucket is not None and not self.bucket.consume()):
+            with self._lock:
+                self.suppressed += 1
+            return
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        record = stats.as_dict()
+        record['suppressed'] = suppressed
+        if self.emit is not None:
+            self.emit(record)
+        else:
+            self.logger.warning(format_record(record),
+                                extra=dict(slowlog=record))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+request statistics
+"""
+import time
+
+from spamc.tracing import NOOP_SPAN
+from spamc.exceptions import SpamCTimeOutError
+
+
+def error_name(err):
+    """Return a qualified name for an exception class or instance"""
+    if not isinstance(err, type):
+        err = err.__class__
+    return '%s.%s' % (err.__module__, err.__name__)
+
+
+# pylint: disable=R0902
+class RequestStats(object):
+    """Statistics collected during a single perform() call"""
+
+    def __init__(self, cmd, user=None, endpoint=None, span=NOOP_SPAN):
+        """Init"""
+        self.cmd = cmd
+        self.user = user
+        self.endpoint = endpoint
+        self.start = time.time()
+        self.duration = None
+        self.tries = 0
+        self.msg_size = 0
+        self.compressed_size = None
+        self.compress_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.errors = []
+        self.outcome = None
+        self.exception = None
+        self.phases = {}
+        self._mark = self.start
+        self.span = span
+        self.attempt = None
+        self.hedge = None
+        self.routing_key = None
+        self.priority = None
+        self.high_risk = False
+        self.shed = False
+        self.cache = None
+        self.coalesced = False
+
+    def begin_attempt(self, tries):
+        """Start a new attempt"""
+        self.tries = tries
+        self.attempt = self.span.child('attempt')
+        self.attempt.set('try', tries)
+
+    def end_attempt(self, err=None):
+        """Finish the current attempt"""
+        if self.attempt is not None:
+            self.attempt.finish(error=err)
+            self.attempt = None
+
+    def mark(self):
+        """Start timing a new phase from now"""
+        self._mark = time.time()
+
+    def add_phase(self, name, start, end):
+        """Record a phase that ran from start to end"""
+        self.phases[name] = self.phases.get(name, 0.0) + end - start
+        parent = self.attempt if self.attempt is not None else self.span
+        parent.child(name, start).finish(end)
+
+    def lap(self, name):
+        """Close the current phase under name and start the next one"""
+        now = time.time()
+        self.add_phase(name, self._mark, now)
+        self._mark = now
+
+    def error(self, err):
+        """Record an exception raised by an attempt"""
+        self.errors.append(error_name(err))
+        self.end_attempt(err)
+
+    def merge(self, other):
+        """Take over the results of an attempt made with other"""
+        self.endpoint = other.endpoint
+        self.tries = other.tries
+        self.msg_size = other.msg_size
+        self.compressed_size = other.compressed_size
+        self.compress_time += other.compress_time
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.errors.extend(other.errors)
+        for name, spent in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + spent
+
+    def as_dict(self):
+        """Return the statistics as a plain dict"""
+        return dict(
+            cmd=self.cmd,
+            user=self.user,
+            endpoint=self.endpoint,
+            start=self.start,
+            duration=self.duration,
+            phases=dict(self.phases),
+            msg_size=self.msg_size,
+            compressed_size=self.compressed_size,
+            compress_time=self.compress_time,
+            tries=self.tries,
+            outcome=self.outcome,
+            exception=self.exception,
+        )
+
+    def finish(self, err=None):
+        """Mark the request as complete"""
+        self.duration = time.time() - self.start
+        if self.shed:
+            self.outcome = 'shed'
+        elif err is None:
+            self.outcome = 'ok'
+        else:
+            self.exception = error_name(err)
+            if isinstance(err, SpamCTimeOutError):
+                self.outcome = 'timeout'
+            else:
+                self.outcome = 'error'
+        for key in ('user', 'endpoint', 'msg_size', 'compressed_size',
+                    'tries', 'outcome'):
+            self.span.set(key, getattr(self, key))
+        self.span.finish(self.start + self.duration, err)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+# spamc - Python spamassassin spamc client library
+# Copyright (C) 2015  Andrew Colin Kissa <andrew@topdog.za.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+spamc: Python spamassassin spamc client library
+request tracing
+
+A tracer opens one span per SpamC command with a child span for every
+attempt and, below those, for the connect, tls, send, wait and parse
+phases. Tracers implement start_span(), spans implement child(),
+set() and finish(). The default Tracer does nothing.
+"""
+import json
+import time
+import random
+import threading
+
+
+def _new_id(bits=64):
+    """Return a random hex identifier"""
+    return '%0*x' % (bits // 4, random.getrandbits(bits))
+
+
+class NoopSpan(object):
+    """Span that records nothing"""
+
+    def child(self, name, start=None):
+        """Return a child span"""
+        # pylint: disable=unused-argument
+        return self
+
+    def set(self, key, value):
+        """Set an attribute"""
+        pass
+
+    def finish(self, end=None, error=None):
+        """Finish the span"""
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Tracer(object):
+    """No-op tracer, subclasses return real spans"""
+
+    def start_span(self, name, trace_id=None, start=None):
+        """Start a root span, trace_id is the caller's correlation id"""
+        # pylint: disable=unused-argument,no-self-use
+        return NOOP_SPAN
+
+
+# pylint: disable=R0902
+class Span(object):
+    """Span that is handed to its tracer's exporter when finished"""
+
+    # pylint: disable=R0913
+    def __init__(self, tracer, name, trace_id, parent_id=None, start=None):
+        """Init"""
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.error = None
+        self.attributes = {}
+
+    def child(self, name, start=None):
+        """Return a child span"""
+        return Span(self.tracer, name, self.trace_id, self.span_id, start)
+
+    def set(self, key, value):
+        """Set an attribute"""
+        self.attributes[key] = value
+
+    def finish(self, end=None, error=None):
+        """Finish the span and export it"""
+        self.end = time.time() if end is None else end
+        if error is not None:
+            self.error = '%s: %s' % (error.__class__.__name__, error)
+        self.tracer.export(self)
+
+    def as_dict(self):
+        """Return the span as a plain dict"""
+        return dict(
+            name=self.name,
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start,
+            end=self.end,
+            duration=self.end - self.start,
+            error=self.error,
+            attributes=self.attributes,
+        )
+
+
+class SpanTracer(Tracer):
+    """Tracer that creates real spans and passes them to an exporter"""
+
+    def __init__(self, exporter):
+        """Init"""
+        self.exporter = exporter
+
+    def start_span(self, name, trace_id=None, start=None):
+        """Start a root span"""
+        if trace_id is None:
+            trace_id = _new_id(128)
+        return Span(self, name, trace_id, start=start)
+
+    def export(self, span):
+        """Hand a finished span to the exporter"""
+        self.exporter.export(span)
+
+
+class JSONLinesExporter(object):
+    """Write finished spans to a file, one JSON document per line"""
+
+    def __init__(self, path):
+        """Init"""
+        self.path = path
+        self._handle = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Write a span"""
+        line = json.dumps(span.as_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            self._handle.write(line)
+            self._handle.flush()
+
+    def close(self):
+        """Close the file"""
+        with self._lock:
+            self._handle.close()
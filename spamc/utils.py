@@ -2,6 +2,9 @@
 # vim: ai ts=4 sts=4 et sw=4
 """utilities"""
 
+import time
+import threading
+
 from importlib import import_module
 
 
@@ -16,3 +19,68 @@ def load_backend(backend_name):
     except ImportError:
         error_msg = "%s isn't a spamc backend" % backend_name
         raise ImportError(error_msg)
+
+
+class BackendUser(object):
+    """Mixin of the components that wait on backend queues, using the
+    backend of the SpamC client they are given to unless one is set"""
+
+    backend = None
+    backend_mod = None
+
+    def set_backend(self, backend):
+        """Use backend, a module or name, or None for that of the
+        client, falling back to threads until bound"""
+        self.backend = backend
+        if isinstance(backend, str):
+            backend = load_backend(backend)
+        self.backend_mod = backend or load_backend('thread')
+
+    def bind(self, backend_mod):
+        """Use the backend of the client, unless one was set"""
+        if self.backend is None:
+            self.backend = self.backend_mod = backend_mod
+            self._rebind(backend_mod)
+
+    def _rebind(self, backend_mod):
+        """Move anything created before bind() to backend_mod"""
+        pass
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter"""
+
+    def __init__(self, rate, burst=None):
+        """Init, rate is tokens per second"""
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens accrued since the last call"""
+        now = time.time()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, tokens=1):
+        """Take tokens if they are available"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def reserve(self, tokens=1, max_wait=None):
+        """Take tokens, possibly on credit, returning how long to wait
+        before using them or None if that would exceed max_wait"""
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (tokens - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= tokens
+            return wait
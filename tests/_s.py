@@ -61,12 +61,18 @@ class TestSpamdHandler(StreamRequestHandler):
     MessageClass = Message
     default_request_version = "SPAMD/1.0"
 
+    def read_body(self):
+        """Consume the message body like spamd does"""
+        content_length = int(self.headers.get('Content-length', 0))
+        return self.rfile.read(content_length)
+
     def do_PING(self):
         """Emulate PING"""
         self.wfile.write("SPAMD/1.5 0 PONG\r\n")
 
     def do_TELL(self):
         """Emulate TELL"""
+        self.read_body()
         self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
         didset = self.headers.get('Set')
         if didset:
@@ -110,6 +116,7 @@ class TestSpamdHandler(StreamRequestHandler):
 
     def do_REPORT(self):
         """Emulate REPORT"""
+        self.read_body()
         self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
         self.wfile.write("Spam: True ; 15 / 5\r\n")
         if self.request_version >= (1, 3):
@@ -121,6 +128,7 @@ class TestSpamdHandler(StreamRequestHandler):
 
     def do_SYMBOLS(self):
         """Emulate SYMBOLS"""
+        self.read_body()
         rules = "BAYES_00,RDNS_NONE,KAM_LAZY_DOMAIN_SECURITY"
         self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
         self.wfile.write("Spam: True ; 15 / 5\r\n")
@@ -134,6 +142,7 @@ class TestSpamdHandler(StreamRequestHandler):
 
     def do_CHECK(self):
         """Emulate CHECK"""
+        self.read_body()
         self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
         self.wfile.write("Spam: True ; 15 / 5\r\n")
         self.wfile.write("\r\n\r\n")
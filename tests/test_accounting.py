@@ -0,0 +1,88 @@
+import sys
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from spamc import SpamC
+from spamc.stats import RequestStats
+from spamc.accounting import Accounting, OTHER, NO_USER
+
+from _s import return_tcp
+
+
+def user_stats(user, sent=10, wait=0.5, err=None):
+    stats = RequestStats('CHECK', user)
+    stats.bytes_sent = sent
+    stats.add_phase('wait', 0.0, wait)
+    stats.finish(err)
+    return stats
+
+
+class TestAccounting(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10110)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_record(self):
+        accounting = Accounting()
+        accounting.record(user_stats('a'))
+        accounting.record(user_stats('a', err=ValueError('x')))
+        accounting.record(user_stats(None))
+        snapshot = accounting.snapshot()
+        self.assertEqual(2, snapshot['a']['requests'])
+        self.assertEqual(20, snapshot['a']['bytes_sent'])
+        self.assertEqual(1.0, snapshot['a']['wait_time'])
+        self.assertEqual(1, snapshot['a']['errors'])
+        self.assertEqual(1, snapshot[NO_USER]['requests'])
+        self.assertEqual(0, snapshot[OTHER]['requests'])
+
+    def test_bounded(self):
+        accounting = Accounting(max_users=3)
+        for _ in range(50):
+            accounting.record(user_stats('heavy'))
+        for num in range(20):
+            accounting.record(user_stats('light%d' % num))
+        snapshot = accounting.snapshot()
+        self.assertEqual(4, len(snapshot))
+        self.assertIn('heavy', snapshot)
+        self.assertEqual(70, sum([usage['requests']
+                                  for usage in snapshot.values()]))
+        self.assertEqual('heavy', accounting.top(1)[0][0])
+
+    def test_weight(self):
+        self.assertRaises(ValueError, Accounting, weight='xxx')
+        accounting = Accounting(max_users=1, weight='bytes')
+        accounting.record(user_stats('a', sent=100))
+        accounting.record(user_stats('b', sent=1))
+        snapshot = accounting.reset()
+        self.assertEqual(101, snapshot['b']['weight'])
+        self.assertEqual(100, snapshot['b']['error_bound'])
+        self.assertEqual(100, snapshot[OTHER]['bytes_sent'])
+        self.assertEqual([OTHER], list(accounting.snapshot()))
+
+    def test_spamc_accounting(self):
+        accounting = Accounting()
+        spamc_tcp = SpamC(host='127.0.0.1', port=10110, user='exim',
+                          gzip=True, accounting=accounting)
+        spamc_tcp.check('Subject: test\r\n\r\nbody')
+        usage = accounting.snapshot()['exim']
+        self.assertEqual(1, usage['requests'])
+        self.assertTrue(usage['bytes_sent'] > 0)
+        self.assertTrue(usage['compress_time'] > 0)
+
+
+if __name__ == '__main__':
+    unittest2.main()
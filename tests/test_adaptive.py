@@ -0,0 +1,92 @@
+import sys
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from spamc import SpamC
+from spamc.stats import RequestStats
+from spamc.metrics import Histogram
+from spamc.adaptive import LatencyModel, size_class
+
+from _s import return_tcp
+
+
+def wait_stats(wait, size=1000, endpoint='a', err=None):
+    stats = RequestStats('CHECK', endpoint=endpoint)
+    stats.msg_size = size
+    stats.add_phase('wait', 0.0, wait)
+    stats.finish(err)
+    return stats
+
+
+class TestAdaptive(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10130)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_size_class(self):
+        self.assertEqual(0, size_class(5000))
+        self.assertEqual(1, size_class(20000))
+        self.assertEqual(5, size_class(10 * 1024 * 1024))
+
+    def test_decay(self):
+        histogram = Histogram((1.0, 2.0))
+        for _ in range(5):
+            histogram.observe(0.5)
+        histogram.decay()
+        self.assertEqual(2, histogram.count)
+
+    def test_default_until_learned(self):
+        model = LatencyModel(min_samples=10)
+        self.assertEqual(30, model.read_timeout('a', 1000, 30))
+        for _ in range(9):
+            model.record(wait_stats(0.05))
+        self.assertEqual(30, model.read_timeout('a', 1000, 30))
+        model.record(wait_stats(0.05))
+        self.assertNotEqual(30, model.read_timeout('a', 1000, 30))
+
+    def test_size_classes(self):
+        model = LatencyModel(min_samples=10, min_timeout=0.01,
+                             max_timeout=100)
+        for _ in range(100):
+            model.record(wait_stats(0.05, size=5000))
+            model.record(wait_stats(3.0, size=10 * 1024 * 1024))
+            model.record(wait_stats(60.0, err=ValueError('x')))
+        small = model.read_timeout('a', 4000)
+        large = model.read_timeout('a', 8 * 1024 * 1024)
+        self.assertTrue(0.05 <= small < 0.2)
+        self.assertTrue(3.0 <= large < 10)
+        self.assertTrue(0.04 < model.ewma('a', 4000) < 0.06)
+        self.assertEqual(None, model.read_timeout('b', 4000))
+
+    def test_bounds(self):
+        model = LatencyModel(min_samples=1, min_timeout=1, max_timeout=5)
+        model.record(wait_stats(0.001))
+        model.record(wait_stats(20, size=10 ** 7))
+        self.assertEqual(1, model.read_timeout('a', 1000))
+        self.assertEqual(5, model.read_timeout('a', 10 ** 7))
+
+    def test_spamc_learns(self):
+        model = LatencyModel(min_samples=5, min_timeout=0.5)
+        spamc_tcp = SpamC(host='127.0.0.1', port=10130,
+                          latency_model=model)
+        for _ in range(6):
+            spamc_tcp.check('Subject: test\r\n\r\nbody')
+        self.assertEqual(0.5, model.read_timeout('127.0.0.1:10130', 100))
+
+
+if __name__ == '__main__':
+    unittest2.main()
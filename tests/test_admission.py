@@ -0,0 +1,396 @@
+import sys
+import time
+import random
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from SocketServer import ThreadingTCPServer
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.endpoints import Endpoint
+from spamc.exceptions import SpamCConnError, SpamCTimeOutError
+from spamc.limits import ConcurrencyLimit, AdmissionControl, \
+    AdaptiveLimit, AdaptiveAdmissionControl, FairQueue, UserRateLimits
+
+from _s import TestSpamdHandler
+
+MSG = 'Subject: test\r\n\r\nbody'
+
+
+class SlowSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        time.sleep(0.5)
+        TestSpamdHandler.do_CHECK(self)
+
+
+class TestAdmission(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = ThreadingTCPServer(
+            ('127.0.0.1', 10170), SlowSpamdHandler)
+        cls.tcp_server.daemon_threads = True
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def _queue(self, backend):
+        limit = ConcurrencyLimit(1, backend, timeout=0.05, max_queue=0)
+        self.assertEqual(0.0, limit.acquire())
+        self.assertRaises(SpamCConnError, limit.acquire)
+        limit.max_queue = 1
+        start = time.time()
+        self.assertRaises(SpamCConnError, limit.acquire)
+        self.assertTrue(time.time() - start >= 0.04)
+        limit.release()
+        self.assertEqual(0.0, limit.acquire())
+        self.assertEqual(
+            dict(limit=1, in_flight=1, waiting=0, rejected=1, timeouts=1),
+            limit.snapshot())
+
+    def test_queue_thread(self):
+        self._queue('thread')
+
+    def test_queue_gevent(self):
+        self._queue('gevent')
+
+    def test_queue_eventlet(self):
+        self._queue('eventlet')
+
+    def test_client(self):
+        metrics = Metrics()
+        admission = AdmissionControl(limit=1, max_queue=1,
+                                     queue_timeout=0.2)
+        spamc_tcp = SpamC('127.0.0.1', 10170, metrics=metrics,
+                          admission=admission)
+        results = []
+
+        def check():
+            try:
+                results.append(spamc_tcp.check(MSG)['message'])
+            except SpamCConnError as err:
+                results.append(err.__class__.__name__)
+
+        threads = []
+        for _ in range(3):
+            thread = threading.Thread(target=check)
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['SpamCConnError', 'SpamCConnError', 'EX_OK'],
+                         results)
+        state = admission.snapshot()['127.0.0.1:10170']
+        self.assertEqual(1, state['rejected'])
+        self.assertEqual(1, state['timeouts'])
+        self.assertEqual(0, state['in_flight'])
+        self.assertEqual(1, metrics.queue_wait['127.0.0.1:10170'].count)
+        text = metrics.render()
+        self.assertIn(
+            'spamc_queue_depth{endpoint="127.0.0.1:10170"} 0', text)
+        self.assertIn(
+            'spamc_in_flight_requests{endpoint="127.0.0.1:10170"} 0', text)
+        self.assertIn('spamc_queue_wait_seconds_count'
+                      '{endpoint="127.0.0.1:10170"} 1', text)
+
+    def test_client_deadline(self):
+        admission = AdmissionControl(limit=1, queue_timeout=5.0)
+        spamc_tcp = SpamC('127.0.0.1', 10170, admission=admission,
+                          total_timeout=0.2)
+        endpoint = spamc_tcp.endpoints[0]
+        admission.acquire(endpoint)
+        try:
+            start = time.time()
+            self.assertRaises(SpamCTimeOutError, spamc_tcp.check, MSG)
+            self.assertTrue(time.time() - start < 1.0)
+        finally:
+            admission.release(endpoint)
+        state = admission.snapshot()['127.0.0.1:10170']
+        self.assertEqual((0, 1), (state['waiting'], state['timeouts']))
+        admission = AdmissionControl(
+            rate_limits=UserRateLimits(1, 1), queue_timeout=5.0)
+        admission.acquire(endpoint, user='a')
+        start = time.time()
+        self.assertRaises(SpamCConnError, admission.acquire, endpoint,
+                          user='a', deadline=time.time() + 0.1)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_shared_metrics(self):
+        metrics = Metrics()
+        admission = AdmissionControl(limit=1)
+        other = AdmissionControl(limit=2)
+        for user in ('a', 'b', 'c'):
+            SpamC('127.0.0.1', 10170, user=user, metrics=metrics,
+                  admission=admission)
+        SpamC('127.0.0.1', 10171, metrics=metrics, admission=other)
+        other.acquire(Endpoint('127.0.0.1', 10171))
+        self.assertEqual(8, len(metrics.gauges))
+        text = metrics.render()
+        self.assertEqual(1, text.count('# TYPE spamc_queue_depth gauge'))
+        self.assertIn(
+            'spamc_in_flight_requests{endpoint="127.0.0.1:10171"} 1', text)
+
+    def test_client_lanes(self):
+        metrics = Metrics()
+        admission = AdmissionControl(limit=1)
+        spamc_tcp = SpamC('127.0.0.1', 10170, metrics=metrics,
+                          admission=admission)
+        results = []
+
+        def run(lane):
+            if lane == 'learn':
+                spamc_tcp.learn(MSG, 'spam')
+            else:
+                spamc_tcp.check(MSG, priority=lane)
+            results.append(lane)
+
+        threads = []
+        for lane in ('interactive', 'learn', 'bulk', 'interactive'):
+            thread = threading.Thread(target=run, args=(lane,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual('interactive', results[1])
+        self.assertIn('spamc_lane_queue_depth{endpoint="127.0.0.1:10170",'
+                      'lane="bulk"} 0', metrics.render())
+
+    def test_per_endpoint(self):
+        admission = AdmissionControl(limit=1, max_queue=0)
+        admission.acquire(Endpoint('a', 1))
+        admission.acquire(Endpoint('b', 1))
+        self.assertRaises(SpamCConnError, admission.acquire,
+                          Endpoint('a', 1))
+        admission.release(Endpoint('a', 1))
+        admission.acquire(Endpoint('a', 1))
+
+
+class TestAdaptiveLimit(unittest2.TestCase):
+
+    def test_resize(self):
+        limit = ConcurrencyLimit(3, max_queue=0)
+        for _ in range(3):
+            limit.acquire()
+        limit.resize(1)
+        self.assertEqual(3, limit.in_flight)
+        limit.release()
+        limit.release()
+        self.assertEqual(1, limit.in_flight)
+        self.assertRaises(SpamCConnError, limit.acquire)
+        limit.resize(2)
+        limit.acquire()
+        self.assertRaises(SpamCConnError, limit.acquire)
+        self.assertEqual(2, limit.snapshot()['in_flight'])
+
+    def test_additive_increase(self):
+        adaptive = AdaptiveLimit(initial=4, max_limit=6)
+        for num in range(100):
+            limit = adaptive.update(0.1, True, 4, now=num)
+        self.assertEqual(6, limit)
+
+    def test_no_increase_when_idle(self):
+        adaptive = AdaptiveLimit(initial=4)
+        for num in range(100):
+            limit = adaptive.update(0.1, True, 1, now=num)
+        self.assertEqual(4, limit)
+
+    def test_decrease_on_errors(self):
+        adaptive = AdaptiveLimit(initial=10, min_limit=2, backoff=0.5)
+        adaptive.update(0.1, True, 10, now=0)
+        self.assertEqual(5, adaptive.update(None, False, 10, now=1))
+        # at most one cut per round trip
+        self.assertEqual(5, adaptive.update(None, False, 10, now=1.01))
+        self.assertEqual(2, adaptive.update(None, False, 10, now=2))
+        self.assertEqual(2, adaptive.update(None, False, 10, now=3))
+        self.assertEqual(2, adaptive.update(None, None, 10, now=4))
+
+    def test_decrease_on_latency(self):
+        adaptive = AdaptiveLimit(initial=10, alpha=1.0)
+        adaptive.update(0.1, True, 10, now=0)
+        self.assertEqual(9, adaptive.update(0.5, True, 10, now=1))
+        self.assertEqual(9, adaptive.update(0.15, True, 10, now=2))
+
+    def test_baseline_follows_latency(self):
+        adaptive = AdaptiveLimit()
+        adaptive.update(0.01, True, 1, now=0)
+        for num in range(1000):
+            adaptive.update(0.1, True, 1, now=num)
+        self.assertAlmostEqual(0.1, adaptive.baseline, places=4)
+
+    def test_steady_noisy_latency(self):
+        adaptive = AdaptiveLimit(initial=10)
+        rand = random.Random(0)
+        now = 0.0
+        for _ in range(2000):
+            elapsed = rand.choice([0.05, 0.1, 0.15, 0.3, 0.4])
+            now += elapsed
+            limit = adaptive.update(elapsed, True, int(adaptive.limit),
+                                    now=now)
+        self.assertTrue(limit >= 10)
+
+    def test_sustained_inflation(self):
+        adaptive = AdaptiveLimit(initial=10)
+        rand = random.Random(0)
+        now = 0.0
+        limits = []
+        for num in range(2600):
+            elapsed = rand.choice([0.05, 0.1, 0.15, 0.3, 0.4])
+            if num >= 2000:
+                elapsed *= 5
+            now += elapsed / 10
+            limits.append(adaptive.update(elapsed, True, int(adaptive.limit),
+                                          now=now))
+        self.assertTrue(limits[1999] >= 20)
+        # queueing is not taken for the norm, the limit is cut right down
+        self.assertTrue(min(limits[2000:]) <= 2)
+        self.assertTrue(limits[2099] < limits[1999] / 2)
+
+    def test_admission(self):
+        admission = AdaptiveAdmissionControl(initial=2, backoff=0.5,
+                                             max_queue=0)
+        endpoint = Endpoint('a', 1)
+        admission.acquire(endpoint)
+        admission.acquire(endpoint)
+        self.assertRaises(SpamCConnError, admission.acquire, endpoint)
+        admission.release(endpoint, 0.1, True)
+        admission.release(endpoint, 0.1, False)
+        self.assertEqual(
+            dict(limit=1, in_flight=0, waiting=0, rejected=1, timeouts=0),
+            admission.snapshot()['a:1'])
+
+
+class TestPriorityLanes(unittest2.TestCase):
+
+    def _order(self, limit, lanes):
+        """Queue a waiter per lane behind a held slot and return the
+        order in which they are admitted"""
+        admitted = []
+
+        def wait(lane):
+            limit.acquire(lane)
+            admitted.append(lane)
+
+        limit.acquire('interactive')
+        threads = []
+        for lane in lanes:
+            thread = threading.Thread(target=wait, args=(lane,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        for _ in lanes:
+            limit.release()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        return admitted
+
+    def test_strict(self):
+        limit = ConcurrencyLimit(1)
+        self.assertEqual(
+            ['interactive', 'interactive', 'normal', 'bulk', 'bulk'],
+            self._order(limit, ['bulk', 'normal', 'interactive', 'bulk',
+                                'interactive']))
+
+    def test_weighted(self):
+        limit = ConcurrencyLimit(1, weights=dict(interactive=2, bulk=1))
+        self.assertEqual(
+            ['interactive', 'bulk', 'interactive', 'interactive', 'bulk',
+             'interactive', 'bulk', 'bulk'],
+            self._order(limit, ['bulk'] * 4 + ['interactive'] * 4))
+
+    def test_reserved(self):
+        limit = ConcurrencyLimit(2, max_queue=0, reserved=1)
+        limit.acquire('bulk')
+        self.assertRaises(SpamCConnError, limit.acquire, 'bulk')
+        self.assertRaises(SpamCConnError, limit.acquire)
+        limit.acquire('interactive')
+        self.assertEqual(2, limit.in_flight)
+
+    def test_unknown_lane(self):
+        limit = ConcurrencyLimit(1, max_queue=1, timeout=0.01)
+        limit.acquire()
+        self.assertRaises(SpamCConnError, limit.acquire, 'nosuchlane')
+        self.assertEqual(1, limit.timeouts)
+        self.assertEqual(0, limit.queued()['normal'])
+
+
+class TestFairness(unittest2.TestCase):
+
+    def _drain(self, queue):
+        result = []
+        while len(queue):
+            result.append(queue.popleft())
+        return result
+
+    def test_round_robin(self):
+        queue = FairQueue()
+        for num in range(4):
+            queue.append('a%d' % num, 'a')
+        queue.append('b0', 'b')
+        queue.append('b1', 'b')
+        self.assertEqual(['a0', 'b0', 'a1', 'b1', 'a2', 'a3'],
+                         self._drain(queue))
+        self.assertEqual({}, queue.queues)
+
+    def test_deficit(self):
+        queue = FairQueue(quantum=2)
+        for num in range(3):
+            queue.append('a%d' % num, 'a', 4)
+        for num in range(6):
+            queue.append('b%d' % num, 'b', 1)
+        self.assertEqual(
+            ['b0', 'b1', 'a0', 'b2', 'b3', 'b4', 'b5', 'a1', 'a2'],
+            self._drain(queue))
+
+    def test_remove(self):
+        queue = FairQueue()
+        queue.append('a0', 'a')
+        queue.append('b0', 'b')
+        self.assertIn('a0', queue)
+        queue.remove('a0')
+        self.assertNotIn('a0', queue)
+        self.assertRaises(ValueError, queue.remove, 'a0')
+        self.assertEqual(['b0'], self._drain(queue))
+
+    def test_rate_limits(self):
+        limits = UserRateLimits(1, 2, max_users=2, idle_time=60)
+        self.assertEqual(0.0, limits.reserve('a'))
+        self.assertEqual(0.0, limits.reserve('a'))
+        self.assertEqual(None, limits.reserve('a', 0.5))
+        self.assertTrue(0.9 < limits.reserve('a') <= 1.0)
+        self.assertEqual(0.0, limits.reserve('b'))
+        self.assertEqual(0.0, limits.reserve('c'))
+        self.assertEqual(['b', 'c'], sorted(limits.buckets))
+
+    def test_shed(self):
+        admission = AdmissionControl(
+            rate_limits=UserRateLimits(1, 1), rate_policy='shed')
+        endpoint = Endpoint('a', 1)
+        admission.acquire(endpoint, user='a')
+        self.assertRaises(SpamCConnError, admission.acquire, endpoint,
+                          user='a')
+        admission.acquire(endpoint, user='b')
+        self.assertEqual(2, admission.snapshot()['a:1']['in_flight'])
+        self.assertRaises(ValueError, AdmissionControl, rate_policy='x')
+
+    def test_queue(self):
+        admission = AdmissionControl(
+            rate_limits=UserRateLimits(20, 1), queue_timeout=0.2)
+        endpoint = Endpoint('a', 1)
+        self.assertEqual(0.0, admission.acquire(endpoint, user='a'))
+        start = time.time()
+        self.assertTrue(admission.acquire(endpoint, user='a') > 0)
+        self.assertTrue(time.time() - start >= 0.04)
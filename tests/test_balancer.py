@@ -0,0 +1,286 @@
+import sys
+import time
+import errno
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from cStringIO import StringIO
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.coalesce import Coalescer
+from spamc.limits import ConcurrencyLimit, AdmissionControl
+from spamc.exceptions import SpamCConnError, SpamCTimeOutError
+from spamc.retry import RetryPolicy, RETRY_ERRNOS
+from spamc.endpoints import Endpoint
+from spamc.stats import RequestStats
+from spamc.balancer import LatencyBalancer, ConsistentHash, SizeRouter, \
+    HealthChecker
+
+from _s import return_tcp
+
+MSG = 'Subject: test\r\n\r\nbody'
+
+
+class TestBalancer(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10150)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        self.fast = Endpoint('127.0.0.1', 1)
+        self.slow = Endpoint('127.0.0.1', 2)
+
+    def test_prefers_fast_endpoint(self):
+        balancer = LatencyBalancer()
+        balancer.start(self.fast)
+        balancer.finish(self.fast, 0.01, True)
+        balancer.start(self.slow)
+        balancer.finish(self.slow, 1.0, True)
+        endpoints = [self.fast, self.slow]
+        for _ in range(10):
+            self.assertIs(self.fast, balancer.select(endpoints, None))
+        self.assertIs(
+            self.slow, balancer.select(endpoints, None, exclude=(self.fast,)))
+
+    def test_outstanding_requests(self):
+        balancer = LatencyBalancer()
+        for _ in range(5):
+            balancer.start(self.fast)
+        self.assertIs(
+            self.slow, balancer.select([self.fast, self.slow], None))
+        self.assertEqual(
+            5, balancer.snapshot()['127.0.0.1:1']['outstanding'])
+
+    def test_drain_and_warm_up(self):
+        balancer = LatencyBalancer(fall=2, rise=2, drain_time=0.2,
+                                   warmup_time=0.2, recover_after=60)
+        endpoints = [self.fast, self.slow]
+        balancer.report(self.fast, False)
+        self.assertTrue(balancer.snapshot()['127.0.0.1:1']['healthy'])
+        balancer.report(self.fast, False)
+        state = balancer.snapshot()['127.0.0.1:1']
+        self.assertFalse(state['healthy'])
+        self.assertTrue(0 < state['weight'] <= 1)
+        time.sleep(0.25)
+        self.assertEqual(0, balancer.snapshot()['127.0.0.1:1']['weight'])
+        for _ in range(10):
+            self.assertIs(self.slow, balancer.select(endpoints, None))
+        balancer.report(self.fast, True)
+        balancer.report(self.fast, True)
+        state = balancer.snapshot()['127.0.0.1:1']
+        self.assertTrue(state['healthy'])
+        self.assertTrue(state['weight'] < 0.5)
+        time.sleep(0.25)
+        self.assertEqual(1.0, balancer.snapshot()['127.0.0.1:1']['weight'])
+
+    def test_all_down(self):
+        balancer = LatencyBalancer(fall=1, drain_time=0)
+        balancer.report(self.fast, False)
+        self.assertIs(self.fast, balancer.select([self.fast], None))
+
+    def test_client(self):
+        balancer = LatencyBalancer(default_latency=0, fall=1, drain_time=0,
+                                   recover_after=60)
+        policy = RetryPolicy(
+            base=0.01, errnos=RETRY_ERRNOS + (errno.ECONNREFUSED,))
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10150', '127.0.0.1:10159'],
+            balancer=balancer, retry_policy=policy)
+        for _ in range(5):
+            result = spamc_tcp.check(MSG)
+            self.assertEqual('EX_OK', result['message'])
+        state = balancer.snapshot()
+        self.assertFalse(state['127.0.0.1:10159']['healthy'])
+        self.assertEqual(0, state['127.0.0.1:10150']['outstanding'])
+        self.assertTrue(state['127.0.0.1:10150']['latency'] > 0)
+
+    def test_health_checker(self):
+        balancer = LatencyBalancer(fall=1, rise=1)
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10150', '127.0.0.1:10159'],
+            balancer=balancer)
+        checker = HealthChecker(spamc_tcp, interval=0.05, timeout=0.5)
+        checker.start()
+        time.sleep(0.2)
+        checker.stop()
+        state = balancer.snapshot()
+        self.assertTrue(state['127.0.0.1:10150']['healthy'])
+        self.assertFalse(state['127.0.0.1:10159']['healthy'])
+
+    def test_health_checker_any_balancer(self):
+        latency = LatencyBalancer(fall=1, rise=1)
+        for balancer in (None, ConsistentHash(fallback=latency)):
+            spamc_tcp = SpamC(
+                endpoints=['127.0.0.1:10150', '127.0.0.1:10159'],
+                balancer=balancer)
+            HealthChecker(spamc_tcp, timeout=0.5).check()
+        self.assertFalse(latency.snapshot()['127.0.0.1:10159']['healthy'])
+
+
+class TestConsistentHash(unittest2.TestCase):
+
+    def setUp(self):
+        self.endpoints = [Endpoint('127.0.0.1', port)
+                          for port in range(1, 5)]
+
+    def _select(self, balancer, key, endpoints=None, exclude=()):
+        stats = RequestStats('CHECK', user=key)
+        return balancer.select(endpoints or self.endpoints, stats, exclude)
+
+    def test_same_user_same_endpoint(self):
+        balancer = ConsistentHash()
+        for user in ('alice', 'bob', u'ch\xe9'):
+            endpoint = self._select(balancer, user)
+            for _ in range(5):
+                self.assertIs(endpoint, self._select(balancer, user))
+
+    def test_routing_key(self):
+        balancer = ConsistentHash()
+        stats = RequestStats('CHECK', user='alice')
+        stats.routing_key = 'bob'
+        self.assertIs(self._select(balancer, 'bob'),
+                      balancer.select(self.endpoints, stats))
+
+    def test_spread_and_stability(self):
+        balancer = ConsistentHash()
+        users = ['user%d' % num for num in range(1000)]
+        before = dict([(user, self._select(balancer, user))
+                       for user in users])
+        counts = {}
+        for endpoint in before.values():
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+        self.assertEqual(4, len(counts))
+        self.assertTrue(min(counts.values()) > 150)
+        removed = self.endpoints[0]
+        remaining = self.endpoints[1:]
+        for user in users:
+            after = self._select(balancer, user, remaining)
+            if before[user] is not removed:
+                self.assertIs(before[user], after)
+
+    def test_bounded_load(self):
+        balancer = ConsistentHash(epsilon=0.5)
+        home = self._select(balancer, 'heavy')
+        chosen = []
+        for _ in range(8):
+            endpoint = self._select(balancer, 'heavy')
+            balancer.start(endpoint)
+            chosen.append(endpoint)
+        self.assertTrue(len(set(chosen)) > 1)
+        self.assertEqual(home, chosen[0])
+        self.assertTrue(max(balancer.outstanding.values()) <= 3)
+        for endpoint in chosen:
+            balancer.finish(endpoint, 0.1, True)
+        self.assertIs(home, self._select(balancer, 'heavy'))
+
+    def test_exclude_and_no_key(self):
+        balancer = ConsistentHash()
+        home = self._select(balancer, 'alice')
+        self.assertIsNot(home, self._select(balancer, 'alice',
+                                            exclude=(home,)))
+        self.assertIn(self._select(balancer, None), self.endpoints)
+
+
+class TestSizeRouter(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [return_tcp(10160), return_tcp(10161)]
+        for server in cls.servers:
+            t1 = threading.Thread(target=server.serve_forever)
+            t1.setDaemon(True)
+            t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+
+    def test_routing(self):
+        metrics = Metrics()
+        router = SizeRouter(['127.0.0.1:10161'], threshold=1024)
+        spamc_tcp = SpamC(endpoints=['127.0.0.1:10160'], balancer=router,
+                          metrics=metrics)
+        big = MSG + 'x' * 2048
+        for msg in (MSG, big, StringIO(big)):
+            result = spamc_tcp.check(msg)
+            self.assertEqual('EX_OK', result['message'])
+        self.assertEqual(1, metrics.latency['127.0.0.1:10160'].count)
+        self.assertEqual(2, metrics.latency['127.0.0.1:10161'].count)
+        self.assertEqual(0, router.limits['large'].in_flight)
+
+    def test_pool_limit(self):
+        router = SizeRouter(['127.0.0.1:10161'], max_large=1, max_small=2,
+                            queue_timeout=0.05)
+        large = router.large_endpoints[0]
+        small = Endpoint('127.0.0.1', 10160)
+        router.start(large)
+        self.assertRaises(SpamCConnError, router.start, large)
+        router.start(small)
+        router.start(small)
+        self.assertRaises(SpamCConnError, router.start, small)
+        router.finish(large, 0.1, True)
+        router.start(large)
+        self.assertEqual(1, router.limits['large'].in_flight)
+        self.assertEqual(2, router.limits['small'].in_flight)
+
+    def test_pool_deadline(self):
+        router = SizeRouter(['127.0.0.1:10161'], threshold=1024,
+                            max_large=1, queue_timeout=5.0)
+        spamc_tcp = SpamC(endpoints=['127.0.0.1:10160'], balancer=router,
+                          total_timeout=0.2)
+        large = router.large_endpoints[0]
+        router.start(large)
+        try:
+            start = time.time()
+            self.assertRaises(SpamCTimeOutError, spamc_tcp.check,
+                              MSG + 'x' * 2048)
+            self.assertTrue(time.time() - start < 1.0)
+        finally:
+            router.finish(large, 0.1, True)
+        self.assertEqual('EX_OK', spamc_tcp.check(MSG)['message'])
+
+    def test_bind(self):
+        router = SizeRouter(['127.0.0.1:10161'], max_large=1)
+        admission = AdmissionControl()
+        coalescer = Coalescer()
+        threaded = Coalescer('thread')
+        spamc_tcp = SpamC(endpoints=['127.0.0.1:10160'], balancer=router,
+                          admission=admission, coalescer=coalescer,
+                          backend='gevent')
+        self.assertEqual(5.0, router.limits['large'].timeout)
+        for component in (router.limits['large'], admission, coalescer):
+            self.assertIs(spamc_tcp.backend_mod, component.backend_mod)
+        SpamC(endpoints=['127.0.0.1:10160'], coalescer=threaded,
+              backend='gevent')
+        self.assertEqual('spamc.backend_thread', threaded.backend_mod.__name__)
+
+    def _limit(self, backend):
+        limit = ConcurrencyLimit(1, backend, timeout=0.05)
+        limit.acquire()
+        self.assertRaises(SpamCConnError, limit.acquire)
+        limit.release()
+        limit.acquire()
+
+    def test_limit_thread(self):
+        self._limit('thread')
+
+    def test_limit_gevent(self):
+        self._limit('gevent')
+
+    def test_limit_eventlet(self):
+        self._limit('eventlet')
@@ -0,0 +1,94 @@
+import sys
+import time
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from SocketServer import ThreadingTCPServer
+
+from spamc import SpamC
+from spamc.batch import BatchScanner
+from spamc.adaptive import LatencyModel
+
+from _s import TestSpamdHandler
+
+from test_adaptive import wait_stats
+
+SEEN = []
+
+
+class SizedSpamdHandler(TestSpamdHandler):
+
+    def read_body(self):
+        body = TestSpamdHandler.read_body(self)
+        SEEN.append(len(body))
+        time.sleep(len(body) / 1000000.0)
+        return body
+
+
+def message(size):
+    return 'Subject: test\r\n\r\n' + 'x' * size
+
+
+class TestBatch(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = ThreadingTCPServer(
+            ('127.0.0.1', 10180), SizedSpamdHandler)
+        cls.tcp_server.daemon_threads = True
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        del SEEN[:]
+
+    def _scan(self, aging, backend):
+        spamc_tcp = SpamC('127.0.0.1', 10180, backend=backend)
+        scanner = BatchScanner(spamc_tcp, workers=1, aging=aging)
+        sizes = [100000, 100, 20000, 1000]
+        results = scanner.scan([message(size) for size in sizes])
+        self.assertEqual(['EX_OK'] * 4,
+                         [result['message'] for result in results])
+        return [size - 19 for size in SEEN]
+
+    def test_shortest_first(self):
+        self.assertEqual([100, 1000, 20000, 100000],
+                         self._scan(1.0, 'gevent'))
+
+    def test_aging(self):
+        # aging outweighs any predicted cost, first come first served
+        self.assertEqual([100000, 100, 20000, 1000],
+                         self._scan(1e9, 'gevent'))
+
+    def test_threads(self):
+        spamc_tcp = SpamC('127.0.0.1', 10180)
+        scanner = BatchScanner(spamc_tcp, workers=3)
+        messages = [message(size) for size in range(0, 10000, 500)]
+        messages.append(1)
+        results = scanner.scan(iter(messages), 'symbols')
+        self.assertEqual(21, len(results))
+        self.assertEqual(['EX_OK'] * 20,
+                         [result['message'] for result in results[:20]])
+        self.assertIsInstance(results[20], ValueError)
+
+    def test_predict(self):
+        model = LatencyModel()
+        spamc_tcp = SpamC('127.0.0.1', 10180, latency_model=model)
+        scanner = BatchScanner(spamc_tcp, seconds_per_byte=1e-6)
+        self.assertEqual(1.0, scanner.predict(1000000))
+        model.record(wait_stats(0.5, 1000000, 'a'))
+        model.record(wait_stats(1.5, 1000000, 'b'))
+        self.assertEqual(1.0, model.cost(1000000))
+        model.record(wait_stats(0.2, 1000, 'a'))
+        self.assertEqual(0.2, scanner.predict(1000))
+        self.assertEqual(1.0, scanner.predict(900000))
@@ -0,0 +1,219 @@
+import sys
+import time
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from cStringIO import StringIO
+from SocketServer import ThreadingTCPServer
+
+import spamc.cache
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.cache import VerdictCache, CanonicalKey, cache_key, \
+    canonical_key
+from spamc.limits import AdmissionControl
+from spamc.shedding import LoadShedder
+from spamc.exceptions import SpamCError
+
+from _s import return_tcp, TestSpamdHandler
+
+MSG = 'Subject: test\r\n\r\nbody'
+
+
+class SlowSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        time.sleep(0.5)
+        TestSpamdHandler.do_CHECK(self)
+
+
+class TestCache(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10200)
+        cls.slow_server = ThreadingTCPServer(
+            ('127.0.0.1', 10201), SlowSpamdHandler)
+        cls.slow_server.daemon_threads = True
+        for server in (cls.tcp_server, cls.slow_server):
+            t1 = threading.Thread(target=server.serve_forever)
+            t1.setDaemon(True)
+            t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+        cls.slow_server.shutdown()
+
+    def test_key(self):
+        self.assertEqual(cache_key('CHECK', 'a', None, MSG),
+                         cache_key('CHECK', 'a', {}, StringIO(MSG)))
+        self.assertNotEqual(cache_key('CHECK', 'a', None, MSG),
+                            cache_key('CHECK', 'b', None, MSG))
+        self.assertNotEqual(cache_key('CHECK', 'a', None, MSG),
+                            cache_key('SYMBOLS', 'a', None, MSG))
+        self.assertNotEqual(cache_key('CHECK', 'a', None, MSG),
+                            cache_key('CHECK', 'a', {'X': '1'}, MSG))
+
+    def test_canonical_key(self):
+        relayed = ('Received: from mx1 (mx1 [10.0.0.1])\r\n'
+                   '\tby mx2 with ESMTP id 4F2A\r\n'
+                   'Delivered-To: a@example.com\r\n'
+                   'X-Envelope-From: <b@example.com>\r\n'
+                   'subject:   test \r\n\r\nbody  \r\n\r\n')
+        key = canonical_key('CHECK', 'a', None, MSG)
+        self.assertEqual(key, canonical_key('CHECK', 'a', None, relayed))
+        self.assertEqual(key, canonical_key('CHECK', 'a', {},
+                                            StringIO(relayed)))
+        self.assertEqual(key, canonical_key(
+            'CHECK', 'a', None, 'Subject: test\n\nbody\n'))
+        self.assertNotEqual(key, canonical_key(
+            'CHECK', 'a', None, 'Subject: test\r\n\r\nbody2'))
+        self.assertNotEqual(key, canonical_key(
+            'CHECK', 'a', None, 'Subject: test\r\nTo: b\r\n\r\nbody'))
+        self.assertNotEqual(key, canonical_key(
+            'CHECK', 'b', None, relayed))
+        self.assertNotEqual(key, CanonicalKey(())('CHECK', 'a', None,
+                                                  relayed))
+
+    def test_canonical_key_streaming(self):
+        msg = ('Received: from mx1\r\n\tby mx2\r\n'
+               'Subject: a  long   subject\r\n\tfolded\r\n'
+               'X-Envelope-To: c\r\n\r\n' + 'word  ' * 100 + '\r\n\r\n')
+        key = canonical_key('CHECK', None, None, msg)
+        block_size = spamc.cache.BLOCK_SIZE
+        try:
+            for size in (1, 2, 3, 7, 64):
+                spamc.cache.BLOCK_SIZE = size
+                self.assertEqual(key, canonical_key(
+                    'CHECK', None, None, StringIO(msg)))
+        finally:
+            spamc.cache.BLOCK_SIZE = block_size
+
+    def test_lookup(self):
+        cache = VerdictCache(ttl=10, grace=10, refresh_ahead=2)
+        self.assertEqual((None, None), cache.lookup('k'))
+        cache.store('k', {'score': 1.0}, now=100)
+        self.assertEqual('fresh', cache.lookup('k', now=105)[0])
+        self.assertEqual('refresh', cache.lookup('k', now=109)[0])
+        self.assertEqual('fresh', cache.lookup('k', now=109)[0])
+        cache.done_refreshing('k')
+        self.assertEqual('refresh', cache.lookup('k', now=109)[0])
+        self.assertEqual('stale', cache.lookup('k', now=115)[0])
+        self.assertEqual((None, None), cache.lookup('k', now=121))
+        self.assertEqual(0, len(cache))
+
+    def test_eviction(self):
+        cache = VerdictCache(max_entries=3)
+        for num in range(5):
+            cache.store('k%d' % num, {})
+            cache.store('k%d' % num, {})
+        self.assertEqual(['k2', 'k3', 'k4'], sorted(cache.entries))
+        self.assertTrue(len(cache.order) <= 6)
+
+    def test_hit(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC('127.0.0.1', 10200, metrics=metrics,
+                          cache=VerdictCache())
+        first = spamc_tcp.check(MSG)
+        self.assertNotIn('cached', first)
+        first['score'] = 100.0
+        second = spamc_tcp.check(StringIO(MSG))
+        self.assertTrue(second['cached'])
+        self.assertEqual(15.0, second['score'])
+        self.assertNotIn('cached', spamc_tcp.symbols(MSG))
+        spamc_tcp.ping()
+        self.assertEqual({'hit': 1, 'miss': 2}, metrics.cache)
+        self.assertEqual(3, metrics.latency['127.0.0.1:10200'].count)
+        self.assertIn('spamc_cache_total{result="hit"} 1', metrics.render())
+
+    def test_hit_relayed(self):
+        spamc_tcp = SpamC('127.0.0.1', 10200,
+                          cache=VerdictCache(key_func=canonical_key))
+        spamc_tcp.check(MSG)
+        relayed = 'Received: from mx1\r\n\tby mx2\r\n' + MSG
+        self.assertTrue(spamc_tcp.check(relayed)['cached'])
+
+    def test_stale_if_error(self):
+        cache = VerdictCache(ttl=0, grace=60)
+        SpamC('127.0.0.1', 10200, cache=cache).check(MSG)
+        down = SpamC('127.0.0.1', 10209, cache=cache)
+        result = down.check(MSG)
+        self.assertTrue(result['stale'])
+        self.assertEqual('EX_OK', result['message'])
+        self.assertRaises(SpamCError, down.check, MSG + 'x')
+        cache.stale_if_error = False
+        self.assertRaises(SpamCError, down.check, MSG)
+
+    def test_stale_when_shed(self):
+        cache = VerdictCache(ttl=0, grace=60)
+        SpamC('127.0.0.1', 10200, cache=cache).check(MSG)
+        shedder = LoadShedder(fraction=1.0, latency_slo=0.1)
+        shedder.latency = 1.0
+        metrics = Metrics()
+        spamc_tcp = SpamC('127.0.0.1', 10200, cache=cache, metrics=metrics,
+                          shedder=shedder)
+        self.assertTrue(spamc_tcp.check(MSG)['stale'])
+        self.assertTrue(spamc_tcp.check(MSG + 'x')['shed'])
+        self.assertEqual({('CHECK', 'ok'): 1, ('CHECK', 'shed'): 1},
+                         metrics.requests)
+
+    def test_stale_timeout(self):
+        metrics = Metrics()
+        cache = VerdictCache(ttl=0, grace=60, stale_timeout=0.1)
+        spamc_tcp = SpamC('127.0.0.1', 10201, cache=cache, metrics=metrics)
+        start = time.time()
+        self.assertNotIn('stale', spamc_tcp.check(MSG))
+        self.assertTrue(time.time() - start >= 0.5)
+        self.assertEqual(1, metrics.latency['127.0.0.1:10201'].count)
+        stored = cache.entries.values()[0].stored
+        start = time.time()
+        self.assertTrue(spamc_tcp.check(MSG)['stale'])
+        self.assertTrue(time.time() - start < 0.4)
+        time.sleep(0.6)
+        # the abandoned request completed in the background
+        self.assertTrue(cache.entries.values()[0].stored > stored)
+        self.assertEqual(2, metrics.latency['127.0.0.1:10201'].count)
+        self.assertEqual({'miss': 1, 'stale': 1}, metrics.cache)
+
+    def test_stale_timeout_file(self):
+        metrics = Metrics()
+        admission = AdmissionControl(limit=1)
+        cache = VerdictCache(ttl=0, grace=60, stale_timeout=0.1)
+        spamc_tcp = SpamC('127.0.0.1', 10200, cache=cache, metrics=metrics,
+                          admission=admission)
+        spamc_tcp.check(MSG)
+        stored = cache.entries.values()[0].stored
+        endpoint = spamc_tcp.endpoints[0]
+        # hold the background request in the queue until the file is
+        # closed
+        admission.acquire(endpoint)
+        msg = StringIO(MSG)
+        try:
+            self.assertTrue(spamc_tcp.check(msg)['stale'])
+            msg.close()
+        finally:
+            admission.release(endpoint)
+        time.sleep(0.2)
+        self.assertTrue(cache.entries.values()[0].stored > stored)
+        self.assertEqual({}, metrics.exceptions)
+
+    def test_refresh_ahead(self):
+        metrics = Metrics()
+        cache = VerdictCache(ttl=10, refresh_ahead=10)
+        spamc_tcp = SpamC('127.0.0.1', 10200, cache=cache, metrics=metrics)
+        spamc_tcp.check(MSG)
+        stored = cache.entries.values()[0].stored
+        msg = StringIO(MSG)
+        self.assertTrue(spamc_tcp.check(msg)['cached'])
+        msg.close()
+        time.sleep(0.2)
+        self.assertTrue(cache.entries.values()[0].stored > stored)
+        self.assertEqual({'hit': 1, 'miss': 1}, metrics.cache)
+        self.assertEqual(2, metrics.latency['127.0.0.1:10200'].count)
@@ -0,0 +1,144 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from SocketServer import ThreadingTCPServer
+
+import numpy
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.classifier import NaiveBayes
+
+from _s import TestSpamdHandler
+
+SEEN = []
+SPAM = 'Subject: cheap pills %d\r\n\r\nbuy cheap viagra pills online now'
+HAM = 'Subject: minutes %d\r\n\r\nplease review the meeting minutes today'
+
+
+class VerdictSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        body = self.read_body()
+        SEEN.append(body)
+        self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
+        if 'viagra' in body:
+            self.wfile.write("Spam: True ; 15 / 5\r\n\r\n")
+        else:
+            self.wfile.write("Spam: False ; -2 / 5\r\n\r\n")
+
+
+class TestClassifier(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = ThreadingTCPServer(
+            ('127.0.0.1', 10250), VerdictSpamdHandler)
+        cls.tcp_server.daemon_threads = True
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        del SEEN[:]
+
+    def trained(self, **kwargs):
+        classifier = NaiveBayes(bits=12, min_messages=5, refresh=1,
+                                **kwargs)
+        for num in range(5):
+            classifier.train(classifier.features(SPAM % num), True)
+            classifier.train(classifier.features(HAM % num), False)
+        return classifier
+
+    def test_features(self):
+        classifier = NaiveBayes(bits=12)
+        indices = classifier.features('cheap cheap CHEAP pills 42')
+        self.assertEqual(2, len(indices))
+        self.assertTrue((indices < 4096).all())
+        self.assertEqual(0, len(classifier.features('')))
+
+    def test_verdict(self):
+        classifier = NaiveBayes(bits=12, min_messages=5, refresh=1)
+        self.assertEqual((None, None),
+                         classifier.verdict(classifier.features(SPAM % 0)))
+        classifier = self.trained()
+        verdict, probability = classifier.verdict(
+            classifier.features(SPAM % 9))
+        self.assertEqual('spam', verdict)
+        self.assertTrue(probability > 0.999)
+        self.assertEqual('ham', classifier.verdict(
+            classifier.features(HAM % 9))[0])
+        self.assertEqual(None, classifier.verdict(
+            classifier.features('Subject: hello\r\n\r\nhello there'))[0])
+        batch = [classifier.features(msg) for msg in (
+            SPAM % 1, '', HAM % 1, 'zzz')]
+        expected = [classifier.probability(indices) for indices in batch]
+        self.assertTrue(numpy.allclose(
+            expected, classifier.probabilities(batch)))
+        self.assertEqual(0, len(classifier.probabilities([])))
+
+    def test_save(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'model.npz')
+            self.trained().save(path)
+            classifier = NaiveBayes(bits=12, min_messages=5)
+            classifier.load(path)
+            self.assertEqual('spam', classifier.verdict(
+                classifier.features(SPAM % 9))[0])
+            self.assertRaises(ValueError, NaiveBayes(bits=10).load, path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_offload(self):
+        metrics = Metrics()
+        classifier = NaiveBayes(bits=12, min_messages=5, refresh=1)
+        spamc_tcp = SpamC('127.0.0.1', 10250, metrics=metrics,
+                          classifier=classifier)
+        for num in range(5):
+            spamc_tcp.check(SPAM % num)
+            spamc_tcp.check(HAM % num)
+        self.assertEqual(10, len(SEEN))
+        self.assertEqual(10, classifier.snapshot()['unsure'])
+        result = spamc_tcp.check(SPAM % 10)
+        self.assertTrue(result['isspam'])
+        self.assertTrue(result['classified'] > 0.999)
+        self.assertFalse(spamc_tcp.check(HAM % 10)['isspam'])
+        self.assertEqual(10, len(SEEN))
+        self.assertNotIn('classified', spamc_tcp.symbols(SPAM % 10))
+        self.assertEqual(2, metrics.cache['classifier'])
+        self.assertIn('spamc_classifier_scans{outcome="offloaded"} 2',
+                      metrics.render())
+
+    def test_shadow(self):
+        classifier = self.trained(shadow=True)
+        spamc_tcp = SpamC('127.0.0.1', 10250, classifier=classifier)
+        self.assertNotIn('classified', spamc_tcp.check(SPAM % 10))
+        spamc_tcp.check(HAM % 10)
+        # spamd disagrees with what the classifier learnt
+        spamc_tcp.check(HAM % 11 + ' viagra')
+        self.assertEqual(3, len(SEEN))
+        self.assertEqual(dict(offloaded=0, agree=2, disagree=1, unsure=0),
+                         classifier.snapshot())
+
+    def test_learn(self):
+        classifier = NaiveBayes(bits=12, min_messages=5, refresh=1)
+        spamc_tcp = SpamC('127.0.0.1', 10250, classifier=classifier)
+        spamc_tcp.learn(SPAM % 0, 'spam')
+        spamc_tcp.learn(HAM % 0, 'ham')
+        spamc_tcp.learn(HAM % 0, 'forget')
+        self.assertEqual((5.0, 5.0),
+                         (classifier.spam_total, classifier.ham_total))
@@ -0,0 +1,114 @@
+import sys
+import time
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from SocketServer import ThreadingTCPServer
+
+import gevent
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.coalesce import Coalescer
+from spamc.exceptions import SpamCError
+
+from _s import TestSpamdHandler
+
+MSG = 'Subject: test\r\n\r\nbody'
+SEEN = []
+
+
+class CountingSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        SEEN.append(self.read_body())
+        time.sleep(0.3)
+        self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
+        self.wfile.write("Spam: True ; 15 / 5\r\n\r\n")
+
+
+class TestCoalesce(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = ThreadingTCPServer(
+            ('127.0.0.1', 10210), CountingSpamdHandler)
+        cls.tcp_server.daemon_threads = True
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        del SEEN[:]
+
+    def test_threads(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC('127.0.0.1', 10210, metrics=metrics,
+                          coalescer=Coalescer())
+        results = []
+
+        def check(msg):
+            results.append(spamc_tcp.check(msg))
+
+        threads = [threading.Thread(target=check, args=(MSG,))
+                   for _ in range(10)]
+        threads.append(threading.Thread(target=check, args=(MSG + 'x',)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, len(SEEN))
+        self.assertEqual(11, len(results))
+        self.assertEqual(set([15.0]),
+                         set([result['score'] for result in results]))
+        self.assertEqual(9, len([result for result in results
+                                 if result.get('coalesced')]))
+        self.assertEqual(9, metrics.coalesced)
+        self.assertEqual(2, metrics.latency['127.0.0.1:10210'].count)
+        self.assertEqual(0, len(spamc_tcp.coalescer))
+
+    def test_greenlets(self):
+        spamc_tcp = SpamC('127.0.0.1', 10210, backend='gevent',
+                          coalescer=Coalescer('gevent'))
+        jobs = [gevent.spawn(spamc_tcp.check, MSG) for _ in range(5)]
+        gevent.joinall(jobs)
+        self.assertEqual(1, len(SEEN))
+        self.assertEqual(['EX_OK'] * 5,
+                         [job.value['message'] for job in jobs])
+
+    def test_errors(self):
+        coalescer = Coalescer()
+        spamc_tcp = SpamC('127.0.0.1', 10219, coalescer=coalescer)
+        errors = []
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            raise SpamCError('down')
+
+        def call():
+            try:
+                coalescer.call('k', slow)
+            except SpamCError as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            started.wait()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(1, len(set([id(err) for err in errors])))
+        self.assertRaises(SpamCError, spamc_tcp.check, MSG)
+        self.assertEqual(0, len(coalescer))
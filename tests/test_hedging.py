@@ -0,0 +1,227 @@
+import sys
+import time
+import errno
+import socket
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from SocketServer import ThreadingTCPServer
+
+from spamc import SpamC, backend_thread
+from spamc.metrics import Metrics
+from spamc.stats import RequestStats
+from spamc.adaptive import LatencyModel
+from spamc.hedging import HedgePolicy
+from spamc.endpoints import Endpoint, Balancer, RoundRobin, get_endpoint
+
+from _s import return_tcp, TestSpamdHandler
+
+MSG = 'Subject: test\r\n\r\nbody'
+
+
+class SlowSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        time.sleep(1)
+        TestSpamdHandler.do_CHECK(self)
+
+
+class CountingSpamdHandler(TestSpamdHandler):
+
+    checks = []
+
+    def do_CHECK(self):
+        self.checks.append(1)
+        TestSpamdHandler.do_CHECK(self)
+
+
+class LateSpawn(object):
+    """Thread backend whose second spawn starts late"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.threads = []
+
+    def __getattr__(self, name):
+        return getattr(backend_thread, name)
+
+    def spawn(self, func, *args):
+        delay = self.delay if self.threads else 0
+
+        def run():
+            time.sleep(delay)
+            func(*args)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+
+
+class First(Balancer):
+
+    def select(self, endpoints, stats, exclude=()):
+        return [endpoint for endpoint in endpoints
+                if endpoint not in exclude][0]
+
+
+class TestHedging(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10140)
+        cls.slow_server = ThreadingTCPServer(
+            ('127.0.0.1', 10141), SlowSpamdHandler)
+        cls.slow_server.daemon_threads = True
+        cls.counting_server = ThreadingTCPServer(
+            ('127.0.0.1', 10142), CountingSpamdHandler)
+        cls.counting_server.daemon_threads = True
+        for server in (cls.tcp_server, cls.slow_server, cls.counting_server):
+            t1 = threading.Thread(target=server.serve_forever)
+            t1.setDaemon(True)
+            t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+        cls.slow_server.shutdown()
+        cls.counting_server.shutdown()
+
+    def test_get_endpoint(self):
+        self.assertEqual('a:783', get_endpoint('a').name)
+        self.assertEqual('a:10', get_endpoint('a:10').name)
+        self.assertEqual('a:10', get_endpoint(('a', 10)).name)
+        self.assertEqual('/tmp/s', get_endpoint('/tmp/s').name)
+        endpoint = Endpoint('b')
+        self.assertTrue(get_endpoint(endpoint) is endpoint)
+        self.assertRaises(ValueError, get_endpoint, 10)
+
+    def test_round_robin(self):
+        endpoints = [Endpoint('a'), Endpoint('b'), Endpoint('c')]
+        balancer = RoundRobin()
+        stats = RequestStats('CHECK')
+        self.assertEqual(['a:783', 'b:783', 'c:783', 'a:783'], [
+            balancer.select(endpoints, stats).name for _ in range(4)])
+        for _ in range(4):
+            self.assertNotEqual('a:783', balancer.select(
+                endpoints, stats, exclude=(endpoints[0],)).name)
+
+    def test_spamc_endpoints(self):
+        spamc_tcp = SpamC(endpoints=['127.0.0.1:10140'])
+        self.assertEqual('127.0.0.1:10140', spamc_tcp.endpoint)
+        self.assertEqual('PONG', spamc_tcp.ping()['message'])
+
+    def test_policy(self):
+        policy = HedgePolicy(max_ratio=0.5)
+        self.assertFalse(policy.applies('TELL'))
+        self.assertTrue(policy.applies('CHECK'))
+        self.assertFalse(policy.allow())
+        self.assertTrue(policy.applies('CHECK'))
+        self.assertTrue(policy.allow())
+        self.assertEqual(0.2, HedgePolicy(delay=0.2).delay('a', 10))
+        self.assertEqual(1.0, policy.delay('a', 10, LatencyModel()))
+        model = LatencyModel(min_samples=1)
+        stats = RequestStats('CHECK', endpoint='a')
+        stats.add_phase('wait', 0, 0.1)
+        stats.finish()
+        model.record(stats)
+        self.assertTrue(0.05 < policy.delay('a', 10, model) <= 0.2)
+
+    def _hedged(self, backend):
+        metrics = Metrics()
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10141', '127.0.0.1:10140'],
+            balancer=First(), backend=backend, metrics=metrics,
+            hedging=HedgePolicy(delay=0.1, max_ratio=1.0))
+        start = time.time()
+        result = spamc_tcp.check(MSG)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual('EX_OK', result['message'])
+        self.assertEqual({'hedge': 1}, metrics.hedges)
+        self.assertEqual(1, metrics.latency['127.0.0.1:10140'].count)
+
+    def test_hedged_thread(self):
+        self._hedged('thread')
+
+    def test_hedged_gevent(self):
+        self._hedged('gevent')
+
+    def test_hedged_eventlet(self):
+        self._hedged('eventlet')
+
+    def test_hedged_file(self):
+        with open(__file__) as handle:
+            spamc_tcp = SpamC(
+                endpoints=['127.0.0.1:10141', '127.0.0.1:10140'],
+                balancer=First(),
+                hedging=HedgePolicy(delay=0.1, max_ratio=1.0))
+            self.assertEqual('EX_OK', spamc_tcp.check(handle)['message'])
+
+    def test_no_hedge_when_fast(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10140', '127.0.0.1:10141'],
+            balancer=First(), metrics=metrics,
+            hedging=HedgePolicy(delay=0.5, max_ratio=1.0))
+        spamc_tcp.check(MSG)
+        self.assertEqual({}, metrics.hedges)
+
+    def test_hedge_budget(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10141', '127.0.0.1:10140'],
+            balancer=First(), metrics=metrics,
+            hedging=HedgePolicy(delay=0.05, max_ratio=0.01))
+        start = time.time()
+        spamc_tcp.check(MSG)
+        self.assertTrue(time.time() - start >= 0.9)
+        self.assertEqual({}, metrics.hedges)
+
+    def test_late_hedge(self):
+        backend = LateSpawn(1.5)
+        spamc_tcp = SpamC(
+            endpoints=['127.0.0.1:10141', '127.0.0.1:10142'],
+            balancer=First(), backend=backend,
+            hedging=HedgePolicy(delay=0.1, max_ratio=1.0))
+        self.assertEqual('EX_OK', spamc_tcp.check(MSG)['message'])
+        for thread in backend.threads:
+            thread.join()
+        # the primary won before the hedge started, it never reached spamd
+        self.assertEqual(2, len(backend.threads))
+        self.assertEqual([], CountingSpamdHandler.checks)
+
+    def _aborted(self, spamc_tcp, port, state):
+        stats = RequestStats('CHECK')
+        try:
+            spamc_tcp._request('CHECK', MSG, None, stats,
+                               Endpoint('127.0.0.1', port), None, state)
+        except socket.error as err:
+            return err.args[0]
+
+    def test_aborted_loser(self):
+        spamc_tcp = SpamC(endpoints=['127.0.0.1:10140'])
+        # nothing listens on port 10149, an aborted hedge never connects
+        state = dict(sending=False, aborted=True)
+        self.assertEqual(errno.ECONNABORTED,
+                         self._aborted(spamc_tcp, 10149, state))
+        self.assertNotIn('conn', state)
+        get_connection = spamc_tcp.get_connection
+        state = dict(sending=False)
+
+        def connect(deadline, endpoint):
+            conn = get_connection(deadline, endpoint)
+            state['aborted'] = True
+            return conn
+
+        spamc_tcp.get_connection = connect
+        self.assertEqual(errno.ECONNABORTED,
+                         self._aborted(spamc_tcp, 10140, state))
+        self.assertFalse(state['sending'])
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from cStringIO import StringIO
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.known import BloomFilter, KnownSpam, LearnJournal, \
+    message_digest, known_paths, rebuild
+
+from _s import return_tcp
+
+MSG = 'Subject: buy now\r\n\r\ncheap watches'
+
+
+def digest(num):
+    return hashlib.sha1(str(num)).digest()
+
+
+class TestKnownSpam(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10230)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bloom(self):
+        path = os.path.join(self.directory, 'bloom')
+        bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+        for num in range(1000):
+            bloom.add(digest(num))
+        self.assertTrue(all([digest(num) in bloom for num in range(1000)]))
+        false = len([num for num in range(1000, 11000)
+                     if digest(num) in bloom])
+        self.assertTrue(false < 300)
+        bloom.close()
+        bloom = BloomFilter(path, capacity=10)
+        self.assertTrue(digest(1) in bloom)
+        self.assertEqual(
+            os.path.getsize(path), 16 + bloom.bits // 8)
+        bloom.close()
+        self.assertRaises(ValueError, BloomFilter, __file__)
+
+    def test_journal(self):
+        journal = LearnJournal(os.path.join(self.directory, 'journal'))
+        journal.append('spam', digest(1), now=1)
+        journal.append('spam', digest(2), now=2)
+        journal.append('ham', digest(1), now=3)
+        with open(journal.path, 'ab') as handle:
+            handle.write('4 spam')
+        self.assertEqual(3, len(list(journal)))
+        self.assertEqual({digest(1): False, digest(2): True},
+                         journal.changes())
+        self.assertRaises(ValueError, journal.append, 'eggs', digest(1))
+
+    def test_rebuild(self):
+        known = KnownSpam(self.directory, capacity=100)
+        for num in range(5):
+            known.learn(digest(num), 'spam')
+        known.learn(digest(0), 'forget')
+        self.assertEqual(4, len(known))
+        self.assertEqual(4, rebuild(self.directory))
+        known.learn(digest(1), 'ham')
+        known.learn(digest(7), 'spam')
+        self.assertEqual(4, rebuild(self.directory))
+        known.reload()
+        # a scan in flight keeps using the maps it started with
+        bloom, digests = known.bloom, known.digests
+        known.reload()
+        self.assertIsNot(digests, known.digests)
+        self.assertTrue(digest(2) in bloom and digest(2) in digests)
+        self.assertEqual(0, len(known.changes))
+        self.assertEqual(4, len(known))
+        self.assertEqual([digest(num) for num in (2, 3, 4, 7)],
+                         [digest(num) for num in (0, 1, 2, 3, 4, 7)
+                          if digest(num) in known])
+        self.assertFalse(os.path.exists(
+            known_paths(self.directory)['journal']))
+        reopened = KnownSpam(self.directory)
+        self.assertTrue(digest(7) in reopened)
+
+    def test_scan(self):
+        metrics = Metrics()
+        known = KnownSpam(self.directory)
+        spamc_tcp = SpamC('127.0.0.1', 10230, metrics=metrics, known=known)
+        self.assertNotIn('known', spamc_tcp.check(MSG))
+        spamc_tcp.learn(StringIO(MSG), 'spam')
+        relayed = 'Received: from mx1\r\n' + MSG + '\r\n'
+        result = spamc_tcp.check(relayed)
+        self.assertTrue(result['known'])
+        self.assertTrue(result['isspam'])
+        self.assertNotIn('known', spamc_tcp.symbols(MSG))
+        self.assertEqual(1, metrics.cache['known'])
+        self.assertEqual(3, metrics.latency['127.0.0.1:10230'].count)
+        spamc_tcp.revoke(MSG)
+        self.assertNotIn('known', spamc_tcp.check(MSG))
+        # the journal survives a restart
+        spamc_tcp.learn(MSG, 'spam')
+        self.assertTrue(message_digest(MSG) in KnownSpam(self.directory))
@@ -0,0 +1,95 @@
+import sys
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from spamc import SpamC
+from spamc.stats import RequestStats
+from spamc.metrics import Metrics, Histogram
+from spamc.exceptions import SpamCError
+
+from _s import return_tcp
+
+
+class TestMetrics(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10070)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_histogram_quantile(self):
+        histogram = Histogram((1.0, 2.0, 4.0))
+        self.assertEqual(None, histogram.quantile(0.5))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(4, histogram.count)
+        self.assertEqual([(1.0, 1), (2.0, 3), (4.0, 4), (float('inf'), 4)],
+                         histogram.cumulative())
+        self.assertTrue(1.0 <= histogram.quantile(0.5) <= 2.0)
+
+    def test_record(self):
+        metrics = Metrics()
+        stats = RequestStats('CHECK', endpoint='127.0.0.1:783')
+        stats.tries = 2
+        stats.msg_size = 100
+        stats.compressed_size = 40
+        stats.bytes_sent = 80
+        stats.bytes_received = 30
+        stats.error(SpamCError('x'))
+        stats.finish()
+        metrics.record(stats)
+        self.assertEqual({('CHECK', 'ok'): 1}, metrics.requests)
+        self.assertEqual({'CHECK': 2}, metrics.retries)
+        self.assertEqual(
+            {'spamc.exceptions.SpamCError': 1}, metrics.exceptions)
+        self.assertEqual(0.4, metrics.compression_ratio())
+        text = metrics.render()
+        self.assertIn(
+            'spamc_requests_total{command="CHECK",outcome="ok"} 1', text)
+        self.assertIn('spamc_compression_ratio 0.4', text)
+        self.assertIn(
+            'spamc_request_duration_seconds_bucket{endpoint="127.0.0.1:783"'
+            ',le="+Inf"} 1', text)
+        self.assertIn('# TYPE spamc_request_duration_seconds histogram',
+                      text)
+
+    def test_label_escaping(self):
+        metrics = Metrics()
+        stats = RequestStats('CHECK', endpoint='/tmp/a"b')
+        stats.finish()
+        metrics.record(stats)
+        self.assertIn('endpoint="/tmp/a\\"b"', metrics.render())
+
+    def test_spamc_feeds_metrics(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC(host='127.0.0.1', port=10070, metrics=metrics)
+        spamc_tcp.ping()
+        spamc_tcp.check('Subject: test\r\n\r\nbody')
+        self.assertEqual(1, metrics.requests[('PING', 'ok')])
+        self.assertEqual(1, metrics.requests[('CHECK', 'ok')])
+        self.assertTrue(metrics.bytes_sent > 0)
+        self.assertTrue(metrics.bytes_received > 0)
+        self.assertEqual(2, metrics.latency['127.0.0.1:10070'].count)
+
+    def test_spamc_feeds_metrics_error(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC(host='127.0.0.1', port=10001, metrics=metrics)
+        self.assertRaises(SpamCError, spamc_tcp.ping)
+        self.assertEqual(1, metrics.requests[('PING', 'error')])
+        self.assertEqual(1, metrics.exceptions['socket.error'])
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,137 @@
+import sys
+import struct
+import hashlib
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from cStringIO import StringIO
+from SocketServer import ThreadingTCPServer
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.cache import VerdictCache
+from spamc.neardup import NearDuplicateIndex, fingerprint, distance, \
+    message_body, simhash
+
+from _s import TestSpamdHandler
+
+BODY = ('Dear friend, we are pleased to announce that you have been '
+        'selected to receive a special offer on our finest watches and '
+        'jewellery. Click the link below to claim your discount before '
+        'the offer expires at the end of the week. ')
+MSG = 'Subject: offer\r\nTo: a@example.com\r\n\r\n' + BODY * 3
+SEEN = []
+
+
+class CountingSpamdHandler(TestSpamdHandler):
+
+    def do_CHECK(self):
+        body = self.read_body()
+        SEEN.append(body)
+        self.wfile.write("SPAMD/1.5 0 EX_OK\r\n")
+        if 'borderline' in body:
+            self.wfile.write("Spam: True ; 6 / 5\r\n\r\n")
+        else:
+            self.wfile.write("Spam: True ; 15 / 5\r\n\r\n")
+
+
+class TestNearDuplicate(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = ThreadingTCPServer(
+            ('127.0.0.1', 10220), CountingSpamdHandler)
+        cls.tcp_server.daemon_threads = True
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def setUp(self):
+        del SEEN[:]
+
+    def test_simhash(self):
+        items = ['feature %d' % num for num in range(101)] + [u'caf\xe9']
+        hashes = [struct.unpack('>Q', hashlib.md5(
+            item.encode('utf-8')).digest()[:8])[0] for item in items]
+        expected = 0
+        for bit in range(64):
+            if sum(value >> bit & 1 for value in hashes) * 2 > len(items):
+                expected |= 1 << bit
+        self.assertEqual(expected, simhash(items))
+        self.assertEqual(0, simhash([]))
+
+    def test_fingerprint(self):
+        self.assertEqual(BODY * 3, message_body(MSG))
+        self.assertEqual(BODY * 3, message_body(StringIO(MSG)))
+        self.assertEqual('', message_body('Subject: no body'))
+        self.assertEqual(None, fingerprint('Subject: x\r\n\r\nhi'))
+        value = fingerprint(MSG)
+        mutated = MSG.replace('Dear friend', 'Dear customer 8812', 1) + \
+            ' ref 5f3a9c http://x.example.com/8812'
+        self.assertTrue(distance(value, fingerprint(mutated)) <= 3)
+        self.assertEqual(value, fingerprint(
+            MSG.replace('Subject: offer', 'Subject: other')))
+        other = 'Subject: hi\r\n\r\n' + \
+            'the quarterly report is attached please review the numbers ' \
+            'and send your comments to the finance team by friday ' * 2
+        self.assertTrue(distance(value, fingerprint(other)) > 3)
+
+    def test_index(self):
+        index = NearDuplicateIndex(max_distance=3, max_entries=2)
+        result = dict(score=15.0, basescore=5.0)
+        index.add(0, result)
+        self.assertEqual((0, result), index.lookup(0))
+        self.assertEqual((2, result), index.lookup(0b101 << 40))
+        self.assertEqual((None, None), index.lookup(0b1111))
+        self.assertTrue(index.match(1)['approximate'])
+        self.assertEqual(1, index.match(1)['distance'])
+        index.add(0xffff, dict(score=5.5, basescore=5.0))
+        self.assertEqual(None, index.match(0xffff))
+        index.add(0xffff0000, result)
+        self.assertEqual(2, len(index))
+        self.assertEqual((None, None), index.lookup(0))
+        self.assertFalse([bucket for band in index.buckets
+                          for bucket in band.values() if 0 in bucket])
+
+    def test_reuse(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC('127.0.0.1', 10220, metrics=metrics,
+                          neardup=NearDuplicateIndex())
+        result = spamc_tcp.check(MSG)
+        self.assertFalse(result.get('approximate'))
+        result = spamc_tcp.check(MSG.replace('friend', 'friend 1234'))
+        self.assertTrue(result['approximate'])
+        self.assertEqual(15.0, result['score'])
+        self.assertEqual(1, len(SEEN))
+        self.assertEqual(1, metrics.cache['near'])
+        self.assertEqual(1, metrics.latency['127.0.0.1:10220'].count)
+        self.assertFalse(spamc_tcp.symbols(
+            MSG.replace('friend', 'friend 1234')).get('approximate'))
+
+    def test_margin(self):
+        spamc_tcp = SpamC('127.0.0.1', 10220,
+                          neardup=NearDuplicateIndex())
+        msg = MSG + ' borderline'
+        spamc_tcp.check(msg)
+        result = spamc_tcp.check(msg + ' 42')
+        self.assertFalse(result.get('approximate'))
+        self.assertEqual(2, len(SEEN))
+
+    def test_cache(self):
+        cache = VerdictCache()
+        spamc_tcp = SpamC('127.0.0.1', 10220, cache=cache,
+                          neardup=NearDuplicateIndex())
+        spamc_tcp.check(MSG)
+        mutated = MSG.replace('friend', 'friend 1234')
+        self.assertTrue(spamc_tcp.check(mutated)['approximate'])
+        self.assertEqual(1, len(cache))
+        self.assertEqual(1, len(SEEN))
@@ -0,0 +1,130 @@
+import sys
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from StringIO import StringIO
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.prefilter import PreFilter, Rule, HeaderMatcher, \
+    compile_rule, read_headers
+
+from _s import return_tcp
+
+RELAY = 'Received: from mail.example.com by relay.example.com\r\n'
+HEADERS = ('Return-Path: <alice@mail.example.com>\r\n'
+           'X-Spam-Status: No, score=-1.2 required=5.0\r\n' + RELAY +
+           'From: Alice <alice@mail.example.com>\r\n'
+           'Subject: hello\r\n'
+           ' world\r\n\r\n')
+MSG = HEADERS + 'Subject: not a header\r\n' + 'body\r\n' * 200
+RULES = [
+    dict(name='relay-spam', header='X-Spam-Status', regex=r'^Yes\b',
+         relay=r'\bby relay\.example\.com\b', verdict='spam'),
+    dict(name='relay-ham', header='X-Spam-Status', regex=r'^No\b',
+         relay=r'\bby relay\.example\.com\b'),
+    dict(name='internal', sender_domains=['example.com'],
+         sender_header='Return-Path', max_size=1024),
+]
+
+
+class RecordingFile(StringIO):
+
+    def __init__(self, value):
+        StringIO.__init__(self, value)
+        self.furthest = 0
+
+    def readline(self, size=-1):
+        line = StringIO.readline(self, size)
+        self.furthest = max(self.furthest, self.tell())
+        return line
+
+
+class TestPreFilter(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10240)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def test_read_headers(self):
+        msg = RecordingFile(MSG)
+        headers = read_headers(msg)
+        self.assertEqual(len(HEADERS), msg.furthest)
+        self.assertEqual(0, msg.tell())
+        self.assertEqual(['hello\r\n world'], headers.get_all('Subject'))
+        self.assertEqual(None, read_headers('\r\nX: y')['X'])
+
+    def test_matchers(self):
+        headers = read_headers(MSG)
+        self.assertTrue(HeaderMatcher('subject')(headers, 0))
+        self.assertTrue(HeaderMatcher('Subject', equals='Hello World')(
+            headers, 0))
+        self.assertFalse(HeaderMatcher('X-Other')(headers, 0))
+        self.assertTrue(HeaderMatcher('X-Other', present=False)(headers, 0))
+        tags = read_headers('X-Tag: a\r\nX-Tag: b\r\n\r\n')
+        self.assertTrue(HeaderMatcher('X-Tag', equals='b')(tags, 0))
+        self.assertFalse(HeaderMatcher('X-Tag', equals='b', topmost=True)(
+            tags, 0))
+        rule = compile_rule(RULES[2])
+        self.assertTrue(rule(headers, 1024))
+        self.assertFalse(rule(headers, 1025))
+        other = read_headers('Return-Path: <bob@example.org>\r\n\r\n')
+        self.assertFalse(rule(other, 0))
+        self.assertFalse(rule(read_headers(''), 0))
+        self.assertRaises(ValueError, compile_rule, dict(name='x'))
+        self.assertRaises(ValueError, compile_rule,
+                          dict(name='x', header='X', bogus=1))
+        self.assertRaises(ValueError, Rule, 'x', [], 'eggs')
+
+    def test_check(self):
+        prefilter = PreFilter(RULES)
+        result = prefilter.check(MSG)
+        self.assertEqual('relay-ham', result['prefiltered'])
+        self.assertFalse(result['isspam'])
+        result = prefilter.check(MSG.replace('No, score', 'Yes, score'))
+        self.assertEqual('relay-spam', result['prefiltered'])
+        self.assertEqual(100.0, result['score'])
+        msg = MSG.replace('X-Spam-Status', 'X-Other')
+        self.assertEqual(None, prefilter.check(msg))
+        self.assertEqual('internal',
+                         prefilter.check(HEADERS.replace(
+                             'X-Spam-Status', 'X-Other'))['prefiltered'])
+
+    def test_forged_stamp(self):
+        prefilter = PreFilter(RULES)
+        forged = 'X-Spam-Status: No, score=-9.0 required=5.0\r\n'
+        # a copy the sender put below the relay stamp is ignored
+        msg = MSG.replace('No, score=-1.2', 'Yes, score=9.0').replace(
+            RELAY, RELAY + forged)
+        self.assertEqual('relay-spam', prefilter.check(msg)['prefiltered'])
+        prefilter = PreFilter(RULES[1:])
+        self.assertEqual(None, prefilter.check(msg))
+        # so is one in mail that never went through the relay
+        msg = MSG.replace(RELAY, '').replace(
+            'X-Spam-Status: No, score=-1.2 required=5.0\r\n', forged)
+        self.assertEqual(None, prefilter.check(msg))
+        msg = MSG.replace(RELAY, 'Received: by mx.example.org\r\n')
+        self.assertEqual(None, prefilter.check(msg))
+
+    def test_scan(self):
+        metrics = Metrics()
+        spamc_tcp = SpamC('127.0.0.1', 10240, metrics=metrics,
+                          prefilter=PreFilter(RULES))
+        self.assertEqual('relay-ham',
+                         spamc_tcp.check(StringIO(MSG))['prefiltered'])
+        self.assertNotIn('prefiltered', spamc_tcp.symbols(MSG))
+        self.assertNotIn('prefiltered', spamc_tcp.check('Subject: x\r\n\r\n'))
+        self.assertEqual(1, metrics.cache['prefilter'])
+        self.assertEqual(2, metrics.latency['127.0.0.1:10240'].count)
@@ -0,0 +1,104 @@
+import os
+import sys
+import signal
+import tempfile
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+import gevent
+
+from spamc import SpamC
+from spamc.profiler import Profiler, OTHER_STACK
+
+from _s import return_tcp
+
+
+def busy(depth):
+    if depth:
+        return busy(depth - 1)
+    return sum([len(str(num)) for num in range(2000)])
+
+
+class TestProfiler(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10100)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_every_nth(self):
+        profiler = Profiler(every=3)
+        for _ in range(7):
+            self.assertTrue(profiler.call(busy, 2) > 0)
+        self.assertEqual(2, profiler.profiled)
+        self.assertEqual(None, sys.getprofile())
+
+    def test_collapsed(self):
+        profiler = Profiler(every=1)
+        profiler.call(busy, 2)
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        stacks = [line.rsplit(' ', 1)[0] for line in lines]
+        self.assertTrue([stack for stack in stacks
+                         if stack.count('busy') == 3])
+        for line in lines:
+            self.assertTrue(int(line.rsplit(' ', 1)[1]) > 0)
+        profiler.reset()
+        self.assertEqual('', profiler.collapsed())
+
+    def test_signal_dump(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        previous = signal.getsignal(signal.SIGUSR2)
+        try:
+            profiler = Profiler(every=1)
+            profiler.install_signal(path)
+            profiler.call(busy, 1)
+            # as if the signal came in while stacks were being merged
+            with profiler._lock:
+                os.kill(os.getpid(), signal.SIGUSR2)
+            with open(path) as handle:
+                self.assertIn('busy', handle.read())
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
+            os.remove(path)
+
+    def test_greenlets(self):
+        profiler = Profiler(every=1)
+
+        def nap():
+            gevent.sleep(0.05)
+            return busy(1)
+
+        greenlets = [gevent.spawn(profiler.profile, nap) for _ in range(2)]
+        gevent.joinall(greenlets)
+        self.assertTrue(all([greenlet.value for greenlet in greenlets]))
+        self.assertEqual(None, sys.getprofile())
+        self.assertEqual(1, profiler.profiled)
+        self.assertIn(OTHER_STACK, profiler.stacks)
+        profiler.call(busy, 1)
+        self.assertEqual(2, profiler.profiled)
+
+    def test_spamc_profiler(self):
+        profiler = Profiler(every=2)
+        spamc_tcp = SpamC(host='127.0.0.1', port=10100, profiler=profiler)
+        for _ in range(4):
+            spamc_tcp.check('Subject: test\r\n\r\nbody')
+        self.assertEqual(2, profiler.profiled)
+        self.assertIn('get_response', profiler.collapsed())
+
+
+if __name__ == '__main__':
+    unittest2.main()
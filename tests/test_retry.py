@@ -0,0 +1,89 @@
+import sys
+import errno
+import socket
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+import mock
+
+from spamc import SpamC
+from spamc.exceptions import SpamCError
+from spamc.retry import RetryPolicy, RetryBudget
+
+RESET = socket.error(errno.ECONNRESET, 'reset')
+
+
+class TestRetry(unittest2.TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(base=0.1, cap=1.0)
+        delay = None
+        for _ in range(50):
+            delay = policy.backoff(delay)
+            self.assertTrue(0.1 <= delay <= 1.0)
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_tries=2)
+        self.assertTrue(policy.should_retry('CHECK', RESET, 0, True))
+        self.assertFalse(policy.should_retry('CHECK', RESET, 2, True))
+        self.assertFalse(policy.should_retry(
+            'CHECK', socket.error(errno.ECONNREFUSED, 'refused'), 0, True))
+        self.assertFalse(policy.should_retry(
+            'CHECK', socket.error('xxxx'), 0, True))
+
+    def test_tell_not_retried_once_sent(self):
+        policy = RetryPolicy()
+        self.assertFalse(policy.should_retry('TELL', RESET, 0, True))
+        self.assertTrue(policy.should_retry('TELL', RESET, 0, False))
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0)
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        policy = RetryPolicy(budget=budget)
+        self.assertFalse(policy.should_retry('CHECK', RESET, 0, True))
+        policy.request()
+        policy.request()
+        self.assertTrue(policy.should_retry('CHECK', RESET, 0, True))
+
+    def test_spamc_retries(self):
+        with mock.patch.object(SpamC, 'get_connection') as mock_conn:
+            mock_conn.return_value.send.side_effect = RESET
+            policy = RetryPolicy(max_tries=3, base=0.001, cap=0.01)
+            spamc_tcp = SpamC(host='127.0.0.1', port=10001,
+                              retry_policy=policy)
+            self.assertRaises(SpamCError, spamc_tcp.ping)
+            self.assertEqual(4, mock_conn.call_count)
+
+    def test_spamc_tell_not_retried(self):
+        with mock.patch.object(SpamC, 'get_connection') as mock_conn:
+            mock_conn.return_value.send.side_effect = RESET
+            policy = RetryPolicy(max_tries=3, base=0.001, cap=0.01)
+            spamc_tcp = SpamC(host='127.0.0.1', port=10001,
+                              retry_policy=policy)
+            self.assertRaises(SpamCError, spamc_tcp.learn, 'xxx', 'spam')
+            self.assertEqual(1, mock_conn.call_count)
+
+    def test_spamc_budget(self):
+        with mock.patch.object(SpamC, 'get_connection') as mock_conn:
+            mock_conn.side_effect = RESET
+            budget = RetryBudget(ratio=0.5, min_per_second=0)
+            policy = RetryPolicy(max_tries=10, base=0.001, cap=0.01,
+                                 budget=budget)
+            spamc_tcp = SpamC(host='127.0.0.1', port=10001,
+                              retry_policy=policy)
+            for _ in range(4):
+                self.assertRaises(SpamCError, spamc_tcp.ping)
+            # 4 requests, 2 retries allowed by the budget
+            self.assertEqual(6, mock_conn.call_count)
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,149 @@
+import sys
+import time
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from cStringIO import StringIO
+
+from spamc import SpamC
+from spamc.metrics import Metrics
+from spamc.stats import RequestStats
+from spamc.endpoints import Endpoint
+from spamc.limits import AdmissionControl
+from spamc.shedding import LoadShedder, NOT_SCANNED, not_scanned
+
+from _s import return_tcp
+
+MSG = 'Subject: test\r\n\r\nbody'
+
+
+def done_stats(duration, err=None):
+    stats = RequestStats('CHECK', endpoint='a:1')
+    stats.finish(err)
+    stats.duration = duration
+    return stats
+
+
+class TestShedding(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10190)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tcp_server.shutdown()
+
+    def test_not_scanned(self):
+        result = not_scanned('CHECK')
+        self.assertEqual(NOT_SCANNED, result['message'])
+        self.assertTrue(result['shed'])
+        self.assertFalse(result['isspam'])
+        spamc_tcp = SpamC('127.0.0.1', 10190)
+        real = spamc_tcp.check(MSG)
+        self.assertEqual(set(real) | set(['shed']), set(result))
+        self.assertEqual(MSG + '\r\n',
+                         not_scanned('PROCESS', StringIO(MSG))['message'])
+
+    def test_not_overloaded(self):
+        shedder = LoadShedder(fraction=1.0, latency_slo=1.0, error_rate=0.5)
+        self.assertFalse(shedder.should_shed('CHECK', 10 ** 7, True))
+        shedder.record(done_stats(0.1))
+        self.assertFalse(shedder.overloaded())
+
+    def test_latency_slo(self):
+        shedder = LoadShedder(fraction=0.0, latency_slo=1.0, max_size=1000)
+        shedder.record(done_stats(5.0))
+        self.assertTrue(shedder.overloaded())
+        self.assertFalse(shedder.should_shed('CHECK', 100))
+        self.assertTrue(shedder.should_shed('CHECK', 10000))
+        self.assertTrue(shedder.should_shed('CHECK', 100, high_risk=True))
+        self.assertFalse(shedder.should_shed('TELL', 10000))
+        self.assertEqual((3, 2), (shedder.requests, shedder.shed))
+
+    def test_ignore_local_answers(self):
+        shedder = LoadShedder(latency_slo=1.0, alpha=0.5)
+        shedder.record(done_stats(3.0))
+        for name in ('hit', 'near', 'known', 'prefilter', 'classifier'):
+            stats = done_stats(0.0)
+            stats.cache = name
+            shedder.record(stats)
+        stats = done_stats(0.0)
+        stats.coalesced = True
+        shedder.record(stats)
+        stats = done_stats(0.0)
+        stats.endpoint = None
+        shedder.record(stats)
+        self.assertEqual(3.0, shedder.latency)
+        stats = done_stats(1.0)
+        stats.cache = 'miss'
+        shedder.record(stats)
+        self.assertEqual(2.0, shedder.latency)
+
+    def test_error_rate(self):
+        shedder = LoadShedder(error_rate=0.15, alpha=0.1)
+        shedder.record(done_stats(0.1, ValueError('x')))
+        self.assertFalse(shedder.overloaded())
+        shedder.record(done_stats(0.1, ValueError('x')))
+        self.assertTrue(shedder.overloaded())
+
+    def test_queue_depth(self):
+        admission = AdmissionControl(limit=1, queue_timeout=0.5)
+        shedder = LoadShedder(queue_threshold=1, admission=admission)
+        endpoint = Endpoint('a', 1)
+        admission.acquire(endpoint)
+        self.assertFalse(shedder.overloaded())
+        waiter = threading.Thread(target=admission.acquire,
+                                  args=(endpoint,))
+        waiter.start()
+        try:
+            for _ in range(100):
+                if admission.snapshot()['a:1']['waiting']:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(shedder.overloaded())
+        finally:
+            admission.release(endpoint)
+            waiter.join()
+
+    def test_recovery(self):
+        shedder = LoadShedder(fraction=1.0, latency_slo=0.5, alpha=0.5,
+                              probe_interval=0.05)
+        spamc_tcp = SpamC('127.0.0.1', 10190, shedder=shedder)
+        shedder.latency = 10.0
+        self.assertTrue(spamc_tcp.check(MSG)['shed'])
+        for _ in range(200):
+            if not shedder.overloaded():
+                break
+            spamc_tcp.check(MSG)
+            time.sleep(0.01)
+        self.assertFalse(shedder.overloaded())
+        self.assertNotIn('shed', spamc_tcp.check(MSG))
+
+    def test_client(self):
+        metrics = Metrics()
+        shedder = LoadShedder(fraction=1.0, latency_slo=0.5)
+        spamc_tcp = SpamC('127.0.0.1', 10190, metrics=metrics,
+                          shedder=shedder)
+        self.assertEqual('EX_OK', spamc_tcp.check(MSG)['message'])
+        shedder.latency = 1.0
+        result = spamc_tcp.check(MSG)
+        self.assertEqual(NOT_SCANNED, result['message'])
+        self.assertEqual('PONG', spamc_tcp.ping()['message'])
+        self.assertEqual({('CHECK', 'ok'): 1, ('CHECK', 'shed'): 1,
+                          ('PING', 'ok'): 1}, metrics.requests)
+        # the shed request never reached spamd
+        self.assertEqual(2, metrics.latency['127.0.0.1:10190'].count)
+        text = metrics.render()
+        self.assertIn('spamc_overloaded 1', text)
+        self.assertIn('spamc_shed_fraction 1.0', text)
+        self.assertIn(
+            'spamc_requests_total{command="CHECK",outcome="shed"} 1', text)
@@ -0,0 +1,86 @@
+import sys
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from spamc import SpamC
+from spamc.stats import RequestStats
+from spamc.slowlog import SlowLog, format_record
+from spamc.utils import TokenBucket
+
+from _s import return_tcp
+
+
+def slow_stats(duration=2.0):
+    stats = RequestStats('CHECK', 'exim', '127.0.0.1:783')
+    stats.add_phase('wait', 0.0, duration)
+    stats.finish()
+    stats.duration = duration
+    return stats
+
+
+class TestSlowLog(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10080)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_threshold(self):
+        records = []
+        slowlog = SlowLog(threshold=1.0, emit=records.append)
+        slowlog.record(slow_stats(0.5))
+        self.assertEqual([], records)
+        slowlog.record(slow_stats(2.0))
+        self.assertEqual(1, len(records))
+        self.assertEqual('CHECK', records[0]['cmd'])
+        self.assertEqual('exim', records[0]['user'])
+        self.assertEqual(2.0, records[0]['phases']['wait'])
+        self.assertIn('wait=2.000000', format_record(records[0]))
+
+    def test_rate_limit(self):
+        records = []
+        slowlog = SlowLog(threshold=0, rate=0.001, burst=1,
+                          emit=records.append)
+        for _ in range(5):
+            slowlog.record(slow_stats())
+        self.assertEqual(1, len(records))
+        self.assertEqual(4, slowlog.suppressed)
+
+    def test_sampling(self):
+        records = []
+        slowlog = SlowLog(threshold=0, sample_rate=0.0, emit=records.append)
+        slowlog.record(slow_stats())
+        self.assertEqual([], records)
+        self.assertEqual(1, slowlog.suppressed)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(0.001, 2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_spamc_phases(self):
+        records = []
+        spamc_tcp = SpamC(host='127.0.0.1', port=10080,
+                          slowlog=SlowLog(threshold=0, emit=records.append))
+        spamc_tcp.check('Subject: test\r\n\r\nbody')
+        self.assertEqual(1, len(records))
+        for phase in ('connect', 'send', 'wait', 'parse'):
+            self.assertIn(phase, records[0]['phases'])
+        self.assertEqual('127.0.0.1:10080', records[0]['endpoint'])
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -43,15 +43,13 @@ class TestSpamCTCP(unittest2.TestCase):
 
     def test_spamc_tcp_exp1(self):
         with mock.patch.object(SpamC, 'get_connection') as mock_conn:
-            mock_conn.return_value.socket.return_value.makefile\
-                .return_value.read.return_value = ''
+            mock_conn.return_value.read.return_value = ''
             spamc_tcp = SpamC(
                 host='127.0.0.1',
                 port=10060)
             with self.assertRaises(SpamCResponseError):
                 spamc_tcp.ping()
-            mock_conn.return_value.socket.return_value.makefile\
-                .return_value.read.assert_called_once_with()
+            mock_conn.return_value.read.assert_called_once_with()
 
     def test_spamc_tcp_exp2(self):
         with mock.patch.object(SpamC, 'get_connection') as mock_conn:
@@ -0,0 +1,118 @@
+import sys
+import time
+import errno
+import socket
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+import mock
+
+from SocketServer import ThreadingTCPServer
+
+from spamc import SpamC
+from spamc.conn import deadline_timeout
+from spamc.exceptions import SpamCTimeOutError
+
+from _s import TestSpamdHandler
+
+
+class TrickleSpamdHandler(TestSpamdHandler):
+
+    def do_PING(self):
+        try:
+            for _ in range(40):
+                self.wfile.write(' ')
+                self.wfile.flush()
+                time.sleep(0.1)
+        except socket.error:
+            # the client gave up
+            self.close_connection = 1
+            return
+        TestSpamdHandler.do_PING(self)
+
+
+class TestTimeouts(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # accepts connections in the kernel backlog but never answers
+        cls.silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        cls.silent.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        cls.silent.bind(('127.0.0.1', 10120))
+        cls.silent.listen(50)
+        cls.trickle = ThreadingTCPServer(
+            ('127.0.0.1', 10121), TrickleSpamdHandler)
+        cls.trickle.daemon_threads = True
+        t1 = threading.Thread(target=cls.trickle.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.silent.close()
+        cls.trickle.shutdown()
+
+    def test_defaults(self):
+        spamc_tcp = SpamC(host='127.0.0.1', port=10120, timeout=3,
+                          read_timeout=5)
+        self.assertEqual(3, spamc_tcp.connect_timeout)
+        self.assertEqual(3, spamc_tcp.send_timeout)
+        self.assertEqual(5, spamc_tcp.read_timeout)
+        self.assertEqual(None, spamc_tcp.total_timeout)
+
+    def test_deadline_timeout(self):
+        self.assertEqual(None, deadline_timeout(None, None))
+        self.assertEqual(2, deadline_timeout(2, time.time() + 60))
+        self.assertTrue(deadline_timeout(None, time.time() + 60) <= 60)
+        self.assertTrue(deadline_timeout(60, time.time() + 1) <= 1)
+        self.assertRaises(socket.timeout, deadline_timeout, 2,
+                          time.time() - 1)
+
+    def _read_timeout(self, backend):
+        spamc_tcp = SpamC(host='127.0.0.1', port=10120, read_timeout=0.2,
+                          backend=backend)
+        start = time.time()
+        self.assertRaises(SpamCTimeOutError, spamc_tcp.ping)
+        self.assertTrue(time.time() - start < 2)
+
+    def test_read_timeout_thread(self):
+        self._read_timeout('thread')
+
+    def test_read_timeout_gevent(self):
+        self._read_timeout('gevent')
+
+    def test_read_timeout_eventlet(self):
+        self._read_timeout('eventlet')
+
+    def test_total_timeout(self):
+        spamc_tcp = SpamC(host='127.0.0.1', port=10120, read_timeout=10,
+                          total_timeout=0.3)
+        start = time.time()
+        self.assertRaises(SpamCTimeOutError, spamc_tcp.ping)
+        self.assertTrue(time.time() - start < 2)
+
+    def test_total_timeout_trickle(self):
+        spamc_tcp = SpamC(host='127.0.0.1', port=10121, read_timeout=10,
+                          total_timeout=1.0)
+        start = time.time()
+        self.assertRaises(SpamCTimeOutError, spamc_tcp.ping)
+        self.assertTrue(time.time() - start < 1.5)
+
+    def test_total_timeout_retries(self):
+        with mock.patch.object(SpamC, 'get_connection') as mock_conn:
+            mock_conn.side_effect = socket.error(errno.ECONNRESET, 'reset')
+            spamc_tcp = SpamC(host='127.0.0.1', port=10120, wait_tries=0.1,
+                              max_tries=100, total_timeout=0.35)
+            start = time.time()
+            self.assertRaises(SpamCTimeOutError, spamc_tcp.ping)
+            self.assertTrue(time.time() - start < 1)
+            self.assertTrue(mock_conn.call_count < 10)
+
+
+if __name__ == '__main__':
+    unittest2.main()
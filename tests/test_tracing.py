@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+try:
+    import unittest2
+except ImportError:
+    if sys.version_info < (2, 7):
+        raise
+    import unittest as unittest2
+
+from spamc import SpamC
+from spamc.exceptions import SpamCError
+from spamc.tracing import Tracer, SpanTracer, JSONLinesExporter, NOOP_SPAN
+
+from _s import return_tcp
+
+
+class ListExporter(object):
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class TestTracing(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tcp_server = return_tcp(10090)
+        t1 = threading.Thread(target=cls.tcp_server.serve_forever)
+        t1.setDaemon(True)
+        t1.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        if hasattr(cls, 'tcp_server'):
+            cls.tcp_server.shutdown()
+
+    def test_noop_tracer(self):
+        span = Tracer().start_span('CHECK')
+        self.assertTrue(span is NOOP_SPAN)
+        self.assertTrue(span.child('connect') is NOOP_SPAN)
+
+    def test_spans(self):
+        exporter = ListExporter()
+        spamc_tcp = SpamC(host='127.0.0.1', port=10090,
+                          tracer=SpanTracer(exporter))
+        spamc_tcp.check('Subject: test\r\n\r\nbody', correlation_id='abc')
+        names = [span.name for span in exporter.spans]
+        self.assertEqual('CHECK', names[-1])
+        self.assertEqual('attempt', names[-2])
+        for phase in ('connect', 'send', 'wait', 'parse'):
+            self.assertIn(phase, names)
+        root = exporter.spans[-1]
+        attempt = exporter.spans[-2]
+        self.assertEqual(['abc'], list(set(
+            [span.trace_id for span in exporter.spans])))
+        self.assertEqual(root.span_id, attempt.parent_id)
+        for span in exporter.spans[:-2]:
+            self.assertEqual(attempt.span_id, span.parent_id)
+        self.assertEqual('ok', root.attributes['outcome'])
+
+    def test_error_span(self):
+        exporter = ListExporter()
+        spamc_tcp = SpamC(host='127.0.0.1', port=10001,
+                          tracer=SpanTracer(exporter))
+        self.assertRaises(SpamCError, spamc_tcp.ping)
+        root = exporter.spans[-1]
+        self.assertEqual('PING', root.name)
+        self.assertIn('SpamCError', root.error)
+        self.assertIn('error', exporter.spans[-2].error)
+
+    def test_json_lines_exporter(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            exporter = JSONLinesExporter(path)
+            spamc_tcp = SpamC(host='127.0.0.1', port=10090,
+                              tracer=SpanTracer(exporter))
+            spamc_tcp.ping(correlation_id='xyz')
+            exporter.close()
+            with open(path) as handle:
+                spans = [json.loads(line) for line in handle]
+            self.assertEqual('PING', spans[-1]['name'])
+            self.assertEqual('xyz', spans[-1]['trace_id'])
+            self.assertEqual(None, spans[-1]['parent_id'])
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest2.main()